@@ -59,6 +59,12 @@ setup(
             'odspt = udata_front.harvesters.odspt:OdsBackendPT',
             'dgt = udata_front.harvesters.dgt:DGTBackend'
         ],
+        'udata.tasks': [
+            'front_harvesters = udata_front.harvesters.tasks',
+        ],
+        'udata.commands': [
+            'front_harvesters = udata_front.harvesters.commands',
+        ],
         'udata.views': [
             'gouvfr_faqs = udata_front.faqs_plugin',
             'gouvfr_saml = udata_front.saml_plugin',
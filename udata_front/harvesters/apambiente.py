@@ -2,51 +2,70 @@ from datetime import datetime
 import requests
 from urllib.parse import urlparse, urlencode
 
-from udata.harvest.backends.base import BaseBackend
-from udata.models import Resource, Dataset, License
+from udata.models import Dataset
 from owslib.csw import CatalogueServiceWeb
+from owslib.fes import PropertyIsGreaterThanOrEqualTo
 
 from udata.harvest.models import HarvestItem
 
+from .base import PTBaseBackend
+from .tools.resources import ResourceReconciler
+
 # backend = 'https://sniambgeoportal.apambiente.pt/geoportal/csw'
 
 
-class PortalAmbienteBackend(BaseBackend):
+class PortalAmbienteBackend(PTBaseBackend):
     display_name = 'Harvester Portal do Ambiente'
+    incremental = True
 
-    def inner_harvest(self):
-        startposition = 0
-        csw = CatalogueServiceWeb(self.source.url)
-        csw.getrecords2(maxrecords=1)
-        matches = csw.results.get("matches")
+    # Number of records requested per GetRecords call
+    PAGE_SIZE = 100
 
-        while startposition <= matches:
-            csw.getrecords2(maxrecords=100, startposition=startposition)
-            startposition = csw.results.get('nextrecord')
-            for rec in csw.records:
+    def iter_datasets(self):
+        for position, records in self.prefetch(self.iter_pages(self.cursor or 0)):
+            self.checkpoint(position)
+            for record in records:
+                self.track_modified(record.modified)
                 item = {}
-                record = csw.records[rec]
                 item["id"] = record.identifier
                 item["title"] = record.title
                 item["description"] = record.abstract
                 item["url"] = record.references[0].get('url')
                 item["type"] = record.type
-                # self.add_item(record.identifier, title=record.title, date=None, item=item)
-                self.process_dataset(record.identifier, title=record.title, date=None, items=item)
+                yield record.identifier, {'title': record.title, 'date': None, 'items': item}
+
+    def iter_pages(self, startposition=0):
+        '''Yield the start position and the records of each GetRecords page'''
+        csw = CatalogueServiceWeb(self.source.url)
+        constraints = []
+        if self.since:
+            # Only list records modified since the last harvest
+            constraints.append(PropertyIsGreaterThanOrEqualTo(
+                'dct:modified', self.since.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        csw.getrecords2(constraints=constraints, maxrecords=1)
+        matches = csw.results.get("matches")
+
+        while startposition <= matches:
+            csw.getrecords2(constraints=constraints, maxrecords=self.PAGE_SIZE,
+                            startposition=startposition)
+            position, startposition = startposition, csw.results.get('nextrecord')
+            yield position, list(csw.records.values())
+            if not startposition:
+                break
 
     def inner_process_dataset(self, item: HarvestItem, **kwargs):
-        dataset = self.get_dataset(item.remote_id)
         # Here you comes your implementation. You should :
         # - fetch the remote dataset (if necessary)
         # - validate the fetched payload
         # - map its content to the dataset fields
         # - store extra significant data in the `extra` attribute
         # - map resources data
+        dataset = self.get_dataset_if_changed(item, kwargs.get('items'))
         item = kwargs.get('items')
 
         # Set basic dataset fields
         dataset.title = item['title']
-        dataset.license = License.guess('cc-by')
+        dataset.license = self.guess_license('cc-by')
         dataset.tags = ["apambiente.pt"]
         dataset.description = item['description']
 
@@ -55,9 +74,6 @@ class PortalAmbienteBackend(BaseBackend):
 
         dataset.description = item.get('description')
 
-        # Force recreation of all resources
-        dataset.resources = []
-
         url = item.get('url')
 
         if item.get('type') == "liveData":
@@ -67,12 +83,9 @@ class PortalAmbienteBackend(BaseBackend):
             if len(type) > 3:
                 type = "wms"
 
-        new_resource = Resource(
-            title=dataset.title,
-            url=url,
-            filetype='remote',
-            format=type
-        )
-        dataset.resources.append(new_resource)
+        # The resource is matched by URL: kept as is when unchanged
+        resources = ResourceReconciler(dataset, 'url')
+        resources.update(url, title=dataset.title, filetype='remote', format=type)
+        resources.remove_stale()
 
         return dataset
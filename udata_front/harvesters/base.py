@@ -0,0 +1,1003 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import traceback
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+
+from celery import chord
+from dateutil.parser import parse as parse_date
+from flask import current_app
+
+from udata import uris
+from udata.i18n import lazy_gettext as _
+from udata.harvest.backends.base import BaseBackend, HarvestExtraConfig, LogCatcher
+from udata.harvest.exceptions import HarvestSkipException, HarvestValidationError
+from udata.harvest.models import HarvestError, HarvestItem, HarvestJob, HarvestLog
+from udata.frontend.markdown import parse_html
+from udata.models import Dataset, License
+from udata.utils import safe_unicode
+
+from .tools.bulk import BulkWriter, save_changes
+from .tools.datasets import CONTENT_HASH, DatasetIndex
+from .tools.http import HarvestHTTPClient
+from .tools.http_cache import HTTPCache
+from .tools.memoize import LRUCache, content_key
+from .tools.organizations import OrganizationResolver
+from .tools.prefetch import crawl, fetch_as_completed, fetch_ordered, prefetch
+from .tools.stats import StageStats, merge_reports
+
+log = logging.getLogger(__name__)
+
+# Keys stored in `HarvestJob.data`
+HIGH_WATER_MARK = 'high_water_mark'
+LAST_FULL_HARVEST = 'last_full_harvest'
+INCREMENTAL = 'incremental'
+UNCHANGED = 'unchanged'
+CHECKPOINT = 'checkpoint'
+RESUMED_FROM = 'resumed_from'
+RETRY_OF = 'retry_of'
+# Backends may replace `item.remote_id` (ie. a name by an id): the listed one is kept here
+LISTED_ID = 'listed_id'
+SHARDS = 'shards'
+SHARDS_HIGH_WATER_MARK = 'shards_high_water_mark'
+STATS = 'stats'
+
+# `job.data` counters incremented by the items of each shard
+SHARD_COUNTERS = (UNCHANGED,)
+
+
+class HarvestUnchangedException(HarvestSkipException):
+    '''Raised when the remote payload did not change since the last harvest'''
+    def __init__(self, dataset):
+        super().__init__('Unchanged since last harvest')
+        self.dataset = dataset
+
+
+# The result of `inner_process_dataset()` and the log records emitted meanwhile
+MappedItem = namedtuple('MappedItem', ('dataset', 'error', 'records'))
+
+
+def listed_id(item):
+    '''The remote id of `item` as yielded by the listing'''
+    return item.kwargs.get(LISTED_ID) or item.remote_id
+
+
+class ThreadLogCatcher(LogCatcher):
+    '''Only catch the records emitted by the thread which created it'''
+    def __init__(self):
+        super().__init__()
+        self.thread = threading.get_ident()
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            super().emit(record)
+
+
+def to_utc(value):
+    '''Convert a remote date (string or datetime) into a naive UTC datetime'''
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = parse_date(value)
+        except (ValueError, OverflowError):
+            return None
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def get_http_cache():
+    '''The harvesters HTTP cache or `None` if disabled'''
+    config = current_app.config
+    if not config['HARVEST_HTTP_CACHE_SIZE']:
+        return None
+    directory = (config['HARVEST_HTTP_CACHE_DIR']
+                 or os.path.join(current_app.instance_path, 'harvest-cache'))
+    try:
+        return HTTPCache(directory, config['HARVEST_HTTP_CACHE_SIZE'])
+    except OSError as e:
+        # ie. a read-only instance path: harvest without cache
+        log.error('Unable to use the HTTP cache in %s: %s', directory, e)
+        return None
+
+
+class PTBaseBackend(BaseBackend):
+    '''
+    Base class for the dados.gov harvesters.
+
+    Backends only implement `iter_datasets()`, yielding `(remote_id, kwargs)`
+    tuples, and `inner_process_dataset()`.
+
+    Backends able to ask the remote for changed records only set `incremental`
+    and use `since` to filter their listing.
+    Each job stores the highest remote modification date seen (the high-water mark)
+    so the next job only asks for records modified after it.
+    A full harvest is still performed every `HARVEST_FULL_HARVEST_DAYS` days
+    to reconcile deleted datasets.
+
+    Backends call `get_dataset_if_changed()` with the raw remote payload
+    before mapping it: its digest is stored in the `harvest:content_hash` extra
+    and unchanged payloads are not mapped nor saved again.
+    The source datasets are indexed by remote id once per job (see `DatasetIndex`):
+    only the changed ones are loaded.
+
+    Datasets can be written by batches using the `bulk_write_size` extra config.
+    Items stay `started` until their batch is written.
+    Existing datasets only receive updates for their changed fields and resources:
+    backends should update the resources in place (see `ResourceReconciler.update()`)
+    rather than rebuilding them.
+
+    Backends report their listing position with `checkpoint()`:
+    an interrupted job is resumed from there by the next one (see `cursor`),
+    skipping the datasets it already processed.
+    With `retry_failed`, only the items which failed in the previous job are processed.
+
+    With the `shard_size` extra config, the listing is split into shards
+    processed by separate Celery tasks (see `harvest_shard()`), the job
+    being finalized once all of them are done (see `finalize_shards()`).
+    Each shard lists its datasets again from its own listing position
+    unless the backend fetches them by id (see `iter_retry()`)
+    or ships their listing kwargs (see `shard_kwargs()`).
+
+    Paginated listings should use `prefetch()` or `fetch_pages()`
+    so that the next pages are fetched while the current one is processed.
+
+    With the `concurrency` extra config, `inner_process_dataset()` runs in
+    a thread pool: it must not rely on the processing order.
+    Datasets are still persisted one at a time by the harvest thread,
+    other writes must be safe to run concurrently:
+    organizations go through the job `organizations` resolver, whose inserts
+    are arbitrated by acronym claims and whose updates are written at the end
+    of the job (see `OrganizationResolver`), and files are either written
+    under a name of their own (ie. the dados.gov downloads) or behind a lock.
+
+    All HTTP requests should go through `get()`, `post()` and `head()`
+    which use the job pooled, retrying and rate limited client (see `HarvestHTTPClient`).
+    GET responses are revalidated against the on-disk cache (see `HTTPCache`)
+    unless called with `cache=False` or `stream=True`.
+    Backends fetching a document per dataset pass it to `skip_if_cached()`
+    before parsing it.
+
+    Stages (fetch, parse, validate, map, persist...) are timed with `stage()`
+    and each job stores a performance report in `job.data['stats']`.
+
+    Descriptions should be converted with `parse_html()` and licenses found
+    with `guess_license()`: both are memoized for the whole job (see `memoized()`).
+    '''
+    # Whether the backend is able to list only the records modified since a date
+    incremental = False
+
+    # Bump to force a remapping of all datasets when the mapping code changes
+    mapping_version = 1
+
+    # Only process the items which failed in the previous job
+    retry_failed = False
+
+    extra_configs = (
+        HarvestExtraConfig(_('Full harvest interval'), 'full_harvest_days', int,
+                           _('Number of days between two full harvests '
+                             '(0 disables incremental harvesting)')),
+        HarvestExtraConfig(_('Bulk write size'), 'bulk_write_size', int,
+                           _('Number of datasets saved at once '
+                             '(0 saves each dataset individually)')),
+        HarvestExtraConfig(_('Concurrency'), 'concurrency', int,
+                           _('Number of datasets fetched and mapped in parallel')),
+        HarvestExtraConfig(_('Rate limit'), 'rate_limit', float,
+                           _('Maximum number of requests per second to each remote host '
+                             '(0 for no limit)')),
+        HarvestExtraConfig(_('Shard size'), 'shard_size', int,
+                           _('Number of datasets processed by each worker task '
+                             '(0 processes the whole job in a single task)')),
+    )
+
+    # The index of the shard processed by this instance (see `harvest_shard()`)
+    shard = None
+
+    # The shards to dispatch when the listing is sharded (see `split_shards()`)
+    _shards = None
+
+    # The last listing position reported while splitting the shards
+    _listing_cursor = None
+
+    # Whether a shard of this job failed (see `finalize_shards()`)
+    _shard_failed = False
+
+    def inner_harvest(self):
+        shard_size = self.get_config_value('shard_size',
+                                           current_app.config['HARVEST_SHARD_SIZE'])
+        if shard_size and not self.dryrun:
+            # Not `None` while listing: disables the checkpoints
+            self._shards = []
+            self._shards = self.split_shards(self.iter_pending(), shard_size)
+            if self._shards:
+                log.info('Harvest of %s split into %s shards', self.source.name, len(self._shards))
+                return
+            self._shards = None
+        self.process_items(self.iter_pending())
+        self.finalize()
+
+    def process_items(self, datasets):
+        concurrency = self.get_config_value('concurrency',
+                                            current_app.config['HARVEST_CONCURRENCY'])
+        try:
+            if concurrency > 1:
+                self.process_concurrently(datasets, concurrency)
+            else:
+                for remote_id, kwargs in datasets:
+                    self.process_dataset(remote_id, **kwargs)
+                    if self.is_done():
+                        break
+        finally:
+            self.flush_datasets()
+
+    def split_shards(self, datasets, shard_size):
+        '''
+        Split the listing into shards of `shard_size` datasets.
+
+        Only the remote ids and the listing window of each shard are sent to
+        the workers: the `cursor` and `since` to list its datasets again from
+        (see `iter_shard()`). Listing kwargs are only kept if the backend ships
+        them (see `shard_kwargs()`).
+        '''
+        since = self.since.isoformat() if self.since else None
+        shards = []
+        shard = None
+        count = 0
+        for remote_id, kwargs in datasets:
+            if shard is None:
+                # The position reported before listing the first dataset of the shard
+                shard = {'cursor': self._listing_cursor, 'since': since, 'datasets': []}
+            shard['datasets'].append([remote_id, self.shard_kwargs(remote_id, kwargs)])
+            count += 1
+            if len(shard['datasets']) >= shard_size:
+                shards.append(shard)
+                shard = None
+            if self.max_items and count >= self.max_items:
+                break
+        if shard:
+            shards.append(shard)
+        return shards
+
+    def shard_kwargs(self, remote_id, kwargs):
+        '''
+        The listing `kwargs` of a dataset to send with its shard, or `None`.
+
+        By default, only the remote id is sent. Backends whose kwargs
+        are small and JSON serializable, but which can't fetch a dataset
+        from its remote id alone, should return them.
+        '''
+        return None
+
+    def dispatch_shards(self):
+        '''Process each shard in its own task and finalize the job once all are done'''
+        # Tasks depend on the backends registry: avoid a circular import
+        from .tasks import fail_sharded_job, finalize_sharded_job, harvest_shard
+        job_id = str(self.job.id)
+        shards = self._shards
+        self._shards = None
+        chord(
+            harvest_shard.s(job_id, index, shard) for index, shard in enumerate(shards)
+        )(finalize_sharded_job.si(job_id).on_error(fail_sharded_job.si(job_id)))
+
+    def harvest_shard(self, index, shard):
+        '''
+        Process the listed datasets of a shard of the job (see `split_shards()`).
+
+        Shards only append their items and increment the job counters
+        with atomic updates, so they can run in parallel. They are idempotent:
+        items already recorded by a previous attempt are not processed again.
+        '''
+        self.shard = index
+        self.job.reload()
+        recorded = set(listed_id(item) for item in self.job.items)
+        # Only this shard items are kept locally and pushed to the job
+        self.job.items = []
+        self.job.data = {}
+        self._shard_items = 0
+        shard = dict(shard, datasets=[(rid, kwargs) for rid, kwargs in shard['datasets']
+                                      if rid not in recorded])
+        log.info('Processing shard %s of %s: %s datasets',
+                 index, self.job.id, len(shard['datasets']))
+        try:
+            self.process_items(self.iter_shard(shard))
+        finally:
+            if hasattr(self, '_organizations'):
+                self.organizations.flush()
+            summary = {STATS: self.performance_report(self._shard_items + len(self.job.items))}
+            if hasattr(self, '_http'):
+                summary['http'] = self.http.report()
+                self.http.close()
+            self.save_shard(summary)
+
+    def save_shard(self, summary=None):
+        '''Push the finished items of the shard and its counters to the job'''
+        finished = [item for item in self.job.items if item.status != 'started']
+        update = {}
+        if finished:
+            update['$push'] = {'items': {'$each': [item.to_mongo() for item in finished]}}
+            self.job.items = [item for item in self.job.items if item.status == 'started']
+            self._shard_items += len(finished)
+        counters = dict((key, self.job.data.pop(key)) for key in SHARD_COUNTERS
+                        if self.job.data.get(key))
+        if counters:
+            update['$inc'] = dict(('data.' + key, value) for key, value in counters.items())
+        if self._high_water_mark:
+            update['$max'] = {'data.' + SHARDS_HIGH_WATER_MARK: self._high_water_mark}
+        if summary:
+            update['$set'] = {'.'.join(('data', SHARDS, str(self.shard))): summary}
+        if update:
+            HarvestJob._get_collection().update_one({'_id': self.job.id}, update)
+
+    def finalize_shards(self, failed=False):
+        '''
+        Finalize a sharded job once all its shards are processed
+        or, if `failed`, once a shard exhausted its retries.
+
+        A job with a failed shard has not seen every listed dataset:
+        it is finalized as a partial one and marked as failed.
+        '''
+        self.job.reload()
+        self._shard_failed = failed
+        self._high_water_mark = self.job.data.pop(SHARDS_HIGH_WATER_MARK, None)
+        self.finalize()
+        self._shard_reports = [self.job.data.get(STATS) or {}] + [
+            shard.get(STATS) or {} for shard in (self.job.data.get(SHARDS) or {}).values()
+        ]
+        if self.source.autoarchive:
+            self.autoarchive()
+        if failed:
+            self.job.errors.append(HarvestError(message='A shard of the job failed'))
+            self.job.status = 'failed'
+        else:
+            items_failed = any(item.status == 'failed' for item in self.job.items)
+            self.job.status = 'done-errors' if items_failed else 'done'
+        self.end_job()
+
+    @property
+    def http(self):
+        if not hasattr(self, '_http'):
+            config = current_app.config
+            self._http = HarvestHTTPClient(
+                timeout=config['HARVEST_HTTP_TIMEOUT'],
+                retries=config['HARVEST_HTTP_RETRIES'],
+                backoff=config['HARVEST_HTTP_BACKOFF'],
+                pool_size=config['HARVEST_HTTP_POOL_SIZE'],
+                cache=get_http_cache(),
+                limits=self.rate_limits(),
+            )
+        return self._http
+
+    def rate_limits(self):
+        '''The per host limits of the HTTP client (see `AdaptiveLimiter`)'''
+        limits = dict(current_app.config['HARVEST_RATE_LIMIT'] or {})
+        rate = self.get_extra_config_value('rate_limit')
+        if rate is not None:
+            limits['rate'] = rate or None
+        return limits
+
+    def head(self, url, headers=None, **kwargs):
+        with self.stage('fetch'):
+            return self.http.head(url, **self.request_kwargs(headers, kwargs))
+
+    def get(self, url, headers=None, **kwargs):
+        with self.stage('fetch'):
+            return self.http.get(url, **self.request_kwargs(headers, kwargs))
+
+    def post(self, url, data, headers=None, **kwargs):
+        with self.stage('fetch'):
+            return self.http.post(url, data=data, **self.request_kwargs(headers, kwargs))
+
+    @property
+    def stats(self):
+        if not hasattr(self, '_stats'):
+            self._stats = StageStats()
+        return self._stats
+
+    def stage(self, name):
+        '''Time a harvest stage: `with self.stage('parse'): ...`'''
+        return self.stats.time(name)
+
+    def performance_report(self, items=None):
+        '''Stages timings, HTTP totals and throughput of this process'''
+        hosts = self.http.report() if hasattr(self, '_http') else []
+        elapsed = self.stats.elapsed
+        items = len(self.job.items) if items is None else items
+        return {
+            'stages': self.stats.as_dict(),
+            'items': items,
+            'duration': round(elapsed, 3),
+            'items_per_second': round(items / elapsed, 2) if elapsed else None,
+            'requests': sum(host['requests'] for host in hosts),
+            'bytes': sum(host['bytes'] for host in hosts),
+            'caches': dict((name, cache.report()) for name, cache in self._caches.items()),
+        }
+
+    def validate(self, data, schema):
+        with self.stage('validate'):
+            return super().validate(data, schema)
+
+    def request_kwargs(self, headers, kwargs):
+        kwargs['headers'] = dict(headers or {}, **self.get_headers())
+        kwargs['verify'] = kwargs.get('verify', self.verify_ssl)
+        return kwargs
+
+    def iter_datasets(self):
+        '''Yield a `(remote_id, kwargs)` tuple for each remote dataset to process'''
+        raise NotImplementedError
+
+    def iter_pending(self):
+        '''The `(remote_id, kwargs)` to process in this job'''
+        if self.retry_failed:
+            return self.iter_retry(self.failed_remote_ids)
+        datasets = self.iter_datasets()
+        processed = self.resume.get('processed')
+        if processed:
+            datasets = ((rid, kwargs) for rid, kwargs in datasets if rid not in processed)
+        return datasets
+
+    def iter_shard(self, shard):
+        '''The `(remote_id, kwargs)` of a shard (see `split_shards()`)'''
+        datasets = shard['datasets']
+        if datasets and all(kwargs is not None for _, kwargs in datasets):
+            # Shipped with the shard: nothing to list
+            return iter(datasets)
+        # The listing is filtered from the shard position, as if resuming there
+        self._resume = {'cursor': shard['cursor'], 'since': to_utc(shard['since'])}
+        return self.iter_retry([remote_id for remote_id, _ in datasets])
+
+    def iter_retry(self, remote_ids):
+        '''
+        Yield the `(remote_id, kwargs)` of the given `remote_ids` only
+        (the failed items to retry or the datasets of a shard).
+
+        The listing is filtered by default, from the `cursor` if any,
+        and stops once all of them are found: backends able to process
+        a dataset from its remote id alone should override it.
+        '''
+        remaining = set(remote_ids)
+        if not remaining:
+            return
+        for remote_id, kwargs in self.iter_datasets():
+            if remote_id in remaining:
+                remaining.discard(remote_id)
+                yield remote_id, kwargs
+                if not remaining:
+                    return
+
+    def prefetch(self, pages):
+        '''Fetch the next pages in the background while the current one is processed'''
+        return prefetch(pages, current_app.config['HARVEST_PREFETCH_PAGES'],
+                        current_app._get_current_object())
+
+    def fetch_pages(self, fetch, offsets):
+        '''Call `fetch(offset)` in parallel for each offset, yielding the pages in order'''
+        return fetch_ordered(fetch, offsets, current_app.config['HARVEST_PREFETCH_PAGES'],
+                             current_app._get_current_object())
+
+    def fetch_as_completed(self, fetch, args):
+        '''Call `fetch(arg)` in parallel for each arg, yielding `(arg, result)` as they complete'''
+        return fetch_as_completed(fetch, args, current_app.config['HARVEST_PREFETCH_PAGES'],
+                                  current_app._get_current_object())
+
+    def crawl(self, fetch, roots):
+        '''Crawl from `roots` with parallel `fetch(url) -> (urls, values)` calls (see `crawl`)'''
+        return crawl(fetch, roots, current_app.config['HARVEST_PREFETCH_PAGES'],
+                     current_app._get_current_object())
+
+    def process_dataset(self, remote_id: str, **kwargs):
+        item = self.start_item(remote_id)
+        self.finish_item(item, self.map_item(item, **kwargs))
+
+    def process_concurrently(self, datasets, concurrency):
+        '''
+        Map the datasets in a pool of `concurrency` threads.
+
+        Items are created and persisted in the calling thread,
+        only `inner_process_dataset()` runs in the workers.
+        '''
+        app = current_app._get_current_object()
+
+        def map_item(item, kwargs):
+            with app.app_context():
+                return self.map_item(item, **kwargs)
+
+        pending = set()
+        with ThreadPoolExecutor(concurrency, thread_name_prefix='harvest') as executor:
+            try:
+                for remote_id, kwargs in datasets:
+                    item = self.start_item(remote_id)
+                    future = executor.submit(map_item, item, kwargs)
+                    future.item = item
+                    pending.add(future)
+                    # Bound the number of mapped datasets waiting in memory
+                    if len(pending) >= 2 * concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.finish_item(future.item, future.result())
+                    if self.is_done():
+                        break
+            finally:
+                for future in as_completed(pending):
+                    self.finish_item(future.item, future.result())
+
+    def start_item(self, remote_id):
+        log.debug(f'Processing dataset {remote_id}…')
+        item = HarvestItem(status='started', started=datetime.utcnow(), remote_id=remote_id,
+                           kwargs={LISTED_ID: remote_id})
+        self.job.items.append(item)
+        self._item_cursors[id(item)] = self._cursor
+        self.save_job()
+        return item
+
+    def map_item(self, item, **kwargs):
+        '''
+        Fetch and map a remote dataset without writing anything.
+
+        Errors are returned, not raised, so that this can run in a worker thread.
+        '''
+        log_catcher = ThreadLogCatcher()
+        current_app.logger.addHandler(log_catcher)
+        try:
+            if not item.remote_id:
+                raise HarvestSkipException('missing identifier')
+
+            with self.stage('map'):
+                dataset = self.inner_process_dataset(item, **kwargs)
+
+            # Use `item.remote_id` because `inner_process_dataset` could have modified it.
+            dataset.harvest = self.update_dataset_harvest_info(dataset.harvest, item.remote_id)
+            digest = self._digests.pop(item.remote_id, None)
+            if digest:
+                dataset.extras[CONTENT_HASH] = digest
+            else:
+                # Not mapped from a hashed payload: don't keep a stale digest
+                dataset.extras.pop(CONTENT_HASH, None)
+            dataset.archived = None
+            return MappedItem(dataset, None, log_catcher.records)
+        except Exception as e:
+            return MappedItem(None, e, log_catcher.records)
+        finally:
+            self._digests.pop(item.remote_id, None)
+            current_app.logger.removeHandler(log_catcher)
+
+    def finish_item(self, item, mapped):
+        '''Persist a mapped dataset or record its error'''
+        log_catcher = ThreadLogCatcher()
+        try:
+            current_app.logger.addHandler(log_catcher)
+            if mapped.error:
+                raise mapped.error
+            self.persist_dataset(item, mapped.dataset)
+        except HarvestUnchangedException as e:
+            item.dataset = e.dataset
+            item.status = 'done'
+            self.job.data[UNCHANGED] = self.job.data.get(UNCHANGED, 0) + 1
+            log.debug(f'Unchanged item {item.remote_id}')
+        except HarvestSkipException as e:
+            item.status = 'skipped'
+
+            log.info(f'Skipped item {item.remote_id} : {safe_unicode(e)}')
+            item.errors.append(HarvestError(message=safe_unicode(e)))
+        except HarvestValidationError as e:
+            item.status = 'failed'
+
+            log.info(f'Error validating item {item.remote_id} : {safe_unicode(e)}')
+            item.errors.append(HarvestError(message=safe_unicode(e)))
+        except Exception as e:
+            item.status = 'failed'
+            log.exception(f'Error while processing {item.remote_id} : {safe_unicode(e)}')
+
+            error = HarvestError(message=safe_unicode(e), details=traceback.format_exc())
+            item.errors.append(error)
+        finally:
+            current_app.logger.removeHandler(log_catcher)
+            item.ended = datetime.utcnow()
+            item.logs = [
+                HarvestLog(level=record.levelname, message=record.getMessage())
+                for record in mapped.records + log_catcher.records
+            ]
+            if item.status != 'started':  # Not waiting for a bulk write
+                self._item_cursors.pop(id(item), None)
+            self.save_job()
+
+    def persist_dataset(self, item, dataset):
+        if self.dryrun:
+            dataset.validate()
+        elif self.bulk_writer:
+            self.bulk_writer.add(item, dataset)
+            # Status will be set once written
+            item.dataset = dataset
+            return
+        else:
+            with self.stage('persist'):
+                if dataset._created or not dataset.id:
+                    dataset.save()
+                else:
+                    # Only write the changed fields and resources
+                    save_changes(dataset)
+            self.known_datasets.add(item.remote_id, dataset)
+        item.dataset = dataset
+        item.status = 'done'
+
+    @property
+    def bulk_writer(self):
+        if not hasattr(self, '_bulk_writer'):
+            size = self.get_config_value('bulk_write_size',
+                                         current_app.config['HARVEST_BULK_WRITE_SIZE'])
+            self._bulk_writer = BulkWriter(Dataset, size, self.on_dataset_written,
+                                           self.on_dataset_error) if size else None
+        return self._bulk_writer
+
+    def flush_datasets(self):
+        '''Write the pending datasets batch if any'''
+        if self.bulk_writer and self.bulk_writer.pending:
+            with self.stage('persist'):
+                self.bulk_writer.flush()
+            self.save_job()
+
+    def on_dataset_written(self, item, dataset):
+        item.status = 'done'
+        self.known_datasets.add(item.remote_id, dataset)
+        self._item_cursors.pop(id(item), None)
+
+    def on_dataset_error(self, item, dataset, error):
+        self._item_cursors.pop(id(item), None)
+        log.error(f'Error while saving {item.remote_id} : {safe_unicode(error)}')
+        item.status = 'failed'
+        item.dataset = None
+        item.errors.append(HarvestError(message=safe_unicode(error)))
+
+    def finalize(self):
+        '''Called once every listed dataset has been processed'''
+        if self.dryrun:
+            return
+        if hasattr(self, '_organizations'):
+            self.organizations.flush()
+        # The listing went through: nothing to resume
+        self._cursor = None
+        self.job.data.pop(CHECKPOINT, None)
+        previous = self.previous_job_data
+        failed = any(i.status == 'failed' for i in self.job.items)
+        # Partial runs must not move the mark or unseen records would be skipped next time
+        complete = (not failed and not self.max_items and not self.resume
+                    and not self.retry_failed and not self._shard_failed)
+        if complete and self._high_water_mark:
+            self.job.data[HIGH_WATER_MARK] = self._high_water_mark
+        elif previous.get(HIGH_WATER_MARK):
+            self.job.data[HIGH_WATER_MARK] = previous[HIGH_WATER_MARK]
+        if complete and not self.since:
+            self.job.data[LAST_FULL_HARVEST] = self.job.started
+        elif previous.get(LAST_FULL_HARVEST):
+            self.job.data[LAST_FULL_HARVEST] = previous[LAST_FULL_HARVEST]
+        self.job.data[INCREMENTAL] = bool(self.since)
+
+    def end_job(self):
+        if hasattr(self, '_shard_reports'):
+            # The listing and the shards ran in separate processes
+            report = merge_reports(self._shard_reports + [self.performance_report(0)])
+            elapsed = (datetime.utcnow() - self.job.started).total_seconds()
+            report['items'] = len(self.job.items)
+            report['duration'] = round(elapsed, 3)
+            report['items_per_second'] = round(report['items'] / elapsed, 2) if elapsed else None
+            self.job.data[STATS] = report
+        else:
+            self.job.data[STATS] = self.performance_report()
+        if hasattr(self, '_http'):
+            self.job.data['http'] = self.http.report()
+            self.http.close()
+        if self._shards:
+            # The job ends once all its shards are processed
+            self.job.status = 'processing'
+            self.job.save()
+            self.dispatch_shards()
+            return
+        super().end_job()
+
+    def autoarchive(self):
+        # Partial jobs only see some records: everything else would be archived
+        if self.partial or self._shards:
+            log.debug('Skipping autoarchive on partial harvest')
+            return
+        super().autoarchive()
+
+    @property
+    def partial(self):
+        '''Whether this job only sees a part of the remote catalog'''
+        return bool(self.since or self.resume or self.retry_failed or self._shard_failed)
+
+    _cursor = None
+
+    @property
+    def _item_cursors(self):
+        # The listing cursor of each unfinished item, oldest first
+        if not hasattr(self, '_item_cursors_by_id'):
+            self._item_cursors_by_id = {}
+        return self._item_cursors_by_id
+
+    def checkpoint(self, cursor):
+        '''
+        Record the listing position (an offset, a page...) of the next listed datasets.
+
+        If the job is interrupted, the next one resumes its listing
+        from the position of the oldest unfinished item.
+        '''
+        if self.dryrun or self.retry_failed:
+            return
+        if self._shards is not None:
+            # A sharded listing is complete before any item is processed:
+            # positions only tell each shard where to list its datasets from
+            self._listing_cursor = cursor
+        else:
+            self._cursor = cursor
+
+    def save_job(self):
+        if self.shard is not None:
+            return self.save_shard()
+        if self._cursor is not None:
+            cursors = self._item_cursors
+            self.job.data[CHECKPOINT] = {
+                'cursor': next(iter(cursors.values())) if cursors else self._cursor,
+                'since': self.since,
+            }
+        super().save_job()
+
+    @property
+    def resume(self):
+        '''
+        The checkpoint of the previous job if it has been interrupted:
+        its `cursor` and the listed remote ids it `processed` (see `listed_id()`).
+        '''
+        if not hasattr(self, '_resume'):
+            self._resume = self.get_resume()
+        return self._resume
+
+    def get_resume(self):
+        # Shards only process the remote ids they are given
+        if self.dryrun or self.retry_failed or self.shard is not None:
+            return {}
+        job = self.previous_job
+        if not job or not job.data.get(CHECKPOINT):
+            return {}
+        checkpoint = job.data[CHECKPOINT]
+        log.info('Resuming harvest of %s at %s', self.source.name, checkpoint['cursor'])
+        self.job.data[RESUMED_FROM] = str(job.id)
+        return {
+            'cursor': checkpoint['cursor'],
+            'since': checkpoint.get('since'),
+            'processed': set(
+                listed_id(item) for item in job.items if item.status in ('done', 'skipped')
+            ),
+        }
+
+    @property
+    def cursor(self):
+        '''The listing position to resume from or `None`'''
+        return self.resume.get('cursor')
+
+    @property
+    def previous_job(self):
+        '''The last job of the source, before this one'''
+        if not hasattr(self, '_previous_job'):
+            qs = HarvestJob.objects(source=self.source)
+            if self.job and self.job.id:
+                qs = qs(id__ne=self.job.id)
+            self._previous_job = qs.order_by('-created').first()
+        return self._previous_job
+
+    @property
+    def failed_remote_ids(self):
+        '''The listed remote ids of the items which failed or never ended in the previous job'''
+        job = self.previous_job
+        if not job:
+            return []
+        self.job.data[RETRY_OF] = str(job.id)
+        return [listed_id(item) for item in job.items
+                if item.status in ('failed', 'started') and listed_id(item)]
+
+    @property
+    def organizations(self):
+        '''The organization resolver shared by all the items of the job'''
+        if not hasattr(self, '_organizations'):
+            self._organizations = OrganizationResolver()
+        return self._organizations
+
+    _caches_lock = threading.Lock()
+
+    @property
+    def _caches(self):
+        if not hasattr(self, '_caches_by_name'):
+            self._caches_by_name = {}
+        return self._caches_by_name
+
+    def memoized(self, name, key, compute):
+        '''
+        `compute()` memoized by `key` in the `name` cache of the job.
+
+        Caches are bounded LRUs of `HARVEST_MEMOIZE_SIZE` values
+        and their hit ratios are part of the performance report.
+        '''
+        with self._caches_lock:
+            cache = self._caches.get(name)
+            if cache is None:
+                cache = self._caches[name] = LRUCache(current_app.config['HARVEST_MEMOIZE_SIZE'])
+        return cache.get(key, compute)
+
+    def parse_html(self, html):
+        '''The Markdown conversion of `html`, memoized by content hash'''
+        return self.memoized('html', content_key(html), lambda: parse_html(html))
+
+    def default_license(self):
+        return self.memoized('licenses', None, License.default)
+
+    def guess_license(self, *strings, default=None):
+        '''`License.guess()` memoized by its arguments'''
+        key = (strings, getattr(default, 'id', None))
+        return self.memoized('licenses', key, lambda: License.guess(*strings, default=default))
+
+    def get_config_value(self, key, default=None):
+        value = self.get_extra_config_value(key)
+        return default if value is None else value
+
+    @property
+    def previous_job_data(self):
+        '''The data of the last job having recorded a high-water mark'''
+        if not hasattr(self, '_previous_job_data'):
+            qs = HarvestJob.objects(source=self.source, **{
+                'data__{0}__exists'.format(HIGH_WATER_MARK): True
+            })
+            if self.job and self.job.id:
+                qs = qs(id__ne=self.job.id)
+            job = qs.order_by('-created').first()
+            self._previous_job_data = job.data if job else {}
+        return self._previous_job_data
+
+    @property
+    def since(self):
+        '''
+        The date from which remote records should be listed
+        or `None` if a full harvest is required.
+        '''
+        if not hasattr(self, '_since'):
+            self._since = self.get_since()
+        return self._since
+
+    def get_since(self):
+        if not self.incremental or self.dryrun or self.retry_failed:
+            return None
+        if self.resume:
+            # Keep listing the same records as the interrupted job
+            return self.resume.get('since')
+        days = self.get_config_value('full_harvest_days',
+                                     current_app.config['HARVEST_FULL_HARVEST_DAYS'])
+        previous = self.previous_job_data
+        mark = previous.get(HIGH_WATER_MARK)
+        last_full = previous.get(LAST_FULL_HARVEST)
+        if not days or not mark or not last_full:
+            return None
+        if datetime.utcnow() - last_full >= timedelta(days=days):
+            log.info('Full harvest required for %s', self.source.name)
+            return None
+        log.info('Incremental harvest of %s since %s', self.source.name, mark.isoformat())
+        return mark
+
+    @property
+    def _digests(self):
+        if not hasattr(self, '_digests_by_id'):
+            self._digests_by_id = {}
+        return self._digests_by_id
+
+    def digest(self, payload):
+        '''
+        A stable digest of a remote payload.
+
+        It also covers the source configuration and the mapping version
+        so that changing any of them triggers a remapping.
+        '''
+        context = {
+            'backend': self.display_name,
+            'mapping': self.mapping_version,
+            'config': self.source.config,
+            'description': self.source.description,
+        }
+        sha = hashlib.sha256()
+        sha.update(json.dumps(context, sort_keys=True, default=str).encode('utf-8'))
+        if isinstance(payload, bytes):
+            sha.update(payload)
+        else:
+            sha.update(json.dumps(payload, sort_keys=True, default=str).encode('utf-8'))
+        return sha.hexdigest()
+
+    def get_dataset_if_changed(self, item, payload):
+        '''
+        Get the dataset matching `item` (see `get_dataset`)
+        or raise `HarvestUnchangedException` if `payload` is the same as on the last harvest.
+        '''
+        digest = self.digest(payload)
+        known = self.known_datasets.get(item.remote_id)
+        if known and not known['archived'] and known['content_hash'] == digest:
+            raise HarvestUnchangedException(Dataset(id=known['id']))
+        self._digests[item.remote_id] = digest
+        return self.get_dataset(item.remote_id)
+
+    def skip_if_cached(self, item, response):
+        '''
+        Raise `HarvestUnchangedException` without parsing `response`
+        if the remote confirmed it did not change (see `HTTPCache`)
+        and it is the payload of the known dataset of `item`.
+
+        The dataset is looked up by the remote id the previous job found
+        for the same listed id: backends replacing `item.remote_id` once
+        the document is parsed (ie. MAAF) can skip the parsing too.
+        '''
+        if not getattr(response, 'from_cache', False):
+            return
+        remote_id = self.previous_remote_ids.get(listed_id(item), item.remote_id)
+        known = self.known_datasets.get(remote_id)
+        if (known and not known['archived']
+                and known['content_hash'] == self.digest(response.content)):
+            item.remote_id = remote_id
+            raise HarvestUnchangedException(Dataset(id=known['id']))
+
+    @property
+    def previous_remote_ids(self):
+        '''The remote ids of the previous job done items by listed id (see `listed_id()`)'''
+        if not hasattr(self, '_previous_remote_ids'):
+            job = self.previous_job
+            self._previous_remote_ids = dict(
+                (listed_id(item), item.remote_id) for item in (job.items if job else [])
+                if item.status == 'done' and item.remote_id
+            )
+        return self._previous_remote_ids
+
+    _known_datasets_lock = threading.Lock()
+
+    @property
+    def known_datasets(self):
+        '''The datasets of the source indexed by remote id'''
+        if not hasattr(self, '_known_datasets'):
+            with self._known_datasets_lock:
+                if not hasattr(self, '_known_datasets'):
+                    self._known_datasets = DatasetIndex(self.source)
+        return self._known_datasets
+
+    def get_dataset(self, remote_id):
+        '''
+        Same as `BaseBackend.get_dataset()` without a query per dataset:
+        the source datasets are found in `known_datasets`.
+        '''
+        known = self.known_datasets.get(remote_id)
+        dataset = self.known_datasets.load(known['id']) if known else None
+        if dataset:
+            return dataset
+        try:
+            uris.validate(remote_id)
+        except uris.ValidationError:
+            pass
+        else:
+            # URIs also match the datasets harvested from other sources
+            return super().get_dataset(remote_id)
+        if self.source.organization:
+            return Dataset(organization=self.source.organization)
+        elif self.source.owner:
+            return Dataset(owner=self.source.owner)
+        return Dataset()
+
+    _high_water_mark = None
+    _high_water_mark_lock = threading.Lock()
+
+    def track_modified(self, value):
+        '''Record a remote modification date to compute the next high-water mark'''
+        modified = to_utc(value)
+        if not modified:
+            return
+        with self._high_water_mark_lock:
+            if not self._high_water_mark or modified > self._high_water_mark:
+                self._high_water_mark = modified
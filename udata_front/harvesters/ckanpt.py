@@ -23,20 +23,23 @@ except ImportError:
     from udata.models import UPDATE_FREQUENCIES
 from udata.core.dataset.models import HarvestDatasetMetadata, HarvestResourceMetadata
 from udata.core.dataset.rdf import frequency_from_rdf
-from udata.frontend.markdown import parse_html
 from udata.models import (
-    db, Resource, License, SpatialCoverage, GeoZone, Organization
+    db, SpatialCoverage, GeoZone
 )
-from udata.utils import get_by, daterange_start, daterange_end, safe_unicode
+from udata.utils import daterange_start, daterange_end, safe_unicode
 
-from udata.harvest.backends.base import BaseBackend, HarvestFilter
+from udata.harvest.backends.base import HarvestFilter, HarvestFeature
 from udata.harvest.exceptions import HarvestException, HarvestSkipException
 
 from udata.harvest.filters import (
     boolean, email, to_date, slug, normalize_tag, normalize_string,
     is_url, empty_none, hash
 )
-from .tools.harvester_utils import missing_datasets_warning
+from .base import PTBaseBackend
+from .tools.harvester_utils import reconcile_missing_datasets
+from .tools.ratelimit import RATE_LIMIT_KEYS
+from .tools.resources import ResourceReconciler
+from .tools.validation import compile_schema
 
 from .schemas.ckan import schema as ckan_schema
 from .schemas.dkan import schema as dkan_schema
@@ -47,14 +50,25 @@ log = logging.getLogger(__name__)
 ALLOWED_RESOURCE_TYPES = ('dkan', 'file', 'file.upload', 'api', 'metadata')
 
 
-class CkanPTBackend(BaseBackend):
+class CkanPTBackend(PTBaseBackend):
     display_name = 'CKAN PT'
     filters = (
         HarvestFilter(_('Organization'), 'organization', str,
                       _('A CKAN Organization name')),
         HarvestFilter(_('Tag'), 'tags', str, _('A CKAN tag name')),
     )
-    schema = ckan_schema
+    features = (
+        HarvestFeature('package_search', _('Bulk listing'),
+                       _('Page through package_search and process the returned packages '
+                         'instead of calling package_show for each dataset')),
+    )
+    schema = compile_schema(ckan_schema)
+    incremental = True
+
+    # Number of packages requested per package_search call
+    PAGE_SIZE = 1000
+    # Stable ordering so offsets are not shifted by updates made during the harvest
+    SEARCH_SORT = 'metadata_created asc, id asc'
 
     harvest_config = {}
 
@@ -65,6 +79,13 @@ class CkanPTBackend(BaseBackend):
         except (ValueError, TypeError) as e:
                 pass
 
+    def rate_limits(self):
+        limits = super(CkanPTBackend, self).rate_limits()
+        # ie. `{"rate_limit": {"rate": 5, "concurrency": 2}}` in the source description
+        config = self.harvest_config.get('rate_limit') or {}
+        limits.update((key, config[key]) for key in RATE_LIMIT_KEYS if key in config)
+        return limits
+
     def get_headers(self):
         headers = super(CkanPTBackend, self).get_headers()
         headers['content-type'] = 'application/json'
@@ -91,7 +112,8 @@ class CkanPTBackend(BaseBackend):
         mime_type = content_type.split(';', 1)[0]
 
         if mime_type == 'application/json':  # Standard API JSON response
-            data = response.json()
+            with self.stage('parse'):
+                data = response.json()
             # CKAN API always returns 200 even on errors
             # Only the `success` property allows to detect errors
             if data.get('success', False):
@@ -121,7 +143,7 @@ class CkanPTBackend(BaseBackend):
         response = self.get(url)
         return response.json()
 
-    def inner_harvest(self):
+    def iter_datasets(self):
 
         try:
             self.harvest_config = json.loads(safe_unicode(self.source.description))
@@ -135,6 +157,7 @@ class CkanPTBackend(BaseBackend):
         fix = False  # Fix should be True for CKAN < '1.8'
 
         filters = self.config.get('filters', [])
+        q = None
         if len(filters) > 0:
             # Build a q search query based on filters
             # use package_search because package_list doesn't allow filtering
@@ -146,62 +169,100 @@ class CkanPTBackend(BaseBackend):
                     param = '-' + param
                 params.append(param)
             q = ' AND '.join(params)
-            response = self.get_action('package_search', fix=fix, q=q, rows=1000)
-            names = [r['name'] for r in response['result']['results']]
+
+        if self.since:
+            # Only list packages modified since the last harvest
+            modified = 'metadata_modified:[{0:%Y-%m-%dT%H:%M:%S}Z TO *]'.format(self.since)
+            q = ' AND '.join((q, modified)) if q else modified
+
+        if self.has_feature('package_search'):
+            # Full packages are returned by package_search: no package_show needed
+            # Yield the stable ids processed items are known by
+            for package in self.search_packages(q=q, fix=fix, start=self.cursor or 0):
+                yield package['id'], {'package': package}
+            return
+
+        if q:
+            names = (package['name']
+                     for package in self.search_packages(q=q, fix=fix, start=self.cursor or 0))
         else:
             response = self.get_action('package_list', fix=fix)
             names = response['result']
-        if self.max_items:
-            names = names[:self.max_items]
+            # The list is returned at once: its index is the cursor
+            start = self.cursor or 0
+            for index, name in enumerate(names[start:], start):
+                self.checkpoint(index)
+                yield name, {}
+            return
         for name in names:
             #self.add_item(name)
-            self.process_dataset(name)
+            yield name, {}
+
+    def iter_retry(self, remote_ids):
+        # Packages can be fetched by id: no need to list them all
+        for remote_id in remote_ids:
+            yield remote_id, {}
+
+    def search_packages(self, fix=False, start=0, **kwargs):
+        '''Iter over all packages matching a package_search query, page by page'''
+        seen = set()
+        while True:
+            self.checkpoint(start)
+            response = self.get_action('package_search', fix=fix, rows=self.PAGE_SIZE,
+                                       start=start, sort=self.SEARCH_SORT, **kwargs)
+            result = response['result']
+            packages = result['results']
+            for package in packages:
+                if package['id'] in seen:
+                    continue
+                seen.add(package['id'])
+                yield package
+            start += len(packages)
+            if not packages or start >= result['count']:
+                break
+
+    def inner_process_dataset(self, item: HarvestItem, **kwargs):
+        package = kwargs.get('package')
+        if package is None:
+            response = self.get_action('package_show', id=item.remote_id)
+            package = response['result']
+        if type(package) == list:
+            package = package[0]
 
-    def inner_process_dataset(self, item: HarvestItem):
-        response = self.get_action('package_show', id=item.remote_id)
-        data = self.validate(response['result'], self.schema)
+        # Fix the remote_id: use real ID instead of not stable name
+        item.remote_id = package.get('id') or item.remote_id
+        self.track_modified(package.get('metadata_modified'))
 
-        if type(data) == list:
-            data = data[0]
+        # Unchanged packages are neither validated nor mapped
+        dataset = self.get_dataset_if_changed(item, package)
 
-        # Fix the remote_id: use real ID instead of not stable name
-        item.remote_id = data['id']
+        data = self.validate(package, self.schema)
 
         # Skip if no resource
         if not len(data.get('resources', [])):
             msg = 'Dataset {0} has no record'.format(item.remote_id)
             raise HarvestSkipException(msg)
 
-        dataset = self.get_dataset(item.remote_id)
-
         # Core attributes
         if not dataset.slug:
             dataset.slug = data['name']
         dataset.title = data['title']
-        dataset.description = parse_html(data['notes'])
+        dataset.description = self.parse_html(data['notes'])
 
         # Detect Org
         organization_acronym = data['organization']['name']
-        orgObj = Organization.objects(acronym=organization_acronym).first()
-        if orgObj:
-            #print 'Found %s' % orgObj.acronym
-            dataset.organization = orgObj
-        else:
-            orgObj = Organization()
-            orgObj.acronym = organization_acronym
-            orgObj.name = data['organization']['title']
-            orgObj.description = data['organization']['description']
-            orgObj.save()
-            #print 'Created %s' % orgObj.acronym
-
-            dataset.organization = orgObj
-
+        with self.stage('organizations'):
+            dataset.organization = self.organizations.get_or_create(
+                organization_acronym,
+                name=data['organization']['title'],
+                description=data['organization']['description'],
+            )
 
         # Detect license
-        default_license = self.harvest_config.get('license', License.default())
-        dataset.license = License.guess(data['license_id'],
-                                        data['license_title'],
-                                        default=default_license)
+        default_license = self.harvest_config.get('license') or self.default_license()
+        dataset.license = self.guess_license(data['license_id'],
+                                             data['license_title'],
+                                             default=default_license)
 
         dataset.tags = [t['name'] for t in data['tags'] if t['name']]
 
@@ -279,59 +340,48 @@ class CkanPTBackend(BaseBackend):
         
         dataset.extras['harvest:name'] = self.source.name
 
-        current_resources = [str(resource.id) for resource in dataset.resources]
-        fetched_resources = []
-        
-        # Resources
-        for res in data['resources']:
-            if res['resource_type'] not in ALLOWED_RESOURCE_TYPES:
-                continue
-            
-            #Ignore invalid Resources
-            try:
-                url = uris.validate(res['url'])
-            except uris.ValidationError:
-                continue            
+        with self.stage('resources'):
+            resources = ResourceReconciler(dataset, 'id')
 
-            try:
-                resource = get_by(dataset.resources, 'id', UUID(res['id']))
-            except Exception:
-                log.error('Unable to parse resource ID %s', res['id'])
-                continue
+            # Resources
+            for res in data['resources']:
+                if res['resource_type'] not in ALLOWED_RESOURCE_TYPES:
+                    continue
             
-            fetched_resources.append(str(res['id']))
-            if not resource:
-                resource = Resource(id=res['id'])
-                dataset.resources.append(resource)
-            resource.title = res.get('name', '') or ''
-            resource.description = parse_html(res.get('description'))
-            resource.url = res['url']
-            resource.filetype = 'remote'
-            resource.format = res.get('format')
-            resource.mime = res.get('mimetype')
-            resource.hash = res.get('hash')
-            resource.created = res['created']
-            resource.modified = res['last_modified']
-            #resource.published = resource.published or resource.created
-            resource.published = resource.created
-
-        # Clean up old resources removed from source
-        for resource_id in current_resources:
-            if resource_id not in fetched_resources:
+                #Ignore invalid Resources
+                try:
+                    url = uris.validate(res['url'])
+                except uris.ValidationError:
+                    continue            
+
                 try:
-                    resource = get_by(dataset.resources, 'id', UUID(resource_id))
+                    resource_id = UUID(res['id'])
                 except Exception:
-                    log.error('Unable to parse resource ID %s', resource_id)
+                    log.error('Unable to parse resource ID %s', res['id'])
                     continue
-                else:
-                    if resource and not self.dryrun:
-                        dataset.resources.remove(resource)
+
+                _, resource = resources.get_or_create(resource_id, id=res['id'])
+                resource.title = res.get('name', '') or ''
+                resource.description = self.parse_html(res.get('description'))
+                resource.url = res['url']
+                resource.filetype = 'remote'
+                resource.format = res.get('format')
+                resource.mime = res.get('mimetype')
+                resource.hash = res.get('hash')
+                resource.created = res['created']
+                resource.modified = res['last_modified']
+                #resource.published = resource.published or resource.created
+                resource.published = resource.created
+
+            # Clean up old resources removed from source
+            if not self.dryrun:
+                resources.remove_stale()
 
         return dataset
 
     def finalize(self):
         super(CkanPTBackend, self).finalize()
 
-        # Check if datasets removed in origin
-        if not self.dryrun:
-            missing_datasets_warning(job_items=self.job.items, source=self.source)
\ No newline at end of file
+        # Check if datasets removed in origin (partial jobs only see some of them)
+        if not self.dryrun and not self.partial:
+            reconcile_missing_datasets(job_items=self.job.items, source=self.source)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import time
+
+from collections import Counter
+from datetime import datetime
+from resource import RUSAGE_SELF, getrusage
+
+import click
+import requests
+
+from flask import current_app
+
+from udata.commands import cli, exit_with_error, success
+from udata.harvest import actions, backends
+from udata.harvest.models import HarvestJob, HarvestSource
+from udata.models import Dataset
+
+from .base import STATS, get_http_cache
+from .tasks import retry_failed_items
+from .tools.benchmark import STATS_PATH, CatalogServer, serve
+from .tools.http_cache import BODY_EXT
+from .tools.stats import STAGES
+
+log = logging.getLogger(__name__)
+
+
+@cli.group('harvest-tools')
+def grp():
+    '''dados.gov harvesters tooling'''
+    pass
+
+
+@grp.group()
+def cache():
+    '''Harvesters HTTP cache operations'''
+    pass
+
+
+def cache_or_exit():
+    http_cache = get_http_cache()
+    if not http_cache:
+        exit_with_error('HTTP cache is disabled (HARVEST_HTTP_CACHE_SIZE = 0)')
+    return http_cache
+
+
+def human_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            break
+        size /= 1024.
+    return '{0:.1f}{1}'.format(size, unit)
+
+
+@cache.command()
+@click.option('-l', '--list', 'show', is_flag=True, help='List the cached URLs')
+@click.option('-m', '--match', help='Only the URLs containing this string')
+def info(show, match):
+    '''Display the HTTP cache usage'''
+    http_cache = cache_or_exit()
+    entries = [e for e in http_cache.entries() if not match or match in e.url]
+    size = sum(e.size for e in entries)
+    log.info('Directory: %s', http_cache.directory)
+    log.info('Entries: %s', len(entries))
+    log.info('Size: %s / %s', human_size(size), human_size(http_cache.max_size))
+    if show:
+        for entry in sorted(entries, key=lambda e: e.url):
+            used = datetime.fromtimestamp(os.path.getmtime(entry.path + BODY_EXT))
+            log.info('%s %8s %s', used.strftime('%Y-%m-%d %H:%M'), human_size(entry.size), entry.url)
+
+
+@cache.command()
+@click.option('-m', '--match', help='Only purge the URLs containing this string')
+def purge(match):
+    '''Remove entries from the HTTP cache'''
+    http_cache = cache_or_exit()
+    removed = http_cache.purge(match)
+    success('Removed {0} entries from the HTTP cache'.format(removed))
+
+
+@cache.command()
+@click.argument('size', type=int)
+def shrink(size):
+    '''Evict the least recently used entries until the cache fits in SIZE bytes'''
+    http_cache = cache_or_exit()
+    removed = http_cache.evict(size)
+    success('Evicted {0} entries from the HTTP cache'.format(removed))
+
+
+@grp.command('retry-failed')
+@click.argument('identifier')
+def retry_failed(identifier):
+    '''Harvest again the items which failed in the last job of a source'''
+    source = actions.get_source(identifier)
+    job = retry_failed_items(str(source.id))
+    failed = sum(1 for item in job.items if item.status == 'failed')
+    success('{0} items retried, {1} failed again'.format(len(job.items), failed))
+
+
+def format_delta(value, previous):
+    if not previous:
+        return ''
+    return '{0:+.0f}%'.format(100. * (value - previous) / previous)
+
+
+@grp.command()
+@click.argument('identifier')
+@click.option('-n', '--jobs', default=5, help='Number of jobs to compare')
+def stats(identifier, jobs):
+    '''Display the performance report of the last jobs of a source'''
+    source = actions.get_source(identifier)
+    reports = [
+        (job, job.data[STATS])
+        for job in HarvestJob.objects(source=source).order_by('-created').limit(jobs)
+        if job.data and job.data.get(STATS)
+    ]
+    if not reports:
+        exit_with_error('No performance report for {0}'.format(source.name))
+    for job, report in reports:
+        log.info('%s %-12s %6s items %8ss %8s items/s %6s requests %8s',
+                 job.created.strftime('%Y-%m-%d %H:%M'), job.status, report['items'],
+                 report['duration'], report['items_per_second'], report['requests'],
+                 human_size(report['bytes']))
+
+    job, report = reports[0]
+    previous = reports[1][1]['stages'] if len(reports) > 1 else {}
+    log.info('Stages of the job of %s:', job.created.strftime('%Y-%m-%d %H:%M'))
+    log_stages(report['stages'], previous)
+    log_caches(report.get('caches') or {})
+
+
+def log_stages(stages, previous=None):
+    previous = previous or {}
+    for stage in sorted(stages, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        values = stages[stage]
+        delta = format_delta(values['total'], previous.get(stage, {}).get('total'))
+        log.info('%-14s %8s calls %10.3fs total %8.4fs p50 %8.4fs p95 %6s',
+                 stage, values['count'], values['total'], values['p50'], values['p95'], delta)
+
+
+def log_caches(caches):
+    for name, values in sorted(caches.items()):
+        log.info('%-14s %8s hits %8s misses %6s ratio',
+                 name + ' cache', values['hits'], values['misses'], values['ratio'])
+
+
+def parse_extra_configs(Backend, configs):
+    '''Parse `key=value` extra configs with their declared type'''
+    types = dict((extra.key, extra.type) for extra in Backend.extra_configs)
+    extra_configs = []
+    for config in configs:
+        key, _, value = config.partition('=')
+        if key not in types:
+            exit_with_error('Unknown extra config {0}'.format(key))
+        extra_configs.append({'key': key, 'value': types[key](value)})
+    return extra_configs
+
+
+@grp.command()
+@click.argument('backend', type=click.Choice(sorted(CatalogServer.SOURCE_PATHS)))
+@click.option('-n', '--datasets', default=1000, help='Number of datasets of the catalog')
+@click.option('-r', '--resources', default=3, help='Number of resources per dataset')
+@click.option('-l', '--latency', default=0., help='Delay added to each response in seconds')
+@click.option('-c', '--config', 'configs', multiple=True,
+              help='Source extra config as key=value (ie. concurrency=4)')
+@click.option('-f', '--feature', 'features', multiple=True, help='Enable a backend feature')
+@click.option('-k', '--keep', is_flag=True, help='Keep the harvested datasets and job')
+def benchmark(backend, datasets, resources, latency, configs, features, keep):
+    '''
+    Harvest a local synthetic catalog and report the harvester throughput.
+
+    The catalog is served by a separate process speaking the BACKEND protocol
+    and the harvest is written to the configured database.
+    '''
+    Backend = backends.get(current_app, backend)
+    extra_configs = parse_extra_configs(Backend, configs)
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(backend, datasets, resources, latency, queue))
+    server.start()
+    try:
+        url, source_url = queue.get(timeout=30)
+        if backend == 'ine':
+            Backend = type(Backend.__name__, (Backend,), {'INDICATOR_URL': url + '/xml_indic.jsp'})
+        source = HarvestSource(
+            name='Benchmark {0} {1:%Y-%m-%d %H:%M:%S}'.format(backend, datetime.utcnow()),
+            url=source_url,
+            backend=backend,
+            config={
+                'extra_configs': extra_configs,
+                'features': dict((feature, True) for feature in features),
+            },
+        )
+        # Local URLs are refused by the URL field validation
+        source.save(validate=False)
+        try:
+            log.info('Harvesting %s datasets with %s resources from %s', datasets, resources, url)
+            start = time.monotonic()
+            job = Backend(source).harvest()
+            duration = time.monotonic() - start
+            served = requests.get(url + STATS_PATH).json()
+            statuses = Counter(item.status for item in job.items)
+            log.info('Job: %s (%s)', job.status,
+                     ', '.join('{0} {1}'.format(n, status) for status, n in statuses.items()))
+            log.info('Duration: %.3fs, %.2f items/s', duration,
+                     len(job.items) / duration if duration else 0)
+            # Kilobytes on Linux
+            log.info('Peak RSS: %s', human_size(getrusage(RUSAGE_SELF).ru_maxrss * 1024))
+            log.info('Requests: %s, %s served', served['requests'], human_size(served['bytes']))
+            log_stages((job.data.get(STATS) or {}).get('stages') or {})
+            log_caches((job.data.get(STATS) or {}).get('caches') or {})
+        finally:
+            if not keep:
+                Dataset.objects(harvest__source_id=str(source.id)).delete()
+                HarvestJob.objects(source=source).delete()
+                source.delete()
+    finally:
+        server.terminate()
+        server.join()
@@ -1,25 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from udata.models import db, Resource, License
+from udata.models import db, Checksum, Resource
 from udata.utils import faker
 
+from udata.harvest.exceptions import HarvestSkipException
+
 from .dadosgovBackend import DGBaseBackend
-from udata.core.organization.models import Organization
+from .tools.download import download
+from .tools.xmlstream import iter_elements, iter_response_elements, localname
 
 from flask import url_for, current_app
 
-from xml.dom import minidom, Node
-from urllib.request import urlopen, quote
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 import csv
-import sys
 import os
 import errno
 import json
+import threading
 import traceback
 
 REPORT_FILE_PATH = '/home/udata/report.csv'
+# The organizations and datasets exported from the former portal database
+AUX_FILE_PATH = '/home/udata'
 DADOSGOVPATH = 'dadosGovFiles'
 DOWNLOADFILEPATH = '/home/udata/fs/%s' % (DADOSGOVPATH)
 DADOSGOVURL = 'servico.dados.gov.pt'
@@ -27,7 +31,10 @@ DADOSGOVURL = 'servico.dados.gov.pt'
 class DGBackend(DGBaseBackend):
     display_name = 'Dados Gov'
 
-    def initialize(self):
+    # Items are processed concurrently: report rows must not be interleaved
+    _report_lock = threading.Lock()
+
+    def iter_datasets(self):
         '''Get the datasets and corresponding organization ids'''
         global REPORT_FILE_PATH, DOWNLOADFILEPATH, DADOSGOVURL
 
@@ -35,7 +42,7 @@ class DGBackend(DGBaseBackend):
         print('Initializing dados gov harvester')
         print('------------------------------------')
 
-        with open(REPORT_FILE_PATH, 'wb') as csvResFile:
+        with open(REPORT_FILE_PATH, 'w', newline='') as csvResFile:
             writer = csv.writer(csvResFile, delimiter=chr(9), quotechar=chr(34), quoting=csv.QUOTE_MINIMAL)
             writer.writerow([
                 'DatasetId'
@@ -48,7 +55,7 @@ class DGBackend(DGBaseBackend):
                 , 'TagsAdicionarDataset'
             ])
 
-        auxFilePath = '/home/udata'
+        auxFilePath = AUX_FILE_PATH
         # ******************************************************************************
         # store the data regarding organizations that matter from the db exported file
         organizationData = {}
@@ -88,20 +95,22 @@ class DGBackend(DGBaseBackend):
         # ******************************************************************************
 
 
+        if not os.path.exists(DOWNLOADFILEPATH):
+            try:
+                os.makedirs(DOWNLOADFILEPATH)
+            except OSError as exc: # Guard against race condition
+                if exc.errno != errno.EEXIST:
+                    raise
+
         # ******************************************************************************
         # associate api datasets and organizations with its organization
         rootUrl = "http://%s/v1/" % (DADOSGOVURL)
-        xmlRootData = urlopen(rootUrl).read()
-        organizationDoc = minidom.parseString(xmlRootData)
-        organizationElements = organizationDoc.getElementsByTagName('collection')
-
-        for orgElement in organizationElements:
-            orgName = orgElement.attributes['href'].value
-            datasetUrl = "http://%s/v1/%s" % (DADOSGOVURL, orgName)
-            xmlDatasetData = urlopen(datasetUrl).read()
-            datasetDoc = minidom.parseString(xmlDatasetData)
-            datasetElements = datasetDoc.getElementsByTagName('collection')
+        response = self.get(rootUrl, stream=True)
+        orgNames = [el.get('href') for el in iter_response_elements(response, 'collection')]
 
+        # fetch the organizations collections concurrently and queue their datasets as they arrive
+        collections = self.fetch_as_completed(self.get_collection, orgNames)
+        for orgName, datasetNames in collections:
             # associate the current dataset with the previously added db data
             if orgName in organizationData:
                 orgData = organizationData[orgName]
@@ -112,56 +121,79 @@ class DGBackend(DGBaseBackend):
             print('------------------------------------')
             print(f"Adding datasets for organization '{orgName}'")
             # if there are any elements in the organization
-            if datasetElements:
+            if datasetNames:
                 # check if the current organization exists in the db, if not create it
-                orgObj = Organization.objects(acronym=orgData['acronym']).first()
-
-                if not orgObj:
-                    print('--')
-                    orgObj = Organization()
-                    orgObj.acronym = orgData['acronym']
-                    print(f'Created {orgObj.acronym}')
-                    print('--')
+                with self.stage('organizations'):
+                    orgObj = self.organizations.get_or_create(
+                        orgData['acronym'], name=orgData['name'], description=orgData['description'])
 
-                orgObj.name = orgData['name']
-                orgObj.description = orgData['description']
-                orgObj.save()
+                # updates are written all at once at the end of the job
+                self.organizations.update(orgObj, name=orgData['name'], description=orgData['description'])
 
                 orgData['dbOrgId'] = orgObj.id
 
-                for dsElement in datasetElements:
-                    datasetName = dsElement.attributes['href'].value
-
+                for datasetName in datasetNames:
                     if datasetName in datasetDbFileData:
-                        self.add_item(
-                            datasetName
-                            , orgId = orgObj.id
-                            , orgAcronym = orgObj.acronym
-                            , filePath = datasetDbFileData[datasetName]['filePath']
-                            , serviceUrl = datasetDbFileData[datasetName]['serviceUrl']
-                            , createdOn = datasetDbFileData[datasetName]['createdOn']
-                        )
+                        yield datasetName, {
+                            'orgId': orgObj.id
+                            , 'orgAcronym': orgObj.acronym
+                            , 'filePath': datasetDbFileData[datasetName]['filePath']
+                            , 'serviceUrl': datasetDbFileData[datasetName]['serviceUrl']
+                            , 'createdOn': datasetDbFileData[datasetName]['createdOn']
+                        }
 
                         # print 'Added dataset "%s"' % datasetName
-
-        if not os.path.exists(DOWNLOADFILEPATH):
-            try:
-                os.makedirs(DOWNLOADFILEPATH)
-            except OSError as exc: # Guard against race condition
-                if exc.errno != errno.EEXIST:
-                    raise
         # ******************************************************************************
 
-    def process(self, item):
+    def shard_kwargs(self, remote_id, kwargs):
+        # Listing again would rewrite the report and fetch all the collections
+        return dict(kwargs, orgId=str(kwargs['orgId']))
+
+    def get_collection(self, orgName):
+        '''The dataset names of an organization collection'''
+        datasetUrl = "http://%s/v1/%s" % (DADOSGOVURL, orgName)
+        response = self.get(datasetUrl, stream=True)
+        return [el.get('href') for el in iter_response_elements(response, 'collection')]
+
+    @property
+    def download_pool(self):
+        '''Bounded pool shared by the downloads of all the items'''
+        if not hasattr(self, '_download_pool'):
+            # Shards don't list the datasets: the directory may not exist on their worker
+            os.makedirs(DOWNLOADFILEPATH, exist_ok=True)
+            self._download_pool = ThreadPoolExecutor(
+                current_app.config['HARVEST_DOWNLOAD_WORKERS'], thread_name_prefix='harvest-download')
+        return self._download_pool
+
+    def download_file(self, url, filename):
+        '''Download a file into `DOWNLOADFILEPATH` in the background'''
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                return download(self, url, os.path.join(DOWNLOADFILEPATH, filename))
+        return self.download_pool.submit(run)
+
+    def write_report(self, row):
+        '''Append a row to the report, items being processed concurrently'''
+        with self._report_lock:
+            with open(REPORT_FILE_PATH, 'a') as csvResFile:
+                writer = csv.writer(csvResFile, delimiter=chr(9), quotechar=chr(34), quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(row)
+
+    def end_job(self):
+        if hasattr(self, '_download_pool'):
+            self._download_pool.shutdown()
+        super(DGBackend, self).end_job()
+
+    def inner_process_dataset(self, item, **kwargs):
         '''Return the DadosGov datasets with the corresponding original and xml file'''
         global REPORT_FILE_PATH, DADOSGOVPATH, DOWNLOADFILEPATH, DADOSGOVURL
-        reload(sys)
-        sys.setdefaultencoding('utf8')
 
         # Get or create a harvested dataset with this identifier.
         dataset = self.get_dataset(item.remote_id)
         # get the organization object, no check necessary, it should always exist
-        orgObj = Organization.objects(id=item.kwargs['orgId']).first()
+        orgObj = self.organizations.get(kwargs['orgAcronym'])
 
         print('------------------------------------')
         print('Processing %s (%s)' % (dataset.title, item.remote_id))
@@ -172,55 +204,49 @@ class DGBackend(DGBaseBackend):
         dataset.tags = ['migrado']
         dataset.extras = {}
         dataset.organization = orgObj.id
-        dataset.license = License.guess('cc-by')
+        dataset.license = self.guess_license('cc-by')
         dataset.resources = []
         
         # *********************************************
         # go through the DB dataset information
-        dataset.created_at = item.kwargs['createdOn']
-        dataset.extras['links'] = item.kwargs['serviceUrl']
+        dataset.created_at = kwargs['createdOn']
+        dataset.extras['links'] = kwargs['serviceUrl']
         # ********************************************************
 
         # ********************************************************
-        req = requests.get(
-            "http://%s/v1/%s/TableMetadata" % (DADOSGOVURL, item.kwargs['orgAcronym'])
+        req = self.get(
+            "http://%s/v1/%s/TableMetadata" % (DADOSGOVURL, kwargs['orgAcronym'])
             , params={ '$filter': "partitionkey eq '%s'" % item.remote_id }
             , headers={'charset': 'utf8'})
 
-        xmlRootData = req.content
-
-        propertiesDoc = minidom.parseString(xmlRootData)
-        propertiesStuff = propertiesDoc.getElementsByTagName('content')
-        propEl = propertiesDoc.getElementsByTagNameNS('*', 'properties')
-        if propEl:
-            propertiesElements = propEl[0].childNodes
-
+        properties = next(iter_elements(req.content, 'properties'), None)
+        if properties is not None:
             # go through the API dataset information
-            for propEl in propertiesElements:
-                if propEl.nodeType == Node.ELEMENT_NODE:
-                    fc = propEl.firstChild
+            for propEl in properties:
+                name = localname(propEl)
+                value = propEl.text
 
-                    if fc:
-                        if propEl.nodeName == 'd:category':
-                            dataset.tags.append(fc.nodeValue)
+                if value:
+                    if name == 'category':
+                        dataset.tags.append(value)
 
-                        elif propEl.nodeName == 'd:keywords':
-                            dataset.tags.extend([currentTag.strip() for currentTag in fc.nodeValue.split(',')])
+                    elif name == 'keywords':
+                        dataset.tags.extend([currentTag.strip() for currentTag in value.split(',')])
 
-                        # elif propEl.nodeName == 'd:PartitionKey':
-                        #     dataset.slug = fc.nodeValue
+                    # elif name == 'PartitionKey':
+                    #     dataset.slug = value
 
-                        elif propEl.nodeName == 'd:nameexternal':
-                            dataset.title = fc.nodeValue
+                    elif name == 'nameexternal':
+                        dataset.title = value
 
-                        elif propEl.nodeName == 'd:description':
-                            dataset.description = fc.nodeValue
+                    elif name == 'description':
+                        dataset.description = value
 
-                        elif propEl.nodeName == 'd:contact':
-                            dataset.extras['contact'] = fc.nodeValue
+                    elif name == 'contact':
+                        dataset.extras['contact'] = value
 
-                        elif propEl.nodeName == 'd:links' and fc.nodeValue:
-                            dataset.extras['links'] = '%s, %s' % (dataset.extras['links'], fc.nodeValue)
+                    elif name == 'links':
+                        dataset.extras['links'] = '%s, %s' % (dataset.extras['links'], value)
             # ********************************************************
 
             env = current_app.config.get('MIGRATION_URL')
@@ -234,144 +260,124 @@ class DGBackend(DGBaseBackend):
             dataset.resources = []
 
             # separate filename from extension
-            filename = os.path.splitext(item.kwargs['filePath'])
+            filename = os.path.splitext(kwargs['filePath'])
 
             # ********************************************************
-            # get xml by api and set the dataset resource field:
+            # download the xml and json exports and the original file in parallel:
 
-            # filenameXml = '%s.xml' % (filename[0])
             filenameXml = '%s.xml' % (item.remote_id)
-            u = urlopen("http://%s/v1/%s/%s" % (DADOSGOVURL, item.kwargs['orgAcronym'], item.remote_id))
-            # create/open the local file to be written
-            with open('%s/%s' % (DOWNLOADFILEPATH, filenameXml), 'wb') as f:
-                # write file data
-                f.write(u.read())
-
-                # get file size info
-                meta = u.info()
-                fileSize = int(meta.getheaders("Content-Length")[0])
-                fullPath = '%s/%s' % (fixedUrl, filenameXml)
-                print(fullPath)
-
-                # set the resource data for the dataset
-                dataset.resources.append(Resource(
-                    title = dataset.title
-                    , description = 'Dados em formato xml'
-                    , url = fullPath
-                    , mime = 'text/xml '
-                    , format = 'xml'
-                    , filesize = fileSize
-                    , created_at = item.kwargs['createdOn']
-                ))
+            filenameJson = '%s.json' % (item.remote_id)
+            filenameOriginal = '%s%s' % (item.remote_id, filename[1])
+            xmlDownload = self.download_file(
+                "http://%s/v1/%s/%s" % (DADOSGOVURL, kwargs['orgAcronym'], item.remote_id), filenameXml)
+            jsonDownload = self.download_file(
+                "http://%s/v1/%s/%s?format=json" % (DADOSGOVURL, kwargs['orgAcronym'], item.remote_id), filenameJson)
+            originalDownload = None
+            if kwargs['filePath']:
+                # https://dadosgovstorage.blob.core.windows.net/datasetsfiles/Acesso%20a%20Consultas%20M%C3%A9dicas%20pela%20Popula%C3%A7%C3%A3o%20Inscrita_636046701023924396.xlsx
+                print('-- ** filePath ** --> %s' % kwargs['filePath'])
+                urlSafe = quote(kwargs['filePath'])
+                print("https://dadosgovstorage.blob.core.windows.net/datasetsfiles/%s" % (urlSafe))
+                originalDownload = self.download_file(
+                    "https://dadosgovstorage.blob.core.windows.net/datasetsfiles/%s" % (urlSafe), filenameOriginal)
             # ********************************************************
 
             # ********************************************************
-            # get json by api and set the dataset resource field:
+            # set the xml dataset resource field:
+
+            xmlFile = xmlDownload.result()
+            fullPath = '%s/%s' % (fixedUrl, filenameXml)
+            print(fullPath)
+
+            # set the resource data for the dataset
+            dataset.resources.append(Resource(
+                title = dataset.title
+                , description = 'Dados em formato xml'
+                , url = fullPath
+                , mime = 'text/xml '
+                , format = 'xml'
+                , filesize = xmlFile.size
+                , checksum = Checksum(type='sha256', value=xmlFile.checksum)
+                , created_at = kwargs['createdOn']
+            ))
+            # ********************************************************
 
-            filenameJson = '%s.json' % (item.remote_id)
-            u = urlopen("http://%s/v1/%s/%s?format=json" % (DADOSGOVURL, item.kwargs['orgAcronym'], item.remote_id))
-            # create/open the local file to be written
-            with open('%s/%s' % (DOWNLOADFILEPATH, filenameJson), 'wb') as f:
-                # write file data
-                f.write(u.read())
-
-                # get file size info
-                meta = u.info()
-                fileSize = int(meta.getheaders("Content-Length")[0])
-                fullPath = '%s/%s' % (fixedUrl, filenameJson)
-                print(fullPath)
-
-                # set the resource data for the dataset
-                dataset.resources.append(Resource(
-                    title = dataset.title
-                    , description = 'Dados em formato json'
-                    , url = fullPath
-                    , mime = 'application/json '
-                    , format = 'json'
-                    , filesize = fileSize
-                    , created_at = item.kwargs['createdOn']
-                ))
+            # ********************************************************
+            # set the json dataset resource field:
+
+            jsonFile = jsonDownload.result()
+            fullPath = '%s/%s' % (fixedUrl, filenameJson)
+            print(fullPath)
+
+            # set the resource data for the dataset
+            dataset.resources.append(Resource(
+                title = dataset.title
+                , description = 'Dados em formato json'
+                , url = fullPath
+                , mime = 'application/json '
+                , format = 'json'
+                , filesize = jsonFile.size
+                , checksum = Checksum(type='sha256', value=jsonFile.checksum)
+                , created_at = kwargs['createdOn']
+            ))
             # ********************************************************
 
             # ********************************************************
-            # get original files using static path and ftp and set the dataset resource field
+            # set the original file dataset resource field
 
-            if item.kwargs['filePath']:
+            if originalDownload:
                 try:
-                    # https://dadosgovstorage.blob.core.windows.net/datasetsfiles/Acesso%20a%20Consultas%20M%C3%A9dicas%20pela%20Popula%C3%A7%C3%A3o%20Inscrita_636046701023924396.xlsx
-                    print('-- ** filePath ** --> %s' % item.kwargs['filePath'])
-                    try:
-                        urlSafe = quote(item.kwargs['filePath'])
-                        print("https://dadosgovstorage.blob.core.windows.net/datasetsfiles/%s" % (urlSafe))
-                        u = urlopen("https://dadosgovstorage.blob.core.windows.net/datasetsfiles/%s" % (urlSafe))
-
-                        # create/open the local file to be written
-                        with open('%s/%s%s' % (DOWNLOADFILEPATH, item.remote_id, filename[1]), 'wb') as f:
-                            # write file data
-                            f.write(u.read())
-
-                            # get file size info
-                            meta = u.info()
-                            fileSize = int(meta.getheaders("Content-Length")[0])
-                            fullPath = '%s/%s%s' % (fixedUrl, item.remote_id, filename[1])
-                            print(fullPath)
-
-                            # set the resource data for the dataset
-                            dataset.resources.append(Resource(
-                                title = dataset.title
-                                , description = 'Ficheiro original (%s)' % (item.kwargs['filePath'])
-                                , url = fullPath
-                                , mime = 'application/vnd.ms-excel'
-                                , format = filename[1][1:]
-                                , filesize = fileSize
-                                , created_at = item.kwargs['createdOn']
-                            ))
-                    except KeyError:
-                        print('************ Error ************')
-                        print(traceback.format_exc())
-                        print('*******************************')
+                    originalFile = originalDownload.result()
+                    fullPath = '%s/%s' % (fixedUrl, filenameOriginal)
+                    print(fullPath)
+
+                    # set the resource data for the dataset
+                    dataset.resources.append(Resource(
+                        title = dataset.title
+                        , description = 'Ficheiro original (%s)' % (kwargs['filePath'])
+                        , url = fullPath
+                        , mime = 'application/vnd.ms-excel'
+                        , format = filename[1][1:]
+                        , filesize = originalFile.size
+                        , checksum = Checksum(type='sha256', value=originalFile.checksum)
+                        , created_at = kwargs['createdOn']
+                    ))
 
                 # file not found exception
                 except IOError as ex:
                     print('Original file not found:')
                     print(ex)
-            
             # ********************************************************
 
             print('--')
             print('Returning %s' % dataset.title)
             print('------------------------------------')
-            with open(REPORT_FILE_PATH, 'a') as csvResFile:
-                writer = csv.writer(csvResFile, delimiter=chr(9), quotechar=chr(34), quoting=csv.QUOTE_MINIMAL)
-                writer.writerow([
-                    item.remote_id
-                    , dataset.title
-                    , orgObj.name
-                    , json.dumps(dataset.tags, ensure_ascii=False)
-                    , item.kwargs['filePath']
-                    , filenameXml
-                    , ''
-                    , '[]'
-                ])
+            self.write_report([
+                item.remote_id
+                , dataset.title
+                , orgObj.name
+                , json.dumps(dataset.tags, ensure_ascii=False)
+                , kwargs['filePath']
+                , filenameXml
+                , ''
+                , '[]'
+            ])
 
             # update the number of datasets associated with this organization
-            orgObj.metrics['datasets'] += 1
-            orgObj.save()
+            self.organizations.increment(orgObj, 'datasets')
 
             return dataset
 
         print('No data returned from the API for the dataset %s' % (item.remote_id))
-        with open(REPORT_FILE_PATH, 'a') as csvResFile:
-            writer = csv.writer(csvResFile, delimiter=chr(9), quotechar=chr(34), quoting=csv.QUOTE_MINIMAL)
-            writer.writerow([
-                item.remote_id
-                , ''
-                , ''
-                , ''
-                , item.kwargs['filePath']
-                , ''
-                , ''
-                , '[]'
-            ])
-
-        return None
\ No newline at end of file
+        self.write_report([
+            item.remote_id
+            , ''
+            , ''
+            , ''
+            , kwargs['filePath']
+            , ''
+            , ''
+            , '[]'
+        ])
+
+        raise HarvestSkipException('No data returned from the API')
\ No newline at end of file
@@ -1,5 +1,5 @@
-from udata.harvest.backends.base import BaseBackend
-
-class DGBaseBackend(BaseBackend):
-    def __init__(self, source, job=None, dryrun=False, max_items=None):
-        super(DGBaseBackend, self).__init__(source, job, False, None)
\ No newline at end of file
+from .base import PTBaseBackend
+
+class DGBaseBackend(PTBaseBackend):
+    def __init__(self, source_or_job, dryrun=False, max_items=None):
+        super(DGBaseBackend, self).__init__(source_or_job, dryrun=False, max_items=None)
\ No newline at end of file
@@ -1,81 +1,147 @@
-from udata.harvest.backends.base import BaseBackend
-from udata.models import Resource, Dataset, License
-import requests
+from udata.models import Dataset
 # from urllib.parse import urlparse
 import urllib.parse as urlparse
+import logging
+import re
 from datetime import datetime
 
-from udata.harvest.models import HarvestItem
+import ijson
+from ijson.common import ObjectBuilder
 
-# backend = 'https://snig.dgterritorio.gov.pt/rndg/srv/por/q?_content_type=json&fast=index&from=1&resultType=details&sortBy=referenceDateOrd&type=dataset%2Bor%2Bseries&dataPolicy=Dados%20abertos&keyword=DGT'
+from udata.harvest.backends.base import HarvestExtraConfig
+from udata.harvest.models import HarvestItem
+from udata.i18n import lazy_gettext as _
 
+from .base import PTBaseBackend
+from .tools.resources import ResourceReconciler
 
-class DGTBackend(BaseBackend):
-    display_name = 'Harvester DGT'
+log = logging.getLogger(__name__)
 
-    def inner_harvest(self):
+# backend = 'https://snig.dgterritorio.gov.pt/rndg/srv/por/q?_content_type=json&fast=index&from=1&resultType=details&sortBy=referenceDateOrd&type=dataset%2Bor%2Bseries&dataPolicy=Dados%20abertos&keyword=DGT'
 
+# GeoNetwork links are `name|description|url|protocol|format|...` strings
+LINK_RE = re.compile(r'^[^|]*\|[^|]*\|(?P<url>[^|]*)\|(?P<type>[^|]*)\|(?P<format>[^|]*)')
+
+# OGC services URLs give their type in the `service` query parameter
+SERVICE_RE = re.compile(r'[?&]service=([^&#]+)')
+
+
+def parse_links(value):
+    '''Parse the GeoNetwork `link` value (a string or a list of strings)'''
+    if isinstance(value, str):
+        value = [value]
+    links = []
+    for link in value or []:
+        match = LINK_RE.match(link) if isinstance(link, str) else None
+        if match:
+            links.append(match.groupdict())
+        else:
+            log.debug('Skip malformed link %r', link)
+    return links
+
+
+def resource_format(url):
+    '''The OGC service type of an URL or its extension'''
+    match = SERVICE_RE.search(url)
+    if match:
+        return urlparse.unquote_plus(match.group(1))
+    return url.split('.')[-1]
+
+
+def iter_metadata(stream):
+    '''
+    Decode the `metadata` records of a GeoNetwork JSON response one at a time.
+
+    `metadata` is a list, or a single object when there is only one result.
+    '''
+    builder = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None:
+            if event == 'start_map' and prefix in ('metadata', 'metadata.item'):
+                builder, root = ObjectBuilder(), prefix
+                builder.event(event, value)
+        else:
+            builder.event(event, value)
+            if event == 'end_map' and prefix == root:
+                yield builder.value
+                builder = None
+
+
+class DGTBackend(PTBaseBackend):
+    display_name = 'Harvester DGT'
+    incremental = True
+    extra_configs = PTBaseBackend.extra_configs + (
+        HarvestExtraConfig(_('Page size'), 'page_size', int,
+                           _('Number of records requested per GeoNetwork query')),
+    )
+
+    # Default number of records requested per GeoNetwork query
+    PAGE_SIZE = 100
+
+    def iter_datasets(self):
+        page_size = self.get_config_value('page_size', self.PAGE_SIZE)
+        start = self.cursor or 1
+        while True:
+            self.checkpoint(start)
+            count = 0
+            for each in self.iter_page(start, start + page_size - 1):
+                count += 1
+                yield self.parse_record(each)
+            if count < page_size:
+                break
+            start += page_size
+
+    def iter_page(self, start, end):
+        '''The metadata records from the `start` to the `end` one (1-based, inclusive)'''
+        url = urlparse.urlparse(self.source.url)
+        # `from` and `to` may already be in the source URL
+        params = [(k, v) for k, v in urlparse.parse_qsl(url.query) if k not in ('from', 'to')]
+        params += [('from', start), ('to', end)]
+        if self.since:
+            # Only list records changed since the last harvest
+            params.append(('dateFrom', self.since.strftime('%Y-%m-%d')))
         headers = {
             'content-type': 'application/json',
             'Accept-Charset': 'utf-8'
         }
-        res = requests.get(self.source.url, headers=headers)
-        res.encoding = 'utf-8'
-        metadata = res.json().get("metadata")
-
-        # Loop through the metadata and process each item
-        for each in metadata:
-            item = {
-                "remote_id": each.get("geonet:info", {}).get("uuid"),
-                "title": each.get("defaultTitle"),
-                "description": each.get("defaultAbstract"),
-                "resources": each.get("link"),
-                "keywords": each.get("keyword")
-            }
-            # if each.get("publicationDate"):
-            #    item["date"] = datetime.strptime(each.get("publicationDate"),
-            #                                     "%Y-%m-%d")
-
-            links = []
-            resources = item.get("resources")
-
-            # Checks if resources is a list or string and processes accordingly
-            if isinstance(resources, list):
-                for url in resources:
-                    url_parts = url.split('|')
-                    inner_link = {}
-                    inner_link['url'] = url_parts[2]
-                    inner_link['type'] = url_parts[3]
-                    inner_link['format'] = url_parts[4]
-                    links.append(inner_link)
-
-            elif isinstance(resources, str):
-                url_parts = resources.split('|')
-                inner_link = {}
-                inner_link['url'] = url_parts[2]
-                inner_link['type'] = url_parts[3]
-                inner_link['format'] = url_parts[4]
-                links.append(inner_link)
-
-            item['resources'] = links
-
-            # self.add_item(item["remote_id"], item=item)
-            self.process_dataset(item["remote_id"], items=item)
+        res = self.get(url._replace(query='').geturl(), headers=headers, params=params,
+                       stream=True)
+        res.raise_for_status()
+        res.raw.decode_content = True
+        try:
+            yield from iter_metadata(res.raw)
+        finally:
+            res.close()
+
+    def parse_record(self, each):
+        info = each.get("geonet:info", {})
+        self.track_modified(info.get("changeDate"))
+        item = {
+            "remote_id": info.get("uuid"),
+            "title": each.get("defaultTitle"),
+            "description": each.get("defaultAbstract"),
+            "resources": parse_links(each.get("link")),
+            "keywords": each.get("keyword")
+        }
+        # if each.get("publicationDate"):
+        #    item["date"] = datetime.strptime(each.get("publicationDate"),
+        #                                     "%Y-%m-%d")
+        return item["remote_id"], {'items': item}
 
     def inner_process_dataset(self, item: HarvestItem, **kwargs):
         """Process harvested data into a dataset"""
-        dataset = self.get_dataset(item.remote_id)
         # Here you comes your implementation. You should :
         # - fetch the remote dataset (if necessary)
         # - validate the fetched payload
         # - map its content to the dataset fields
         # - store extra significant data in the `extra` attribute
         # - map resources data
+        dataset = self.get_dataset_if_changed(item, kwargs.get('items'))
         item = kwargs.get('items')
 
         # Set basic dataset fields
         dataset.title = item['title']
-        dataset.license = License.guess('cc-by')
+        dataset.license = self.guess_license('cc-by')
         dataset.tags = ["snig.dgterritorio.gov.pt"]
         dataset.description = item['description']
 
@@ -86,24 +152,14 @@ class DGTBackend(BaseBackend):
         for keyword in item.get('keywords'):
             dataset.tags.append(keyword)
 
-        # Recreate all resources
-        # Force recreation of all resources
-        dataset.resources = []
-
+        # Resources are matched by URL: unchanged ones are not written again
+        resources = ResourceReconciler(dataset, 'url')
         for resource in item.get("resources"):
-
-            parsed = urlparse.urlparse(resource['url'])
-            try:
-                format = str(urlparse.parse_qs(parsed.query)['service'][0])
-            except KeyError:
-                format = resource['url'].split('.')[-1]
-
-            new_resource = Resource(title=item['title'],
-                                    url=resource['url'],
-                                    filetype='remote',
-                                    format=format)
-
-            dataset.resources.append(new_resource)
+            resources.update(resource['url'],
+                             title=item['title'],
+                             filetype='remote',
+                             format=resource_format(resource['url']))
+        resources.remove_stale()
 
         # Add extra metadata
         dataset.extras['harvest:name'] = self.source.name
@@ -1,43 +1,49 @@
-from udata.models import db, Resource, License
-
-from udata.harvest.backends.base import BaseBackend
+from udata.models import db
 
 from datetime import datetime
-from xml.dom import minidom, Node
-import requests
 
 from udata.harvest.models import HarvestItem
 
-class INEBackend(BaseBackend):
+from .base import PTBaseBackend
+from .tools.resources import ResourceReconciler
+from .tools.xmlstream import iter_elements, iter_response_elements, localname
+
+class INEBackend(PTBaseBackend):
     display_name = 'Instituto nacional de estatística'
 
-    def inner_harvest(self):
+    # Each indicator metadata is fetched from this URL
+    INDICATOR_URL = 'https://www.ine.pt/ine/xml_indic.jsp'
+
+    def iter_datasets(self):
         try:
             from ineDatasets import datasetIds
         except :
             datasetIds = set([])
 
-        req = requests.get(self.source.url)
-        doc = minidom.parseString(req.content)
-
-        properties = doc.getElementsByTagName('indicator')
+        # The catalogue lists thousands of indicators: parse it as it streams in
+        response = self.get(self.source.url, stream=True)
+        for indicator in iter_response_elements(response, 'indicator'):
+            datasetIds.add(indicator.get('id'))
 
-        for propNode in properties:
-            currentId = propNode.attributes['id'].value
-            datasetIds.add(currentId)
-
-        for dsId in datasetIds:
+        # Sorted so the position in the list can be resumed from
+        datasetIds = sorted(datasetIds)
+        start = self.cursor or 0
+        for index, dsId in enumerate(datasetIds[start:], start):
+            self.checkpoint(index)
             #self.add_item(dsId)
-            self.process_dataset(dsId)
+            yield dsId, {}
+
+    def iter_retry(self, remote_ids):
+        # Indicators are fetched by id: no need to list them all
+        for remote_id in remote_ids:
+            yield remote_id, {}
 
     def inner_process_dataset(self, item: HarvestItem):
         '''Return the INE datasets'''
 
-        dataset = self.get_dataset(item.remote_id)
-
        # get remote data for dataset
-        req = requests.get(
-            "https://www.ine.pt/ine/xml_indic.jsp"
+        req = self.get(
+            self.INDICATOR_URL
             , params={ 
                 'varcd': item.remote_id
                 , 'lang': 'PT' 
@@ -47,28 +53,23 @@ class INEBackend(BaseBackend):
         )
 
         returnedData = req.content
+        dataset = self.get_dataset_if_changed(item, returnedData)
         print('Get metadata for %s' % (item.remote_id))
 
         keywordSet = set()
-        dataset.license = License.guess('cc-by')
-        dataset.resources = []
-        doc = minidom.parseString(returnedData)
-        properties = doc.getElementsByTagName('indicator')
+        dataset.license = self.guess_license('cc-by')
+        # Resources are matched by URL: unchanged ones are not written again
+        resources = ResourceReconciler(dataset, 'url')
         # go through the API dataset information
-        for propNode in properties:
-            for childNode in propNode.childNodes:
-                # print childNode
-                fc = childNode.firstChild
-                if fc:
-                    if childNode.nodeName == 'keywords':
-                        for obj in childNode.childNodes:
-                            # INE needs to create a proper xml file...
-                            valueData = obj.nodeValue
-                            # need to ignore the ',' nodes
-                            if obj.nodeValue != ',':
-                                # need to ignore the last "," usually after the INE value
-                                if valueData[-1:] == ',':
-                                    valueData = valueData[:-1]
+        for indicator in iter_elements(returnedData, 'indicator'):
+            for childNode in indicator:
+                name = localname(childNode)
+                if childNode.text or len(childNode):
+                    if name == 'keywords':
+                        # INE needs to create a proper xml file...
+                        for valueData in (childNode.text or '').split(','):
+                            # need to ignore the empty values between and after the ","
+                            if valueData:
                                 # this removes redundant keywords that sometimes show with different cases (lower and upper)
                                 keywordSet.add(valueData.lower())
 
@@ -76,33 +77,34 @@ class INEBackend(BaseBackend):
                         dataset.tags.append('ine.pt')
                         dataset.frequency = 'unknown'
 
-                    elif childNode.nodeName == 'title':
-                        dataset.title = fc.nodeValue
+                    elif name == 'title':
+                        dataset.title = childNode.text
 
-                    elif childNode.nodeName == 'description':
-                        dataset.description = fc.nodeValue
+                    elif name == 'description':
+                        dataset.description = childNode.text
 
-                    elif childNode.nodeName == 'html':
-                        for obj in childNode.childNodes:
-                            if obj.nodeName == 'bdd_url':
-                                dataset.description += "\n " + obj.firstChild.nodeValue
+                    elif name == 'html':
+                        for obj in childNode:
+                            if localname(obj) == 'bdd_url':
+                                dataset.description += "\n " + obj.text
 
-                    elif childNode.nodeName == 'json':
-                        for obj in childNode.childNodes:
-                            if obj.nodeName == 'json_dataset':
-                                dataset.resources.append(Resource(
-                                    title = 'Dataset json url'
+                    elif name == 'json':
+                        for obj in childNode:
+                            if localname(obj) == 'json_dataset':
+                                resources.update(
+                                    obj.text
+                                    , title = 'Dataset json url'
                                     , description = 'Dataset em formato json'
-                                    , url = obj.firstChild.nodeValue
                                     , filetype='remote'
                                     , format = 'json'
-                                ))
-                            elif obj.nodeName == 'json_metainfo':
-                                dataset.resources.append(Resource(
-                                    title = 'Json metainfo url'
+                                )
+                            elif localname(obj) == 'json_metainfo':
+                                resources.update(
+                                    obj.text
+                                    , title = 'Json metainfo url'
                                     , description = 'Metainfo em formato json'
-                                    , url = obj.firstChild.nodeValue
                                     , filetype='remote'
                                     , format = 'json'
-                                ))
+                                )
+        resources.remove_stale()
         return dataset
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 import logging
 import re
+import threading
 
 from collections import OrderedDict
 from urllib.parse import urljoin
@@ -8,14 +9,16 @@ from urllib.parse import urljoin
 from lxml import etree, html
 from voluptuous import Schema, Optional, All, Any, Lower, In, Length
 
-from udata.models import db, License, Resource, Checksum, SpatialCoverage
-from udata.harvest.backends import BaseBackend
+from udata.models import db, License, Checksum, SpatialCoverage
 from udata.harvest.filters import (
     boolean, email, to_date, taglist, force_list, normalize_string, is_url
 )
 from udata.harvest.models import HarvestItem
 from udata.utils import get_by
 
+from .base import PTBaseBackend
+from .tools.resources import ResourceReconciler
+
 
 log = logging.getLogger(__name__)
 
@@ -119,38 +122,65 @@ def dictize(element):
     return element.tag, OrderedDict(extract(element)) or element.text
 
 
-class MaafBackend(BaseBackend):
+_xsd = None
+# Compilation and validation are not thread-safe
+_xsd_lock = threading.Lock()
+
+
+def get_xsd():
+    '''The descriptors XML schema, compiled once per process'''
+    global _xsd
+    if _xsd is None:
+        with _xsd_lock:
+            if _xsd is None:
+                with open(XSD_PATH) as f:
+                    doc = etree.parse(f)
+                _xsd = etree.XMLSchema(doc)
+    return _xsd
+
+
+class MaafBackend(PTBaseBackend):
     display_name = 'MAAF'
     verify_ssl = False
 
-    def inner_harvest(self):
-        '''Parse the index pages HTML to find link to dataset descriptors'''
-        directories = [self.source.url]
-        while directories:
-            directory = directories.pop(0)
-            response = self.get(directory)
-            root = html.fromstring(response.text)
-            for link in root.xpath('//ul/li/a')[1:]:  # Skip parent directory.
-                href = link.get('href')
-                if href.endswith('/'):
-                    directories.append(urljoin(directory, href))
-                elif href.lower().endswith('.xml'):
-                    # We use the URL as `remote_id` for now, we'll be replace at
-                    # the beginning of the process
-                    self.process_dataset(urljoin(directory, href))
-                    if self.is_done():
-                        return
-                else:
-                    log.debug('Skip %s', href)
+    def iter_datasets(self):
+        '''Crawl the index pages HTML to find link to dataset descriptors'''
+        # Descriptors are processed while the next directories are listed
+        for url in self.crawl(self.list_directory, [self.source.url]):
+            # We use the URL as `remote_id` for now, we'll be replace at
+            # the beginning of the process
+            yield url, {}
+
+    def iter_retry(self, remote_ids):
+        # Listed remote ids are the descriptors URLs: no need to crawl again
+        for remote_id in remote_ids:
+            yield remote_id, {}
+
+    def list_directory(self, directory):
+        '''The subdirectories and dataset descriptors URLs of an index page'''
+        response = self.get(directory)
+        root = html.fromstring(response.text)
+        directories, descriptors = [], []
+        for link in root.xpath('//ul/li/a')[1:]:  # Skip parent directory.
+            href = link.get('href')
+            if href.endswith('/'):
+                directories.append(urljoin(directory, href))
+            elif href.lower().endswith('.xml'):
+                descriptors.append(urljoin(directory, href))
+            else:
+                log.debug('Skip %s', href)
+        return directories, descriptors
 
     def inner_process_dataset(self, item: HarvestItem):
         response = self.get(item.remote_id)
+        # Revalidated descriptors are neither validated nor parsed again
+        self.skip_if_cached(item, response)
         xml = self.parse_xml(response.content)
         metadata = xml['metadata']
 
         # Replace the `remote_id` from the URL to `id`.
         item.remote_id = metadata['id']
-        dataset = self.get_dataset(item.remote_id)
+        dataset = self.get_dataset_if_changed(item, response.content)
 
         dataset.title = metadata['title']
         dataset.frequency = FREQUENCIES.get(metadata['frequency'], 'unknown')
@@ -159,7 +189,9 @@ class MaafBackend(BaseBackend):
         dataset.tags = sorted(set(metadata['tags']))
 
         if metadata.get('license_id'):
-            dataset.license = License.objects.get(id=metadata['license_id'])
+            license_id = metadata['license_id']
+            dataset.license = self.memoized('licenses', ('id', license_id),
+                                            lambda: License.objects.get(id=license_id))
 
         if (metadata.get('temporal_coverage_from') and
                 metadata.get('temporal_coverage_to')):
@@ -180,26 +212,29 @@ class MaafBackend(BaseBackend):
                 dataset.spatial.zones = [
                     ZONES[metadata['territorial_coverage_code']]]
 
-        dataset.resources = []
+        # Resources are matched by URL: unchanged ones are not written again
+        resources = ResourceReconciler(dataset, 'url')
         cle = get_by(metadata['resources'], 'format', 'cle')
+        checksum = None
         for row in metadata['resources']:
             if row['format'] == 'cle':
                 continue
             else:
-                resource = Resource(
+                resource = resources.update(
+                    row['url'],
                     title=row['name'],
                     description=(
                         row['description'] + '\n\n' + SSL_COMMENT).strip(),
                     filetype='remote',
-                    url=row['url'],
                     format=row['format']
                 )
                 if resource.format == 'csv' and cle:
-                    resource.checksum = Checksum(
-                        type='sha256', value=self.get(cle['url']).text)
+                    # Fetched once per descriptor, whatever the number of CSV resources
+                    checksum = checksum or self.get(cle['url']).text
+                    resource.checksum = Checksum(type='sha256', value=checksum)
                 if row.get('last_modified'):
                     resource.last_modified_internal = row['last_modified']
-                dataset.resources.append(resource)
+        resources.remove_stale()
 
         if metadata.get('author'):
             dataset.extras['author'] = metadata['author']
@@ -216,14 +251,13 @@ class MaafBackend(BaseBackend):
 
     def parse_xml(self, xml):
         root = etree.fromstring(xml)
-        self.xsd.validate(root)
+        # Compiled before taking the lock: `get_xsd()` takes it too
+        xsd = self.xsd
+        with _xsd_lock:
+            xsd.validate(root)
         _, tree = dictize(root)
         return self.validate(tree, schema)
 
     @property
     def xsd(self):
-        if not getattr(self, '_xsd', None):
-            with open(XSD_PATH) as f:
-                doc = etree.parse(f)
-            self._xsd = etree.XMLSchema(doc)
-        return self._xsd
+        return get_xsd()
@@ -1,19 +1,21 @@
 import mimetypes
 import os
 
+from itertools import chain
+
 from dateutil.parser import parse as parse_date
 
-from udata.frontend.markdown import parse_html
 from udata.i18n import gettext as _
-from udata.harvest.backends.base import BaseBackend, HarvestFilter, HarvestFeature
+from udata.harvest.backends.base import HarvestExtraConfig, HarvestFilter, HarvestFeature
 from udata.harvest.exceptions import HarvestSkipException
-from udata.models import License, Resource, Organization
-from udata.utils import get_by
 
 from urllib.parse import urlparse
 
 from udata.harvest.models import HarvestItem
 
+from .base import PTBaseBackend
+from .tools.resources import ResourceReconciler
+
 def guess_format(mimetype, url=None):
     '''
     Guess a file format given a MIME type and/or an url
@@ -38,9 +40,10 @@ def guess_mimetype(mimetype, url=None):
         return mime
 
 
-class OdsBackendPT(BaseBackend):
+class OdsBackendPT(PTBaseBackend):
     display_name = 'OpenDataSoft PT'
     verify_ssl = False
+    incremental = True
     filters = (
         HarvestFilter(_('Tag'), 'tags', str, _('A tag name')),
         HarvestFilter(_('Publisher'), 'publisher', str, _('A publisher name')),
@@ -49,6 +52,13 @@ class OdsBackendPT(BaseBackend):
         HarvestFeature('inspire', _('Harvest Inspire datasets'),
                        _('Whether this harvester should import datasets coming from Inspire')),
     )
+    extra_configs = PTBaseBackend.extra_configs + (
+        HarvestExtraConfig(_('Page size'), 'page_size', int,
+                           _('Number of datasets requested per search call')),
+    )
+
+    # Default number of datasets requested per search call
+    PAGE_SIZE = 100
 
     # Map filters key to ODS facets
     FILTERS = {
@@ -99,37 +109,44 @@ class OdsBackendPT(BaseBackend):
     def export_url(self, dataset_id):
         return '{0}?tab=export'.format(self.explore_url(dataset_id))
 
-    def inner_harvest(self):
-        count = 0
-        nhits = None
-
-        def should_fetch():
-            if nhits is None:
-                return True
-            max_value = min(nhits, self.max_items) if self.max_items else nhits
-            return count < max_value
-
-        while should_fetch():
-            params = {
-                'start': count,
-                'rows': 50,
-                'interopmetas': 'true',
-            }
-            for f in self.get_filters():
-                ods_key = self.FILTERS.get(f['key'], f['key'])
-                op = 'exclude' if f.get('type') == 'exclude' else 'refine'
-                key = '.'.join((op, ods_key))
-                param = params.get(key, set())
-                param.add(f['value'])
-                params[key] = param
-            response = self.get(self.api_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            nhits = data['nhits']
+    def iter_datasets(self):
+        page_size = self.get_config_value('page_size', self.PAGE_SIZE)
+        offset = self.cursor or 0
+        first = self.search_datasets(offset, page_size)
+        nhits = first['nhits']
+        total = min(nhits, offset + self.max_items) if self.max_items else nhits
+        # `nhits` is known: remaining pages are requested in parallel
+        offsets = range(offset + page_size, total, page_size)
+        pages = chain([first], self.fetch_pages(
+            lambda start: self.search_datasets(start, page_size), offsets))
+        for start, data in zip(chain([offset], offsets), pages):
+            if not data['datasets']:
+                break
+            self.checkpoint(start)
             for dataset in data['datasets']:
-                count += 1
-                #self.add_item(dataset['datasetid'], dataset=dataset)
-                self.process_dataset(dataset['datasetid'], dataset=dataset)
+                self.track_modified(dataset['metas'].get('modified'))
+                yield dataset['datasetid'], {'dataset': dataset}
+
+    def search_datasets(self, start, rows):
+        params = {
+            'start': start,
+            'rows': rows,
+            'interopmetas': 'true',
+        }
+        for f in self.get_filters():
+            ods_key = self.FILTERS.get(f['key'], f['key'])
+            op = 'exclude' if f.get('type') == 'exclude' else 'refine'
+            key = '.'.join((op, ods_key))
+            param = params.get(key, set())
+            param.add(f['value'])
+            params[key] = param
+        if self.since:
+            # Only list datasets modified since the last harvest
+            params['q'] = 'modified>={0:%Y/%m/%d}'.format(self.since)
+        response = self.get(self.api_url, params=params)
+        response.raise_for_status()
+        with self.stage('parse'):
+            return response.json()
 
     def inner_process_dataset(self, item: HarvestItem, **kwargs):
         ods_dataset = kwargs.get('dataset')
@@ -145,12 +162,12 @@ class OdsBackendPT(BaseBackend):
             msg = 'Dataset {datasetid} has INSPIRE metadata'
             raise HarvestSkipException(msg.format(**ods_dataset))
 
-        dataset = self.get_dataset(item.remote_id)
+        dataset = self.get_dataset_if_changed(item, ods_dataset)
 
         dataset.title = ods_metadata['title']
         dataset.frequency = 'unknown'
         description = ods_metadata.get('description', '').strip()
-        dataset.description = parse_html(description)
+        dataset.description = self.parse_html(description)
         dataset.private = False
 
         # Detect Organization
@@ -159,17 +176,8 @@ class OdsBackendPT(BaseBackend):
         except KeyError:
             pass
         else:
-            orgObj = Organization.objects(acronym=organization_acronym).first()
-            if orgObj:
-                dataset.organization = orgObj
-            else:
-                orgObj = Organization()
-                orgObj.acronym = organization_acronym
-                orgObj.name = organization_acronym
-                orgObj.description = organization_acronym
-                orgObj.save()
-
-                dataset.organization = orgObj
+            with self.stage('organizations'):
+                dataset.organization = self.organizations.get_or_create(organization_acronym)
 
         tags = set()
         if 'keyword' in ods_metadata:
@@ -190,22 +198,24 @@ class OdsBackendPT(BaseBackend):
         dataset.tags.append(urlparse(self.source.url).hostname)
 
         # Detect license
-        default_license = dataset.license or License.default()
+        default_license = dataset.license or self.default_license()
         license_id = ods_metadata.get('license')
-        dataset.license = License.guess(license_id,
-                                        self.LICENSES.get(license_id),
-                                        default=default_license)
+        dataset.license = self.guess_license(license_id,
+                                             self.LICENSES.get(license_id),
+                                             default=default_license)
 
-        self.process_resources(dataset, ods_dataset, ('csv', 'json'))
+        with self.stage('resources'):
+            resources = ResourceReconciler(dataset, 'url')
+            self.process_resources(resources, ods_dataset, ('csv', 'json'))
 
-        if 'geo' in ods_dataset['features']:
-            exports = ['geojson']
-            if ods_metadata['records_count'] <= self.SHAPEFILE_RECORDS_LIMIT:
-                exports.append('shp')
-            self.process_resources(dataset, ods_dataset, exports)
+            if 'geo' in ods_dataset['features']:
+                exports = ['geojson']
+                if ods_metadata['records_count'] <= self.SHAPEFILE_RECORDS_LIMIT:
+                    exports.append('shp')
+                self.process_resources(resources, ods_dataset, exports)
 
-        self.process_extra_files(dataset, ods_dataset, 'alternative_export')
-        self.process_extra_files(dataset, ods_dataset, 'attachment')
+            self.process_extra_files(resources, ods_dataset, 'alternative_export')
+            self.process_extra_files(resources, ods_dataset, 'attachment')
 
         dataset.extras['ods:url'] = self.explore_url(dataset_id)
         dataset.extras['harvest:name'] = self.source.name
@@ -217,13 +227,13 @@ class OdsBackendPT(BaseBackend):
 
         return dataset
 
-    def process_extra_files(self, dataset, data, data_type):
+    def process_extra_files(self, resources, data, data_type):
         dataset_id = data['datasetid']
         modified_at = self.parse_date(data['metas']['modified'])
         plural_type = '{0}s'.format(data_type)
         for export in data.get(plural_type, []):
             url = self.extra_file_url(dataset_id, export['id'], plural_type)
-            created, resource = self.get_resource(dataset, url)
+            _, resource = resources.get_or_create(url)
             resource.title = export.get('title', 'No title')
             resource.description = export.get('description')
             resource.format = guess_format(export.get('mimetype'),
@@ -232,16 +242,8 @@ class OdsBackendPT(BaseBackend):
                                            export['url'])
             resource.modified = modified_at
             resource.extras['ods:type'] = data_type
-            if created:
-                dataset.resources.append(resource)
-
-    def get_resource(self, dataset, url):
-        resource = get_by(dataset.resources, 'url', url)
-        if not resource:
-            return True, Resource(url=url)
-        return False, resource
 
-    def process_resources(self, dataset, data, formats):
+    def process_resources(self, resources, data, formats):
         dataset_id = data['datasetid']
         ods_metadata = data['metas']
         modified_at = self.parse_date(ods_metadata['modified'])
@@ -249,7 +251,7 @@ class OdsBackendPT(BaseBackend):
         for _format in formats:
             label, udata_format, mime = self.FORMATS[_format]
             url = self.download_url(dataset_id, _format)
-            created, resource = self.get_resource(dataset, url)
+            _, resource = resources.get_or_create(url)
             resource.title = _('Export to {format}').format(format=label)
             resource.description = description
             resource.filetype = 'remote'
@@ -257,8 +259,6 @@ class OdsBackendPT(BaseBackend):
             resource.mime = mime
             resource.modified = modified_at
             resource.extras['ods:type'] = 'api'
-            if created:
-                dataset.resources.append(resource)
 
     def description_from_fields(self, fields):
         '''Build a resource description/schema from ODS API fields'''
@@ -0,0 +1,80 @@
+from flask import current_app
+from flask_mail import Message
+
+from udata.harvest import backends
+from udata.harvest.models import HarvestJob, HarvestSource
+from udata.models import Dataset, User, Role
+from udata.search import reindex
+from udata.tasks import get_logger, task
+
+from udata_front import theme
+
+log = get_logger(__name__)
+
+
+@task(route='low.harvest')
+def send_missing_datasets_warning(source_id, dataset_ids):
+    '''Reindex datasets hidden by a harvest reconciliation and notify the admins'''
+    source = HarvestSource.objects.get(id=source_id)
+    datasets = list(Dataset.objects(id__in=dataset_ids))
+
+    for dataset in datasets:
+        reindex.delay('Dataset', str(dataset.id))
+
+    org_recipients = [member.user.email for member in source.organization.members if member.role == 'admin']
+    admin_role = Role.objects.filter(name='admin').first()
+    recipients = [user.email for user in User.objects.filter(roles=admin_role).all()]
+
+    subject = 'Relatório harvesting dados.gov - {}.'.format(source)
+
+    context = {
+        'subject': subject,
+        'harvester': source,
+        'datasets': datasets,
+        'server': current_app.config.get('SERVER_NAME')
+    }
+
+    msg = Message(subject=subject, sender='dados@ama.pt', recipients=org_recipients, cc=['dados@ama.pt'], bcc=recipients)
+    msg.body = theme.render('mail/harvester_warning.txt', **context)
+    msg.html = theme.render('mail/harvester_warning.html', **context)
+
+    mail = current_app.extensions.get('mail')
+    try:
+        mail.send(msg)
+    except Exception:
+        log.exception('Unable to send missing datasets warning for %s', source.name)
+
+
+@task(route='low.harvest')
+def retry_failed_items(source_id):
+    '''Harvest again the items which failed in the last job of a source'''
+    source = HarvestSource.objects.get(id=source_id)
+    Backend = backends.get(current_app, source.backend)
+    backend = Backend(source)
+    backend.retry_failed = True
+    return backend.harvest()
+
+
+def get_job_backend(job_id):
+    job = HarvestJob.objects.get(id=job_id)
+    Backend = backends.get(current_app, job.source.backend)
+    return Backend(job)
+
+
+@task(route='low.harvest', acks_late=True, autoretry_for=(Exception,),
+      max_retries=3, retry_backoff=True)
+def harvest_shard(job_id, index, shard):
+    '''Process a shard of a sharded harvest job (safe to retry)'''
+    get_job_backend(job_id).harvest_shard(index, shard)
+
+
+@task(route='low.harvest')
+def finalize_sharded_job(job_id):
+    '''Finalize a sharded harvest job once all its shards are processed'''
+    get_job_backend(job_id).finalize_shards()
+
+
+@task(route='low.harvest')
+def fail_sharded_job(job_id):
+    '''Finalize a sharded harvest job when one of its shards failed'''
+    get_job_backend(job_id).finalize_shards(failed=True)
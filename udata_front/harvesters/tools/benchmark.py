@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+'''
+Local stand-ins for the remote catalogs harvested by the backends.
+
+Each server speaks the protocol of a backend and serves a synthetic catalog
+generated on the fly from the dataset index, so catalogs of any size
+use constant memory. Used by `udata harvest-tools benchmark`.
+'''
+import json
+import re
+import threading
+import time
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import UUID
+from xml.sax.saxutils import escape
+
+# Number of descriptors per MAAF directory
+DIRECTORY_SIZE = 100
+
+# Path of the requests counters
+STATS_PATH = '/__stats__'
+
+EPOCH = datetime(2020, 1, 1)
+
+CSW_CAPABILITIES = '''<?xml version="1.0" encoding="UTF-8"?>
+<csw:Capabilities xmlns:csw="http://www.opengis.net/cat/csw/2.0.2"
+    xmlns:ows="http://www.opengis.net/ows" xmlns:xlink="http://www.w3.org/1999/xlink"
+    version="2.0.2">
+  <ows:ServiceIdentification>
+    <ows:Title>Benchmark</ows:Title>
+    <ows:ServiceType>CSW</ows:ServiceType>
+    <ows:ServiceTypeVersion>2.0.2</ows:ServiceTypeVersion>
+  </ows:ServiceIdentification>
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetRecords">
+      <ows:DCP><ows:HTTP>
+        <ows:Get xlink:href="{url}"/>
+        <ows:Post xlink:href="{url}"/>
+      </ows:HTTP></ows:DCP>
+    </ows:Operation>
+  </ows:OperationsMetadata>
+</csw:Capabilities>'''
+
+CSW_RECORDS = '''<?xml version="1.0" encoding="UTF-8"?>
+<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2"
+    xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dct="http://purl.org/dc/terms/"
+    version="2.0.2">
+  <csw:SearchStatus timestamp="{now}"/>
+  <csw:SearchResults numberOfRecordsMatched="{matched}" numberOfRecordsReturned="{returned}"
+      nextRecord="{next}" elementSet="full">
+{records}
+  </csw:SearchResults>
+</csw:GetRecordsResponse>'''
+
+CSW_START_RE = re.compile(rb'startPosition="(\d+)"')
+CSW_MAX_RE = re.compile(rb'maxRecords="(\d+)"')
+
+
+def xml_element(tag, value):
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(value)))
+
+
+class SyntheticCatalog(object):
+    '''
+    A catalog of `size` datasets with `resources` resources each.
+
+    Everything is derived from the dataset index: the same catalog
+    is generated for the same parameters.
+    '''
+    def __init__(self, size, resources=3):
+        self.size = size
+        self.resources = resources
+
+    def identifier(self, index):
+        return str(UUID(int=index + 1))
+
+    def name(self, index):
+        return 'dataset-{0}'.format(index)
+
+    def modified(self, index):
+        return EPOCH + timedelta(minutes=index)
+
+    def organization(self, index):
+        return 'org-{0}'.format(index % 50)
+
+    def description(self, index):
+        return 'Synthetic dataset **{0}** used to benchmark the harvesters.\n\n{1}'.format(
+            index, 'Lorem ipsum dolor sit amet. ' * 10)
+
+    def resource_urls(self, index):
+        return ['https://example.org/{0}/resource-{1}.csv'.format(self.name(index), r)
+                for r in range(self.resources)]
+
+    def page(self, start, rows):
+        '''The indexes from the `start` one (0-based)'''
+        return range(max(0, start), min(self.size, max(0, start) + rows))
+
+    def ckan_package(self, index):
+        modified = self.modified(index).isoformat()
+        organization = self.organization(index)
+        return {
+            'id': self.identifier(index),
+            'name': self.name(index),
+            'title': 'Dataset {0}'.format(index),
+            'notes': self.description(index),
+            'license_id': 'cc-by',
+            'license_title': 'Creative Commons Attribution',
+            'tags': [{'id': str(UUID(int=t + 1)), 'name': 'tag-{0}'.format(t)}
+                     for t in range(index % 5)],
+            'metadata_created': EPOCH.isoformat(),
+            'metadata_modified': modified,
+            'organization': {
+                'id': organization,
+                'description': 'Organization {0}'.format(organization),
+                'created': EPOCH.isoformat(),
+                'title': organization.title(),
+                'name': organization,
+                'revision_timestamp': EPOCH.isoformat(),
+                'is_organization': True,
+                'state': 'active',
+                'image_url': '',
+                'revision_id': organization,
+                'type': 'organization',
+                'approval_status': 'approved',
+            },
+            'resources': [{
+                'id': str(UUID(int=(index + 1) * 1000 + position)),
+                'position': position,
+                'name': 'Resource {0}'.format(position),
+                'description': 'Resource {0} of dataset {1}'.format(position, index),
+                'format': 'CSV',
+                'mimetype': 'text/csv',
+                'size': 1024,
+                'hash': None,
+                'created': EPOCH.isoformat(),
+                'last_modified': modified,
+                'url': url,
+                'resource_type': 'file',
+            } for position, url in enumerate(self.resource_urls(index))],
+            'extras': [],
+            'private': False,
+            'type': 'dataset',
+            'author': None,
+            'author_email': None,
+            'maintainer': None,
+            'maintainer_email': None,
+            'state': 'active',
+        }
+
+    def ods_dataset(self, index):
+        name = self.name(index)
+        return {
+            'datasetid': name,
+            'has_records': True,
+            'features': [],
+            'fields': [{'label': 'Value', 'name': 'value', 'type': 'int'}],
+            'metas': {
+                'title': 'Dataset {0}'.format(index),
+                'description': self.description(index),
+                'publisher': self.organization(index),
+                'keyword': ['tag-{0}'.format(t) for t in range(index % 5)],
+                'theme': 'Theme {0}'.format(index % 10),
+                'modified': self.modified(index).isoformat() + '+00:00',
+                'license': 'Open Database License (ODbL)',
+                'records_count': 100,
+            },
+            'attachments': [{
+                'id': 'attachment-{0}'.format(position),
+                'title': 'Attachment {0}'.format(position),
+                'mimetype': 'text/csv',
+                'url': url,
+            } for position, url in enumerate(self.resource_urls(index))],
+        }
+
+    def csw_record(self, index):
+        urls = self.resource_urls(index) or ['https://example.org/{0}.wms'.format(index)]
+        return '<csw:Record>{0}</csw:Record>'.format(''.join([
+            xml_element('dc:identifier', self.identifier(index)),
+            xml_element('dc:title', 'Dataset {0}'.format(index)),
+            xml_element('dc:type', 'dataset'),
+            xml_element('dct:abstract', self.description(index)),
+            xml_element('dct:modified', self.modified(index).isoformat()),
+        ] + [
+            '<dct:references scheme="WWW:LINK">{0}</dct:references>'.format(escape(url))
+            for url in urls
+        ]))
+
+    def geonetwork_record(self, index):
+        return {
+            'geonet:info': {
+                'uuid': self.identifier(index),
+                'changeDate': self.modified(index).isoformat(),
+            },
+            'defaultTitle': 'Dataset {0}'.format(index),
+            'defaultAbstract': self.description(index),
+            'link': ['Resource|Resource {0}|{1}|WWW:DOWNLOAD|csv'.format(position, url)
+                     for position, url in enumerate(self.resource_urls(index))],
+            'keyword': ['tag-{0}'.format(t) for t in range(index % 5)],
+        }
+
+    def ine_indicator(self, index):
+        urls = self.resource_urls(index)
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<catalog><indicator id="{0}">'
+                '{1}{2}{3}<json>{4}</json></indicator></catalog>').format(
+            self.name(index),
+            xml_element('title', 'Indicator {0}'.format(index)),
+            xml_element('description', self.description(index)),
+            xml_element('keywords', ','.join('tag-{0}'.format(t) for t in range(index % 5))),
+            ''.join(xml_element('json_dataset' if position % 2 else 'json_metainfo', url)
+                    for position, url in enumerate(urls)),
+        )
+
+    def maaf_descriptor(self, index):
+        resources = ''.join(
+            '<resources>{0}{1}{2}{3}</resources>'.format(
+                xml_element('name', 'Resource {0}'.format(position)),
+                xml_element('description', 'Resource {0} of dataset {1}'.format(position, index)),
+                xml_element('format', 'csv'),
+                xml_element('url', url))
+            for position, url in enumerate(self.resource_urls(index)))
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<dataset><metadata>'
+                '{0}<extras><key>index</key><value>{1}</value></extras>{2}'
+                '<groups/>{3}<license_id>fr-lo</license_id><maintainer/><maintainer_email/>'
+                '{4}{5}<private>false</private>{6}<state/>{7}{8}'
+                '<temporal_coverage_from/><temporal_coverage_to/>'
+                '<territorial_coverage><territorial_coverage_code>country/fr'
+                '</territorial_coverage_code><territorial_coverage_granularity>pays'
+                '</territorial_coverage_granularity></territorial_coverage>{9}'
+                '</metadata></dataset>').format(
+            xml_element('author', 'Benchmark'), index,
+            xml_element('frequency', 'annuelle'),
+            xml_element('id', self.identifier(index)),
+            xml_element('notes', self.description(index)),
+            xml_element('organization', self.organization(index)),
+            resources,
+            xml_element('supplier', self.organization(index)),
+            xml_element('tags', ','.join('tag-{0}'.format(t) for t in range(1 + index % 5))),
+            xml_element('title', 'Dataset {0}'.format(index)),
+        )
+
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    '''Serve the catalog of the server in the protocol of its backend'''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlparse(self.path)
+        self.params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        if url.path == STATS_PATH:
+            return self.send_json(self.server.stats())
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        handler = getattr(self, 'serve_' + self.server.backend)
+        try:
+            handler(url.path)
+        except LookupError:
+            self.send_error(404)
+
+    def send(self, body, content_type):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if urlparse(self.path).path != STATS_PATH:
+            self.server.count(len(body))
+
+    def send_json(self, data):
+        self.send(json.dumps(data), 'application/json; charset=utf-8')
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def int_param(self, name, default=0):
+        return int(self.params.get(name) or default)
+
+    def serve_ckanpt(self, path):
+        action = path.rstrip('/').rsplit('/', 1)[-1]
+        if action == 'package_list':
+            result = [self.catalog.name(i) for i in range(self.catalog.size)]
+        elif action == 'package_search':
+            indexes = self.catalog.page(self.int_param('start'), self.int_param('rows', 10))
+            result = {
+                'count': self.catalog.size,
+                'results': [self.catalog.ckan_package(i) for i in indexes],
+            }
+        elif action == 'package_show':
+            name = self.params['id']
+            index = (int(name.rsplit('-', 1)[-1]) if name.startswith('dataset-')
+                     else UUID(name).int - 1)
+            result = self.catalog.ckan_package(index)
+        else:
+            raise LookupError(action)
+        self.send_json({'success': True, 'result': result})
+
+    def serve_odspt(self, path):
+        indexes = self.catalog.page(self.int_param('start'), self.int_param('rows', 10))
+        self.send_json({
+            'nhits': self.catalog.size,
+            'datasets': [self.catalog.ods_dataset(i) for i in indexes],
+        })
+
+    def serve_apambiente(self, path):
+        if self.command == 'GET':
+            url = 'http://{0}:{1}{2}'.format(*self.server.server_address, path)
+            return self.send(CSW_CAPABILITIES.format(url=url), 'application/xml')
+        start = CSW_START_RE.search(self.body)
+        rows = CSW_MAX_RE.search(self.body)
+        # CSW positions are 1-based
+        start = max(1, int(start.group(1)) if start else 1)
+        indexes = self.catalog.page(start - 1, int(rows.group(1)) if rows else 10)
+        end = start + len(indexes)
+        self.send(CSW_RECORDS.format(
+            now=datetime.utcnow().isoformat(),
+            matched=self.catalog.size,
+            returned=len(indexes),
+            next=end if end <= self.catalog.size else 0,
+            records='\n'.join(self.catalog.csw_record(i) for i in indexes),
+        ), 'application/xml')
+
+    def serve_dgt(self, path):
+        # `from` and `to` are 1-based and inclusive
+        start = self.int_param('from', 1)
+        indexes = self.catalog.page(start - 1, self.int_param('to', start) - start + 1)
+        self.send_json({
+            'summary': {'@count': str(self.catalog.size)},
+            'metadata': [self.catalog.geonetwork_record(i) for i in indexes],
+        })
+
+    def serve_ine(self, path):
+        if 'varcd' in self.params:
+            index = int(self.params['varcd'].rsplit('-', 1)[-1])
+            return self.send(self.catalog.ine_indicator(index), 'application/xml')
+        self.send('<?xml version="1.0" encoding="UTF-8"?>\n<catalog>{0}</catalog>'.format(
+            ''.join('<indicator id="{0}"/>'.format(self.catalog.name(i))
+                    for i in range(self.catalog.size))
+        ), 'application/xml')
+
+    def serve_maaf(self, path):
+        parts = [p for p in path.split('/') if p]
+        links = ['<li><a href="../">Parent Directory</a></li>']
+        if not parts:
+            directories = (self.catalog.size + DIRECTORY_SIZE - 1) // DIRECTORY_SIZE
+            links += ['<li><a href="d{0}/">d{0}/</a></li>'.format(d) for d in range(directories)]
+        elif len(parts) == 1:
+            directory = int(parts[0][1:])
+            indexes = self.catalog.page(directory * DIRECTORY_SIZE, DIRECTORY_SIZE)
+            links += ['<li><a href="{0}.xml">{0}.xml</a></li>'.format(i) for i in indexes]
+        else:
+            index = int(parts[1].split('.')[0])
+            return self.send(self.catalog.maaf_descriptor(index), 'application/xml')
+        self.send('<html><body><ul>{0}</ul></body></html>'.format(''.join(links)), 'text/html')
+
+
+class CatalogServer(ThreadingHTTPServer):
+    '''A local server exposing a `SyntheticCatalog` to the `backend` harvester'''
+    daemon_threads = True
+
+    # Path of the source URL harvested by each backend
+    SOURCE_PATHS = {
+        'ckanpt': '/',
+        'odspt': '/',
+        'apambiente': '/csw',
+        'dgt': '/q?_content_type=json&fast=index&resultType=details',
+        'ine': '/catalogue.xml',
+        'maaf': '/',
+    }
+
+    def __init__(self, backend, catalog, latency=0, address=('127.0.0.1', 0)):
+        if backend not in self.SOURCE_PATHS:
+            raise ValueError('Unsupported backend {0}'.format(backend))
+        super().__init__(address, CatalogHandler)
+        self.backend = backend
+        self.catalog = catalog
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    @property
+    def source_url(self):
+        return self.url + self.SOURCE_PATHS[self.backend]
+
+    def count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes': self.bytes}
+
+
+def serve(backend, size, resources, latency, queue):
+    '''Run a catalog server until killed, sending its URLs through `queue`'''
+    server = CatalogServer(backend, SyntheticCatalog(size, resources), latency)
+    queue.put((server.url, server.source_url))
+    server.serve_forever()
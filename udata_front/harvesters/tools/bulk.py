@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from bson import ObjectId
+from mongoengine import signals
+from mongoengine.fields import EmbeddedDocumentField, ListField
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+log = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def prepare(document, created=False):
+    '''The `Document.save()` steps before the write (signals, validation...)'''
+    model = type(document)
+    signals.pre_save.send(model, document=document)
+    document.validate()
+    signals.pre_save_post_validation.send(model, document=document, created=created)
+
+
+def identified_lists(model):
+    '''The `(name, db_field, id_db_field)` of the lists of embedded documents having an id'''
+    for name, field in model._fields.items():
+        if (isinstance(field, ListField) and isinstance(field.field, EmbeddedDocumentField)
+                and 'id' in field.field.document_type._fields):
+            yield name, field.db_field, field.field.document_type._fields['id'].db_field
+
+
+def update_operations(document):
+    '''
+    The targeted updates writing the changes of an existing document.
+
+    Changes are taken from the document delta. Lists of embedded documents
+    having an id (ie. resources) are not rewritten when they change:
+    removed items are `$pull`-ed, new ones `$push`-ed, and only the changed
+    fields of the others are `$set`. Each kind of change needs its own update,
+    because they would conflict on the list path. The updates commute, so
+    they can be written unordered.
+    '''
+    sets, unsets = document._delta()
+    operations = []
+    array_filters = []
+    for name, db_field, id_field in identified_lists(type(document)):
+        # The delta gives positional paths (`resources.0.title`) when only items changed
+        paths = [path for path in list(sets) + list(unsets)
+                 if path == db_field or path.startswith(db_field + '.')]
+        if not paths:
+            continue
+        for path in paths:
+            sets.pop(path, None)
+            unsets.pop(path, None)
+        items = getattr(document, name)
+        if db_field in paths:
+            # The list itself changed: items were added or removed
+            operations.append(UpdateOne({'_id': document.id}, {
+                '$pull': {db_field: {id_field: {'$nin': [item.id for item in items]}}}
+            }))
+            new = [item.to_mongo() for item in items if item._created]
+            if new:
+                operations.append(UpdateOne({'_id': document.id}, {
+                    '$push': {db_field: {'$each': new}}
+                }))
+        for item in items:
+            changed = set(path.split('.')[0] for path in item._get_changed_fields())
+            if item._created or not changed:
+                continue
+            identifier = 'i{0}'.format(len(array_filters))
+            array_filters.append({'.'.join((identifier, id_field)): item.id})
+            son = item.to_mongo()
+            # Changed fields are given by their database names
+            for item_field in changed:
+                path = '{0}.$[{1}].{2}'.format(db_field, identifier, item_field)
+                if son.get(item_field) is None:
+                    unsets[path] = 1
+                else:
+                    sets[path] = son[item_field]
+    update = {}
+    if sets:
+        update['$set'] = sets
+    if unsets:
+        update['$unset'] = unsets
+    if update:
+        operations.append(UpdateOne({'_id': document.id}, update,
+                                    array_filters=array_filters or None))
+    return operations
+
+
+def save_changes(document):
+    '''Like `Document.save()` for an existing document, with targeted updates'''
+    model = type(document)
+    prepare(document)
+    operations = update_operations(document)
+    if operations:
+        model._get_collection().bulk_write(operations, ordered=False)
+    written(document, False)
+
+
+def written(document, created):
+    '''The `Document.save()` steps after the write'''
+    for name, _, _ in identified_lists(type(document)):
+        for item in getattr(document, name):
+            item._created = False
+    document._clear_changed_fields()
+    document._created = False
+    signals.post_save.send(type(document), document=document, created=created)
+
+
+class BulkWriter(object):
+    '''
+    Accumulate documents and write them with unordered `bulk_write` calls.
+
+    Documents go through the same steps as `Document.save()`
+    (signals, validation, slug population...) but are written by chunks.
+    New documents are inserted with an upsert on their preassigned id,
+    existing ones only receive their changed fields.
+
+    Lists of embedded documents are updated item by item (see `update_operations()`).
+
+    `on_success(key, document)` and `on_error(key, document, exception)`
+    are called for each document once written.
+    '''
+    def __init__(self, model, size, on_success, on_error):
+        self.model = model
+        self.size = size
+        self.on_success = on_success
+        self.on_error = on_error
+        self.pending = []
+
+    def add(self, key, document):
+        '''Prepare a document for writing, validation errors are raised immediately'''
+        created = document._created or not document.id
+        if not document.id:
+            document.id = ObjectId()
+        prepare(document, created)
+        self.pending.append((key, document, created))
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def operations(self, document, created):
+        if created:
+            return [UpdateOne({'_id': document.id},
+                              {'$setOnInsert': document.to_mongo()},
+                              upsert=True)]
+        return update_operations(document)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        # The operations of each document are contiguous: keep the range of their indexes
+        operations, batch = [], []
+        for key, document, created in pending:
+            document_operations = self.operations(document, created)
+            if document_operations:
+                start = len(operations)
+                operations.extend(document_operations)
+                batch.append((key, document, created, range(start, len(operations))))
+            else:
+                self.succeed(key, document, created)
+        if not operations:
+            return
+
+        errors = {}
+        try:
+            self.model._get_collection().bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = {error['index']: error for error in e.details['writeErrors']}
+        log.debug('Wrote %s documents (%s errors)', len(batch), len(errors))
+
+        for key, document, created, indexes in batch:
+            error = next((errors[i] for i in indexes if i in errors), None)
+            if not error:
+                self.succeed(key, document, created)
+            elif error['code'] == DUPLICATE_KEY:
+                # Most likely two new documents got the same slug: let `save()` fix it
+                try:
+                    document.save()
+                except Exception as e:
+                    self.on_error(key, document, e)
+                else:
+                    self.on_success(key, document)
+            else:
+                self.on_error(key, document, Exception(error['errmsg']))
+
+    def succeed(self, key, document, created):
+        written(document, created)
+        self.on_success(key, document)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from udata.models import Dataset
+
+log = logging.getLogger(__name__)
+
+# Maximum number of datasets loaded by a single query
+LOAD_BATCH_SIZE = 100
+
+# The dataset extra holding the digest of the remote payload it was mapped from
+CONTENT_HASH = 'harvest:content_hash'
+
+
+class DatasetIndex(object):
+    '''
+    The datasets already harvested from a source, indexed by remote id.
+
+    Only their id, content hash, modification date and archival date are
+    loaded, with a single projected query on first use: checking whether a
+    remote dataset is known or unchanged is a dictionary hit.
+
+    Full documents are only loaded by `load()` for the datasets to update.
+    Concurrent calls are coalesced: the requests made while a query runs
+    are served by the next one, in `$in` batches of `LOAD_BATCH_SIZE`.
+    '''
+    def __init__(self, source):
+        self.source = source
+        self._entries = None
+        self._lock = threading.Lock()
+        self._query_lock = threading.Lock()
+        self._wanted = set()
+        self._loaded = {}
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self.load_entries()
+        return self._entries
+
+    def load_entries(self):
+        query = {'$or': [
+            {'harvest.source_id': str(self.source.id)},
+            {'harvest.domain': self.source.domain},
+        ]}
+        projection = {
+            'harvest.remote_id': 1,
+            'extras.' + CONTENT_HASH: 1,
+            'harvest.modified_at': 1,
+            'archived': 1,
+        }
+        entries = {}
+        for doc in Dataset._get_collection().find(query, projection):
+            harvest = doc.get('harvest') or {}
+            if harvest.get('remote_id'):
+                # Same as `get_dataset()`: the first matching dataset wins
+                entries.setdefault(harvest['remote_id'], {
+                    'id': doc['_id'],
+                    'content_hash': (doc.get('extras') or {}).get(CONTENT_HASH),
+                    'last_modified': harvest.get('modified_at'),
+                    'archived': doc.get('archived'),
+                })
+        log.debug('Indexed %s datasets of %s', len(entries), self.source.name)
+        return entries
+
+    def get(self, remote_id):
+        '''The `{id, content_hash, last_modified, archived}` of a known dataset or `None`'''
+        return self.entries.get(remote_id)
+
+    def add(self, remote_id, dataset):
+        '''Index a dataset written during the job'''
+        if not dataset.id:
+            return
+        with self._lock:
+            self.entries[remote_id] = {
+                'id': dataset.id,
+                'content_hash': dataset.extras.get(CONTENT_HASH),
+                'last_modified': getattr(dataset.harvest, 'modified_at', None),
+                'archived': dataset.archived,
+            }
+
+    def load(self, dataset_id):
+        '''The full dataset document or `None` if it has been deleted meanwhile'''
+        with self._lock:
+            self._wanted.add(dataset_id)
+        with self._query_lock:
+            with self._lock:
+                if dataset_id in self._loaded:
+                    return self._loaded.pop(dataset_id)
+                wanted = self._wanted
+                ids = [dataset_id] + list(wanted - {dataset_id})[:LOAD_BATCH_SIZE - 1]
+                self._wanted = wanted - set(ids)
+            datasets = dict((d.id, d) for d in Dataset.objects(id__in=ids))
+            with self._lock:
+                for id_ in ids[1:]:
+                    self._loaded[id_] = datasets.get(id_)
+        return datasets.get(dataset_id)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+PART_EXT = '.part'
+META_EXT = '.meta'
+
+CHUNK_SIZE = 1024 * 1024
+
+# The outcome of a download: `skipped` when the local file was already up to date
+Download = namedtuple('Download', ('path', 'size', 'checksum', 'skipped'))
+
+
+def read_meta(path):
+    try:
+        with open(path + META_EXT) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(path, meta):
+    tmp = path + META_EXT + PART_EXT
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path + META_EXT)
+
+
+def file_checksum(path, sha=None):
+    sha = sha or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha
+
+
+def finish(url, path, etag, size, checksum):
+    '''Move the complete `<path>.part` to `path` and record its metadata'''
+    os.replace(path + PART_EXT, path)
+    write_meta(path, {
+        'url': url,
+        'etag': etag,
+        'size': size,
+        'checksum': checksum,
+    })
+    return Download(path, size, checksum, False)
+
+
+def download(client, url, path, chunk_size=CHUNK_SIZE):
+    '''
+    Download `url` into `path` with constant memory usage.
+
+    The body is streamed by chunks into `<path>.part` and hashed (SHA-256)
+    on the fly, then atomically renamed to `path`.
+    A partial file left by an interrupted download is resumed with a `Range`
+    request, unless the remote file changed meanwhile. It is only moved
+    to `path` if it was already complete.
+    The remote `ETag` and size are kept in `<path>.meta`:
+    files already downloaded are not downloaded again if they still match.
+
+    `client` is an object with `head()` and `get()` methods
+    (ie. the harvest backend or its HTTP client).
+    '''
+    meta = read_meta(path)
+    head = client.head(url, allow_redirects=True)
+    etag = head.headers.get('ETag') if head.ok else None
+    length = head.headers.get('Content-Length') if head.ok else None
+    size = int(length) if length and length.isdigit() else None
+
+    up_to_date = (
+        (etag or size is not None)
+        and (not etag or meta.get('etag') == etag)
+        and (size is None or meta.get('size') == size)
+    )
+    if (up_to_date and meta.get('checksum') and os.path.exists(path)
+            and os.path.getsize(path) == meta.get('size')):
+        log.debug('%s is up to date', path)
+        return Download(path, meta['size'], meta['checksum'], True)
+
+    part = path + PART_EXT
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {}
+    # Only resume a partial download of the very same remote file
+    resumable = offset and etag and meta.get('partial_etag') == etag
+    if resumable and offset == size:
+        # Interrupted before being renamed: nothing left to download
+        log.debug('%s is already downloaded', part)
+        return finish(url, path, etag, offset, file_checksum(part).hexdigest())
+    elif resumable and (size is None or offset < size):
+        headers['Range'] = 'bytes={0}-'.format(offset)
+        headers['If-Range'] = etag
+    else:
+        offset = 0
+    write_meta(path, dict(meta, partial_etag=etag))
+
+    response = client.get(url, headers=headers, stream=True, cache=False)
+    if response.status_code == 416 and headers:
+        # The range can't be satisfied (ie. the remote size is unknown): start over
+        log.debug('Unable to resume %s: downloading it again', url)
+        response.close()
+        response = client.get(url, stream=True, cache=False)
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            log.debug('Resuming %s from byte %s', url, offset)
+            sha = file_checksum(part)
+            mode = 'ab'
+        else:
+            offset = 0
+            sha = hashlib.sha256()
+            mode = 'wb'
+        written = offset
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                sha.update(chunk)
+                written += len(chunk)
+    finally:
+        response.close()
+
+    return finish(url, path, response.headers.get('ETag') or etag, written, sha.hexdigest())
@@ -1,61 +1,49 @@
 # -*- coding: utf-8 -*-
 import logging
-from datetime import datetime
-from udata.i18n import lazy_gettext as _
 
-from flask import current_app, render_template
-from flask_mail import Message
+from udata.models import Dataset
 
-#from udata import theme
-from udata_front import theme
-from udata.models import (
-    Dataset, User, Role
-)
+from ..tasks import send_missing_datasets_warning
 
 log = logging.getLogger(__name__)
 
-'''
-Checks for missing datasets in source
-'''
-def missing_datasets_warning(job_items, source):
 
-    job_datasets = [item.dataset.id for item in job_items]
+def job_dataset_ids(job_items):
+    '''Collect the datasets ids referenced by job items without dereferencing them'''
+    ids = set()
+    for item in job_items:
+        ref = item._data.get('dataset')
+        if ref is not None:
+            # Either an ObjectId, a DBRef or an already dereferenced dataset
+            ids.add(getattr(ref, 'id', ref))
+    return ids
+
 
-    domain_harvested_datasets = Dataset.objects(__raw__={
-        'extras.harvest:domain': source.domain,
+'''
+Hides datasets missing in source
+'''
+def reconcile_missing_datasets(job_items, source):
+    # Failed items may still be published: their dataset can't be told apart from missing ones
+    unfinished = [item for item in job_items if item.status in ('failed', 'started')]
+    if unfinished:
+        log.warning('Not hiding datasets missing from %s: %s items failed',
+                    source.name, len(unfinished))
+        return []
+    # udata moved `extras.harvest:domain` into `harvest.domain`
+    query = {
+        'harvest.domain': source.domain,
         'private': False,
-        'deleted': None
-    }).all()
-    
-    missing_datasets = []
-    for dataset in domain_harvested_datasets:
-        if dataset.id not in job_datasets:
-            dataset.private = True
-            missing_datasets.append(dataset)
-            dataset.save()
-    
-    if missing_datasets:
-        org_recipients = [ member.user.email for member in source.organization.members if member.role == 'admin' ]
-        admin_role = Role.objects.filter(name='admin').first()
-        recipients = [ user.email for user in User.objects.filter(roles=admin_role).all() ]
-
-        #recipients = list(set(org_recipients + recipients))
-
-        subject = 'Relatório harvesting dados.gov - {}.'.format(source)
-
-        context = {
-            'subject': subject,
-            'harvester': source,
-            'datasets': missing_datasets,
-            'server': current_app.config.get('SERVER_NAME')
-        }
-
-        msg = Message(subject=subject, sender='dados@ama.pt', recipients=org_recipients, cc=['dados@ama.pt'], bcc=recipients)
-        msg.body = theme.render('mail/harvester_warning.txt', **context)
-        msg.html = theme.render('mail/harvester_warning.html', **context)
-
-        mail = current_app.extensions.get('mail')
-        try:
-            mail.send(msg)
-        except:
-            pass
+        'deleted': None,
+        '_id': {'$nin': list(job_dataset_ids(job_items))},
+        # Skipped items have no dataset but are still listed
+        'harvest.remote_id': {'$nin': [item.remote_id for item in job_items if item.remote_id]},
+    }
+    collection = Dataset._get_collection()
+    missing_ids = [d['_id'] for d in collection.find(query, {'_id': 1})]
+
+    if missing_ids:
+        collection.update_many({'_id': {'$in': missing_ids}}, {'$set': {'private': True}})
+        log.info('Hid %s datasets missing from %s', len(missing_ids), source.name)
+        send_missing_datasets_warning.delay(str(source.id), [str(i) for i in missing_ids])
+
+    return missing_ids
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from bisect import bisect_left
+from time import monotonic
+from urllib.parse import urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .ratelimit import AdaptiveLimiter
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class HostStats(object):
+    '''Requests counters and latency histogram for a single host'''
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.cached = 0
+        self.bytes = 0
+        self.duration = 0.
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, duration, response=None, streamed=False):
+        self.requests += 1
+        self.duration += duration
+        self.histogram[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        if response is None or response.status_code >= 400:
+            self.errors += 1
+        elif response.status_code == 304:
+            self.cached += 1
+        if response is not None:
+            retries = getattr(response.raw, 'retries', None)
+            if retries:
+                self.retries += len(retries.history)
+            if not streamed:
+                # Streamed bodies are counted as they are read (see `count_reads()`)
+                self.bytes += len(response.content)
+
+    def as_dict(self):
+        # Bucket bounds can't be used as Mongo keys (dots)
+        bounds = LATENCY_BUCKETS + (None,)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'cached': self.cached,
+            'bytes': self.bytes,
+            'duration': round(self.duration, 3),
+            'latency': [{'le': le, 'count': count} for le, count in zip(bounds, self.histogram)],
+        }
+
+
+def count_reads(raw, count):
+    '''
+    Call `count(size)` with the size of the data read from a streamed
+    urllib3 response, be it by `read()` (`response.raw`) or `iter_content()`.
+    '''
+    def counted(read):
+        def wrapper(*args, **kwargs):
+            data = read(*args, **kwargs)
+            count(len(data))
+            return data
+        return wrapper
+
+    def counted_chunks(read_chunked):
+        def wrapper(*args, **kwargs):
+            for data in read_chunked(*args, **kwargs):
+                count(len(data))
+                yield data
+        return wrapper
+
+    # Instance attributes take precedence over the methods called by `stream()`
+    for name in ('read', 'read1'):
+        if hasattr(raw, name):
+            setattr(raw, name, counted(getattr(raw, name)))
+    if hasattr(raw, 'read_chunked'):
+        raw.read_chunked = counted_chunks(raw.read_chunked)
+
+
+class HarvestHTTPClient(object):
+    '''
+    HTTP client shared by all the requests of a harvest job.
+
+    Each remote host gets its own `requests.Session` with a connection pool,
+    exponential backoff retries on 5xx and 429 responses and default timeouts.
+    Requests are counted and timed per host, the bytes of streamed responses
+    being counted as they are read.
+
+    Given an `HTTPCache`, GET requests are revalidated against the stored
+    responses and `304 Not Modified` are served from disk.
+    Every response has a `from_cache` attribute.
+
+    Requests to each host are throttled by an `AdaptiveLimiter`
+    built from `limits` (`rate`, `burst`, `concurrency`...).
+    '''
+    def __init__(self, timeout=(10, 60), retries=5, backoff=0.5, pool_size=10, cache=None,
+                 limits=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.limits = dict(limits or {})
+        self.limits.setdefault('concurrency', pool_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.limiters = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def session(self, host):
+        with self._lock:
+            if host not in self.sessions:
+                self.sessions[host] = self.create_session()
+                self.limiters[host] = AdaptiveLimiter(**self.limits)
+                self.stats[host] = HostStats()
+            return self.sessions[host]
+
+    def create_session(self):
+        session = requests.Session()
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # Harvesting only reads: all methods can be retried
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        return session
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        session = self.session(host)
+        limiter = self.limiters[host]
+        kwargs.setdefault('timeout', self.timeout)
+        limiter.acquire()
+        start = monotonic()
+        response = None
+        try:
+            response = session.request(method, url, **kwargs)
+            response.from_cache = False
+            if kwargs.get('stream') and response.raw is not None:
+                count_reads(response.raw, lambda size: self.count_bytes(host, size))
+            return response
+        finally:
+            duration = monotonic() - start
+            limiter.release(duration, response)
+            with self._lock:
+                self.stats[host].record(duration, response, kwargs.get('stream', False))
+
+    def count_bytes(self, host, size):
+        with self._lock:
+            self.stats[host].bytes += size
+
+    def get(self, url, cache=True, **kwargs):
+        if not cache or not self.cache or kwargs.get('stream'):
+            return self.request('GET', url, **kwargs)
+        full_url = self.cache.url_for(url, kwargs.pop('params', None))
+        entry = self.cache.get(full_url)
+        if entry:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.conditional_headers())
+        response = self.request('GET', full_url, **kwargs)
+        if entry and response.status_code == 304:
+            return self.cache.response(entry, response)
+        self.cache.store(full_url, response)
+        return response
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def report(self):
+        '''Per host stats, as a list because hosts can't be used as Mongo keys'''
+        with self._lock:
+            return [
+                dict(host=host, limiter=self.limiters[host].as_dict(), **stats.as_dict())
+                for host, stats in self.stats.items()
+            ]
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from time import time
+
+from requests import Request, Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+log = logging.getLogger(__name__)
+
+BODY_EXT = '.body'
+META_EXT = '.json'
+
+# Response headers kept along with the body
+STORED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+class CacheEntry(object):
+    '''A cached response: its metadata and the path to its body'''
+    def __init__(self, key, path, meta):
+        self.key = key
+        self.path = path
+        self.meta = meta
+
+    @property
+    def url(self):
+        return self.meta['url']
+
+    @property
+    def size(self):
+        return self.meta.get('size', 0)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    def read(self):
+        with open(self.path + BODY_EXT, 'rb') as f:
+            return f.read()
+
+
+class HTTPCache(object):
+    '''
+    A size-bounded on-disk cache of GET responses revalidated by the remote.
+
+    Responses having an `ETag` or a `Last-Modified` header are stored by URL
+    (query string included). The next request for the same URL is made
+    conditional and a `304 Not Modified` is answered from disk.
+
+    The least recently used entries are evicted once `max_size` bytes are exceeded.
+    '''
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def url_for(url, params=None):
+        '''The full URL of a request, with its query string'''
+        if isinstance(params, dict):
+            # Sets have no stable order across processes
+            params = {
+                key: sorted(value) if isinstance(value, (set, frozenset)) else value
+                for key, value in params.items()
+            }
+        return Request('GET', url, params=params).prepare().url
+
+    def key_for(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, url):
+        '''The cache entry for `url` or `None`'''
+        key = self.key_for(url)
+        path = self.path_for(key)
+        try:
+            with open(path + META_EXT) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(path + BODY_EXT):
+            return None
+        return CacheEntry(key, path, meta)
+
+    def entries(self):
+        '''Iterate over all the cache entries'''
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith(META_EXT):
+                    key = filename[:-len(META_EXT)]
+                    path = os.path.join(root, key)
+                    try:
+                        with open(path + META_EXT) as f:
+                            meta = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    yield CacheEntry(key, path, meta)
+
+    @property
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry.size for entry in self.entries())
+            return self._size
+
+    def store(self, url, response):
+        '''Store a `200 OK` response if it can be revalidated later'''
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+        content = response.content
+        if len(content) > self.max_size:
+            return
+        key = self.key_for(url)
+        path = self.path_for(key)
+        previous = self.get(url)
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': {
+                name: response.headers[name]
+                for name in STORED_HEADERS if name in response.headers
+            },
+            'size': len(content),
+            'stored': time(),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.write(path + BODY_EXT, content)
+        self.write(path + META_EXT, json.dumps(meta).encode('utf-8'))
+        delta = len(content) - (previous.size if previous else 0)
+        with self._lock:
+            if self._size is not None:
+                self._size += delta
+        if self.size > self.max_size:
+            self.evict()
+
+    def write(self, path, content):
+        # Atomic replacement: concurrent readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def touch(self, entry):
+        '''Mark an entry as recently used'''
+        try:
+            os.utime(entry.path + BODY_EXT)
+        except OSError:
+            pass
+
+    def response(self, entry, revalidation):
+        '''Build a `200 OK` response from a cache entry on a `304 Not Modified`'''
+        self.touch(entry)
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry.url
+        response.headers = CaseInsensitiveDict(entry.meta.get('headers', {}))
+        # Freshness headers sent with the 304 take precedence
+        for name in STORED_HEADERS:
+            if name in revalidation.headers:
+                response.headers[name] = revalidation.headers[name]
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.request = revalidation.request
+        response.elapsed = revalidation.elapsed
+        response._content = entry.read()
+        response.from_cache = True
+        return response
+
+    def evict(self, max_size=None):
+        '''Remove the least recently used entries until the cache fits in `max_size`'''
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            entries = []
+            for entry in self.entries():
+                try:
+                    used = os.path.getmtime(entry.path + BODY_EXT)
+                except OSError:
+                    used = 0
+                entries.append((used, entry))
+            entries.sort(key=lambda e: e[0])
+            size = sum(entry.size for _, entry in entries)
+            removed = 0
+            for _, entry in entries:
+                if size <= max_size:
+                    break
+                self.remove(entry)
+                size -= entry.size
+                removed += 1
+            self._size = size
+        if removed:
+            log.debug('Evicted %s entries from HTTP cache', removed)
+        return removed
+
+    def remove(self, entry):
+        for ext in (META_EXT, BODY_EXT):
+            try:
+                os.remove(entry.path + ext)
+            except OSError:
+                pass
+
+    def purge(self, pattern=None):
+        '''Remove all the entries or those whose URL contains `pattern`'''
+        removed = 0
+        for entry in list(self.entries()):
+            if pattern is None or pattern in entry.url:
+                self.remove(entry)
+                removed += 1
+        with self._lock:
+            self._size = None
+        return removed
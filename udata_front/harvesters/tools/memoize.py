@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+def content_key(value):
+    '''A short key for a possibly long text (ie. a description)'''
+    if not value:
+        return value
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+    '''
+    A bounded least recently used cache counting its hits and misses.
+
+    Values are computed outside of the lock: concurrent misses on the same key
+    may compute it twice but never block the other workers.
+    A `size` of 0 disables the cache.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        '''The value cached for `key` or the result of `compute()`'''
+        with self._lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                self.hits += 1
+                return self.values[key]
+            self.misses += 1
+        value = compute()
+        if self.size > 0:
+            with self._lock:
+                self.values[key] = value
+                self.values.move_to_end(key)
+                while len(self.values) > self.size:
+                    self.values.popitem(last=False)
+        return value
+
+    def report(self):
+        return cache_report(self.hits, self.misses)
+
+
+def cache_report(hits, misses):
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'ratio': round(hits / total, 3) if total else None,
+    }
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from collections import Counter, defaultdict
+
+from bson import ObjectId
+from mongoengine import signals
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from udata.models import Organization
+
+log = logging.getLogger(__name__)
+
+# Only those fields are needed to link datasets and update organizations
+PRELOADED_FIELDS = ('id', 'acronym', 'name', 'description', 'slug')
+
+# The organization created by the harvesters for each acronym, by `_id`
+CLAIMS_COLLECTION = 'harvest_organization_claim'
+
+
+class OrganizationResolver(object):
+    '''
+    Resolve organizations from their acronym during a harvest job.
+
+    All known acronyms are loaded in memory on first use so that each lookup
+    is a dictionary hit. Missing organizations are created once claimed:
+    parallel jobs can not create duplicates (see `upsert()`).
+
+    Metrics increments and fields updates are accumulated
+    and written in a single bulk write by `flush()`.
+    '''
+    def __init__(self):
+        self._organizations = None
+        self._increments = defaultdict(Counter)
+        self._updates = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @property
+    def organizations(self):
+        if self._organizations is None:
+            with self._lock:
+                if self._organizations is None:
+                    self._organizations = self.load()
+        return self._organizations
+
+    def load(self):
+        organizations = {}
+        qs = Organization.objects(acronym__nin=[None, '']).only(*PRELOADED_FIELDS)
+        # Keep the oldest one on duplicated acronyms
+        for org in qs.order_by('created_at'):
+            organizations.setdefault(org.acronym, org)
+        log.debug('Loaded %s organizations', len(organizations))
+        return organizations
+
+    def get(self, acronym):
+        return self.organizations.get(acronym)
+
+    def get_or_create(self, acronym, name=None, description=None):
+        org = self.get(acronym)
+        if org:
+            return org
+        with self._lock:
+            org = self.organizations.get(acronym)
+            if not org:
+                org = self.upsert(acronym, name or acronym, description or name or acronym)
+                self.organizations[acronym] = org
+        return org
+
+    def upsert(self, acronym, name, description):
+        '''
+        Insert an organization unless one with the same acronym already exists.
+
+        Acronyms are not unique (users edit them): the organization is inserted
+        then claimed for its acronym in `CLAIMS_COLLECTION`, whose `_id`
+        is unique. When another job claimed it first, the inserted
+        organization is removed and the claimed one is used instead.
+        '''
+        existing = self.find(acronym)
+        if existing:
+            return existing
+        org = Organization(id=ObjectId(), acronym=acronym, name=name, description=description)
+        # Same steps as `Document.save()`: populate slug and dates then validate
+        signals.pre_save.send(Organization, document=org)
+        org.validate()
+        collection = Organization._get_collection()
+        collection.insert_one(org.to_mongo())
+        winner = self.claim(acronym, org.id)
+        if winner != org.id:
+            collection.delete_one({'_id': org.id})
+            return Organization.objects.get(id=winner)
+        log.info('Created organization %s', acronym)
+        org._clear_changed_fields()
+        org._created = False
+        signals.post_save.send(Organization, document=org, created=True)
+        return org
+
+    def find(self, acronym):
+        '''The organization holding `acronym`, ie. created since the acronyms were loaded'''
+        org = Organization.objects(acronym=acronym).order_by('created_at').first()
+        if not org:
+            return None
+        holder = self.claim(acronym, org.id)
+        return org if holder == org.id else Organization.objects.get(id=holder)
+
+    def claim(self, acronym, org_id):
+        '''Claim `acronym` for `org_id` and return the id of the organization holding it'''
+        claims = Organization._get_db()[CLAIMS_COLLECTION]
+        try:
+            claim = claims.find_one_and_update(
+                {'_id': acronym},
+                {'$setOnInsert': {'organization': org_id}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Concurrent upserts: the other one inserted the claim
+            claim = claims.find_one({'_id': acronym})
+        if claim['organization'] == org_id:
+            return org_id
+        if Organization.objects(id=claim['organization'], acronym=acronym).count():
+            return claim['organization']
+        # The claimed organization has been deleted or renamed since: take its place
+        result = claims.update_one({'_id': acronym, 'organization': claim['organization']},
+                                   {'$set': {'organization': org_id}})
+        return org_id if result.modified_count else self.claim(acronym, org_id)
+
+    def increment(self, org, metric, value=1):
+        with self._lock:
+            self._increments[org.id][metric] += value
+
+    def update(self, org, **fields):
+        '''Set some organization fields, written on `flush()`'''
+        changed = {key: value for key, value in fields.items() if getattr(org, key) != value}
+        if not changed:
+            return
+        with self._lock:
+            for key, value in changed.items():
+                setattr(org, key, value)
+            self._updates[org.id].update(changed)
+
+    def flush(self):
+        '''Write the pending updates and metrics increments in a single bulk write'''
+        with self._lock:
+            increments, self._increments = self._increments, defaultdict(Counter)
+            updates, self._updates = self._updates, defaultdict(dict)
+        operations = []
+        for org_id in set(increments) | set(updates):
+            update = {}
+            if increments.get(org_id):
+                update['$inc'] = {
+                    'metrics.{0}'.format(metric): value
+                    for metric, value in increments[org_id].items()
+                }
+            if updates.get(org_id):
+                update['$set'] = updates[org_id]
+            operations.append(UpdateOne({'_id': org_id}, update))
+        if operations:
+            Organization._get_collection().bulk_write(operations, ordered=False)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from queue import Empty, Full, Queue
+
+log = logging.getLogger(__name__)
+
+# Marks the end of the prefetched values
+_DONE = object()
+
+
+def _context(app):
+    return app.app_context() if app else nullcontext()
+
+
+def prefetch(iterable, size, app=None):
+    '''
+    Consume `iterable` in a background thread, up to `size` values ahead.
+
+    Typically used to fetch the next pages of a listing while the current one
+    is processed. Errors raised by `iterable` are raised to the consumer.
+    '''
+    queue = Queue(maxsize=max(1, size))
+    stopped = threading.Event()
+
+    def put(value):
+        while not stopped.is_set():
+            try:
+                queue.put(value, timeout=.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        with _context(app):
+            try:
+                for value in iterable:
+                    if not put((value, None)):
+                        return
+            except Exception as e:
+                put((_DONE, e))
+            else:
+                put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name='harvest-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                value, error = queue.get(timeout=.1)
+            except Empty:
+                if thread.is_alive():
+                    continue
+                # Values may have been queued between the timeout and the exit of the thread
+                try:
+                    value, error = queue.get_nowait()
+                except Empty:
+                    raise RuntimeError('Prefetch thread exited without completing')
+            if value is _DONE:
+                if error:
+                    raise error
+                return
+            yield value
+    finally:
+        # The consumer stopped early (`max_items`, error...): let the producer exit
+        stopped.set()
+        thread.join()
+
+
+def fetch_ordered(fetch, args, concurrency, app=None):
+    '''
+    Call `fetch(arg)` for each of `args` in `concurrency` threads
+    and yield the results in order.
+
+    At most `concurrency` calls are running or waiting to be consumed.
+    '''
+    def call(arg):
+        with _context(app):
+            return fetch(arg)
+
+    args = iter(args)
+    with ThreadPoolExecutor(max(1, concurrency), thread_name_prefix='harvest-fetch') as executor:
+        futures = deque()
+        try:
+            for arg in args:
+                futures.append(executor.submit(call, arg))
+                if len(futures) >= concurrency:
+                    break
+            while futures:
+                result = futures.popleft().result()
+                for arg in args:
+                    futures.append(executor.submit(call, arg))
+                    break
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def fetch_as_completed(fetch, args, concurrency, app=None):
+    '''
+    Call `fetch(arg)` for each of `args` in `concurrency` threads
+    and yield `(arg, result)` tuples as soon as each call completes.
+    '''
+    def call(arg):
+        with _context(app):
+            return fetch(arg)
+
+    args = iter(args)
+    with ThreadPoolExecutor(max(1, concurrency), thread_name_prefix='harvest-fetch') as executor:
+        pending = {}
+        try:
+            for arg in args:
+                pending[executor.submit(call, arg)] = arg
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    arg = pending.pop(future)
+                    for next_arg in args:
+                        pending[executor.submit(call, next_arg)] = next_arg
+                        break
+                    yield arg, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def crawl(fetch, roots, concurrency, app=None):
+    '''
+    Crawl from `roots` with `concurrency` parallel `fetch(url)` calls.
+
+    `fetch` returns the `(urls, values)` found at `url`: unvisited `urls`
+    are queued for crawling and `values` are yielded as soon as they are found.
+    '''
+    def call(url):
+        with _context(app):
+            return fetch(url)
+
+    visited = set(roots)
+    frontier = deque(roots)
+    with ThreadPoolExecutor(max(1, concurrency), thread_name_prefix='harvest-crawl') as executor:
+        pending = set()
+        try:
+            while frontier or pending:
+                while frontier and len(pending) < concurrency:
+                    pending.add(executor.submit(call, frontier.popleft()))
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    urls, values = future.result()
+                    for url in urls:
+                        if url not in visited:
+                            visited.add(url)
+                            frontier.append(url)
+                    yield from values
+        finally:
+            for future in pending:
+                future.cancel()
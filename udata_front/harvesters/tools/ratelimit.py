@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+
+log = logging.getLogger(__name__)
+
+# Statuses meaning the remote asks us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# `AdaptiveLimiter` settings which can be configured
+RATE_LIMIT_KEYS = ('rate', 'burst', 'concurrency', 'latency_factor')
+
+# Weight of the last request in the latency moving average
+LATENCY_SMOOTHING = 0.2
+
+
+def parse_retry_after(value):
+    '''The delay in seconds requested by a `Retry-After` header'''
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter(object):
+    '''
+    Limit the requests sent to a single host.
+
+    Requests are throttled by a token bucket (`rate` requests per second
+    with bursts up to `burst`) and a concurrency window.
+    Both follow an AIMD policy: they are halved when the host answers
+    with a 429/503 or when its latency rises over `latency_factor` times
+    the best latency seen, and grow back linearly while the host is healthy,
+    up to their configured values.
+    '''
+    def __init__(self, rate=None, burst=None, concurrency=10, latency_factor=3.):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1., rate or 1.)
+        self.tokens = self.burst
+        self.max_concurrency = max(1, concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self.latency_factor = latency_factor
+        self.latency = None
+        self.best_latency = None
+        self.active = 0
+        self.blocked_until = 0.
+        self.last_decrease = 0.
+        self.throttled = 0
+        self.waited = 0.
+        self._updated = monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        '''Block until a request can be sent'''
+        start = monotonic()
+        with self._cond:
+            while True:
+                now = monotonic()
+                self.refill(now)
+                delay = self.blocked_until - now
+                if delay <= 0 and self.active >= int(self.concurrency):
+                    self._cond.wait(1)
+                    continue
+                if delay <= 0 and self.rate and self.tokens < 1:
+                    delay = (1 - self.tokens) / self.rate
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+            if self.rate:
+                self.tokens -= 1
+            self.active += 1
+            self.waited += monotonic() - start
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def release(self, duration, response=None):
+        '''Free the request slot and adapt the limits to the host answer'''
+        with self._cond:
+            self.active -= 1
+            if self.is_throttled(response):
+                self.throttled += 1
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+                if delay:
+                    self.blocked_until = max(self.blocked_until, monotonic() + delay)
+                self.decrease('throttled')
+            elif response is not None and response.status_code < 500:
+                self.observe(duration)
+            self._cond.notify_all()
+
+    def is_throttled(self, response):
+        if response is None:
+            return False
+        if response.status_code in THROTTLE_STATUSES:
+            return True
+        # Throttling answers already retried by urllib3
+        retries = getattr(response.raw, 'retries', None)
+        return bool(retries) and any(
+            h.status in THROTTLE_STATUSES for h in retries.history
+        )
+
+    def observe(self, duration):
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency += LATENCY_SMOOTHING * (duration - self.latency)
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+        if self.latency > self.latency_factor * max(self.best_latency, 0.05):
+            self.decrease('slow')
+        else:
+            self.increase()
+
+    def increase(self):
+        # Roughly one more slot per round-trip of the whole window
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1. / self.concurrency)
+        if self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100.)
+
+    def decrease(self, reason):
+        now = monotonic()
+        # Only once per latency window: in-flight requests reflect the previous limits
+        if now - self.last_decrease < max(self.latency or 0, 1.):
+            return
+        self.last_decrease = now
+        self.concurrency = max(1., self.concurrency / 2)
+        if self.max_rate:
+            self.rate = max(self.max_rate / 100., self.rate / 2)
+        log.debug('Slowing down (%s): %s concurrent requests, %s requests/s',
+                  reason, int(self.concurrency), self.rate or 'unlimited')
+
+    def as_dict(self):
+        with self._cond:
+            return {
+                'concurrency': int(self.concurrency),
+                'rate': round(self.rate, 2) if self.rate else None,
+                'throttled': self.throttled,
+                'waited': round(self.waited, 3),
+            }
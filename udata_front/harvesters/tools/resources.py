@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from udata.models import Resource
+
+
+class ResourceReconciler(object):
+    '''
+    Match the remote resources of a dataset with its existing ones.
+
+    Existing resources are indexed once by `key` (ie. `id` or `url`)
+    so matching, adding and removing resources is linear in their number.
+    '''
+    def __init__(self, dataset, key='id'):
+        self.dataset = dataset
+        self.key = key
+        self.index = {}
+        for resource in dataset.resources:
+            self.index.setdefault(getattr(resource, key), resource)
+        self.seen = set()
+
+    def get_or_create(self, value, **kwargs):
+        '''
+        The existing resource matching `value` or a new one appended to the dataset.
+
+        The new resource is built from `kwargs` or only from its key.
+        Returns a `(created, resource)` tuple.
+        '''
+        self.seen.add(value)
+        resource = self.index.get(value)
+        if resource is not None:
+            return False, resource
+        resource = Resource(**(kwargs or {self.key: value}))
+        self.index[value] = resource
+        self.dataset.resources.append(resource)
+        return True, resource
+
+    def update(self, value, **fields):
+        '''
+        The existing resource matching `value`, or a new one, with `fields` set.
+
+        Existing resources keep their id and creation date,
+        only the fields actually changed are written.
+        '''
+        _, resource = self.get_or_create(value)
+        for name, field_value in fields.items():
+            setattr(resource, name, field_value)
+        return resource
+
+    @property
+    def stale(self):
+        '''The resources which have not been matched'''
+        return [r for value, r in self.index.items() if value not in self.seen]
+
+    def remove_stale(self):
+        '''Remove the resources which have not been matched from the dataset'''
+        stale = self.stale
+        if stale:
+            stale_ids = set(id(resource) for resource in stale)
+            self.dataset.resources = [
+                r for r in self.dataset.resources if id(r) not in stale_ids
+            ]
+        return stale
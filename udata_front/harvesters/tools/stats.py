@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from contextlib import contextmanager
+from time import monotonic
+
+from .memoize import cache_report
+
+# Stages timed by the harvesters, in processing order
+STAGES = ('fetch', 'parse', 'validate', 'map', 'organizations', 'resources', 'persist')
+
+
+def percentile(values, ratio):
+    '''The `ratio` percentile of sorted `values` (nearest rank)'''
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(ratio * len(values))) - 1))
+    return values[index]
+
+
+class StageStats(object):
+    '''
+    Durations of the harvest stages (fetch, parse, validate...).
+
+    Stages can be nested: the `map` stage includes the fetching and parsing
+    of a dataset, each stage reports its own inclusive durations.
+    Thread safe so it can be shared by the concurrent workers of a job.
+    '''
+    def __init__(self):
+        self.durations = {}
+        self.started = monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, monotonic() - start)
+
+    def add(self, stage, duration):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(duration)
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def as_dict(self):
+        '''Count, total, p50 and p95 (in seconds) of each stage'''
+        with self._lock:
+            durations = dict((stage, sorted(values)) for stage, values in self.durations.items())
+        return dict((stage, {
+            'count': len(values),
+            'total': round(sum(values), 3),
+            'p50': round(percentile(values, .5), 4),
+            'p95': round(percentile(values, .95), 4),
+        }) for stage, values in durations.items())
+
+
+def merge_reports(reports):
+    '''
+    Merge the performance reports of several processes (ie. the shards of a job).
+
+    Counts, totals, requests, bytes and cache hits are summed.
+    Percentiles can't be merged: the highest one is kept as an upper bound.
+    '''
+    merged = {'stages': {}, 'items': 0, 'requests': 0, 'bytes': 0, 'caches': {}}
+    for report in reports:
+        for name, values in (report.get('caches') or {}).items():
+            current = merged['caches'].get(name) or cache_report(0, 0)
+            merged['caches'][name] = cache_report(current['hits'] + values['hits'],
+                                                  current['misses'] + values['misses'])
+        for key in ('items', 'requests', 'bytes'):
+            merged[key] += report.get(key) or 0
+        for stage, values in (report.get('stages') or {}).items():
+            current = merged['stages'].setdefault(stage, {'count': 0, 'total': 0.})
+            current['count'] += values['count']
+            current['total'] = round(current['total'] + values['total'], 3)
+            for key in ('p50', 'p95'):
+                current[key] = max(current.get(key) or 0, values.get(key) or 0)
+    return merged
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import inspect
+import logging
+
+from functools import lru_cache
+
+from voluptuous import All, Any, Invalid, Optional, Required, Schema
+from voluptuous.schema_builder import ALLOW_EXTRA, REMOVE_EXTRA, UNDEFINED
+
+from udata.harvest.filters import normalize_string, normalize_tag, slug, to_date
+
+log = logging.getLogger(__name__)
+
+# Pure validators returning immutable values: their results are memoized
+MEMOIZED = (to_date, normalize_string, normalize_tag, slug)
+
+# Size of the cache of each memoized validator
+MEMOIZE_SIZE = 4096
+
+
+class Reject(Exception):
+    '''The fast path can't tell: the full schema decides'''
+
+
+class Unsupported(Exception):
+    '''The schema uses a construct the fast path doesn't handle'''
+
+
+def memoize(validator):
+    cached = lru_cache(maxsize=MEMOIZE_SIZE)(validator)
+
+    def call(value):
+        try:
+            return cached(value)
+        except TypeError:  # Unhashable value
+            return validator(value)
+    call.cache = cached
+    return call
+
+
+def compile_node(node, extra, memoized):
+    '''Compile a node of a voluptuous schema into a `validate(value)` function'''
+    if isinstance(node, Schema):
+        # Nested schemas have their own settings
+        return compile_node(node.schema, node.extra, memoized)
+    if isinstance(node, dict):
+        return compile_dict(node, extra, memoized)
+    if isinstance(node, list):
+        return compile_list(node, extra, memoized)
+    if isinstance(node, (All, Any)):
+        validators = [compile_node(v, extra, memoized) for v in node.validators]
+        return (compile_all if isinstance(node, All) else compile_any)(validators)
+    if hasattr(node, '__voluptuous_compile__') or isinstance(node, (tuple, set, frozenset)):
+        raise Unsupported(node)
+    if inspect.isclass(node):
+        def validate_type(value):
+            if not isinstance(value, node):
+                raise Reject()
+            return value
+        return validate_type
+    if callable(node):
+        validator = memoized.get(node, node)
+
+        def validate_callable(value):
+            try:
+                return validator(value)
+            except (ValueError, Invalid):
+                raise Reject()
+        return validate_callable
+    if node is None or isinstance(node, (bool, bytes, int, str, float, complex)):
+        def validate_literal(value):
+            if value != node:
+                raise Reject()
+            return value
+        return validate_literal
+    raise Unsupported(node)
+
+
+def compile_all(validators):
+    def validate_all(value):
+        for validator in validators:
+            value = validator(value)
+        return value
+    return validate_all
+
+
+def compile_any(validators):
+    def validate_any(value):
+        for validator in validators:
+            try:
+                return validator(value)
+            except Reject:
+                continue
+        raise Reject()
+    return validate_any
+
+
+def compile_dict(node, extra, memoized):
+    keys = {}
+    # Keys that must be present for the fast path to apply, whatever `required` is
+    expected = []
+    defaults = []
+    for key, value in node.items():
+        if isinstance(key, (Optional, Required)):
+            name = key.schema
+            if key.default is not UNDEFINED:
+                defaults.append((name, key.default))
+            if isinstance(key, Required):
+                expected.append(name)
+        else:
+            name = key
+            expected.append(name)
+        if not isinstance(name, str):
+            raise Unsupported(key)
+        keys[name] = compile_node(value, extra, memoized)
+
+    def validate_dict(value):
+        if not isinstance(value, dict):
+            raise Reject()
+        out = {}
+        for key, item in value.items():
+            validator = keys.get(key)
+            if validator is not None:
+                out[key] = validator(item)
+            elif extra == ALLOW_EXTRA:
+                out[key] = item
+            elif extra != REMOVE_EXTRA:
+                raise Reject()
+        for name in expected:
+            if name not in value:
+                raise Reject()
+        for name, default in defaults:
+            if name not in value:
+                out[name] = keys[name](default())
+        return out
+    return validate_dict
+
+
+def compile_list(node, extra, memoized):
+    if not node:
+        raise Unsupported(node)
+    validate_item = compile_any([compile_node(v, extra, memoized) for v in node])
+
+    def validate_list(value):
+        if not isinstance(value, list):
+            raise Reject()
+        return [validate_item(item) for item in value]
+    return validate_list
+
+
+class CompiledSchema(object):
+    '''
+    A voluptuous `Schema` with a compiled fast path.
+
+    The schema is compiled once into plain functions: no path tracking,
+    no error collection, and memoized pure validators (ie. date parsing).
+    The fast path only accepts values it validates exactly like the schema.
+    Everything else (invalid values, missing keys...) goes through the
+    original schema, so results and error messages are unchanged.
+    '''
+    def __init__(self, schema, pure=()):
+        self.schema = schema
+        memoized = dict((validator, memoize(validator)) for validator in MEMOIZED + tuple(pure))
+        try:
+            self.fast = compile_node(schema, schema.extra, memoized)
+        except Unsupported as e:
+            log.debug('No fast path for %r: %r is not supported', schema, e.args[0])
+            self.fast = None
+
+    def __call__(self, data):
+        if self.fast is not None:
+            try:
+                return self.fast(data)
+            except Exception:
+                pass
+        return self.schema(data)
+
+
+_compiled = {}
+
+
+def compile_schema(schema, pure=()):
+    '''
+    The `CompiledSchema` of a schema, compiled once per process.
+
+    `pure` lists the schema specific validators to memoize
+    (ie. a custom date parser), in addition to the `MEMOIZED` filters.
+    '''
+    if id(schema) not in _compiled:
+        _compiled[id(schema)] = CompiledSchema(schema, pure)
+    return _compiled[id(schema)]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+from lxml import etree
+
+
+def localname(element):
+    '''The tag of an element without its namespace (`None` for comments...)'''
+    if not isinstance(element.tag, str):
+        return None
+    return etree.QName(element).localname
+
+
+def iter_elements(source, tag):
+    '''
+    Yield the `tag` elements of an XML document, whatever their namespace,
+    as soon as they are parsed.
+
+    Each element is cleared, along with its previous siblings, once the
+    consumer asks for the next one: memory stays bounded whatever the
+    document size, but elements must not be used after that.
+
+    `source` is either the document bytes or a file-like object.
+    '''
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    for _, element in etree.iterparse(source, events=('end',), tag='{*}' + tag,
+                                      resolve_entities=False, huge_tree=True):
+        yield element
+        element.clear(keep_tail=True)
+        # Drop the already processed siblings still referenced by the parent
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def iter_response_elements(response, tag):
+    '''Parse the `tag` elements of a streamed (`stream=True`) HTTP response'''
+    response.raise_for_status()
+    response.raw.decode_content = True
+    try:
+        yield from iter_elements(response.raw, tag)
+    finally:
+        response.close()
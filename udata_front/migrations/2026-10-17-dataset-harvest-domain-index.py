@@ -0,0 +1,19 @@
+"""
+Index harvested datasets domain used by harvesters to find missing datasets
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def migrate(db):
+    log.info("Indexing datasets harvest domain.")
+
+    db.dataset.create_index(
+        [("harvest.domain", 1), ("private", 1)],
+        name="harvest_domain_private",
+        partialFilterExpression={"harvest.domain": {"$exists": True}},
+    )
+
+    log.info("Datasets harvest domain indexed.")
@@ -0,0 +1,21 @@
+"""
+Index organizations acronym used by harvesters to find organizations
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def migrate(db):
+    log.info("Indexing organizations acronym.")
+
+    collection = db.organization
+    index = collection.index_information().get("acronym")
+    if index and index.get("unique"):
+        # Acronyms are edited by users: harvesters handle duplicates themselves
+        collection.drop_index("acronym")
+
+    collection.create_index("acronym", name="acronym")
+
+    log.info("Organizations acronym indexed.")
@@ -79,3 +79,49 @@ SEARCH_SIREN_URL = None
 
 # Metadata quality is hidden for datasets harvested from these backends
 QUALITY_METADATA_BACKEND_IGNORE = []
+
+# Harvesting
+# Number of days between two full harvests for sources harvested incrementally
+# (can be overridden per source with the `full_harvest_days` extra config)
+HARVEST_FULL_HARVEST_DAYS = 7
+
+# Number of harvested datasets written at once (0 saves each dataset individually)
+# (can be overridden per source with the `bulk_write_size` extra config)
+HARVEST_BULK_WRITE_SIZE = 0
+
+# Number of harvested datasets fetched and mapped in parallel threads
+# (can be overridden per source with the `concurrency` extra config)
+HARVEST_CONCURRENCY = 1
+
+# Number of listed datasets processed by each Celery task (0 processes a job in a single task)
+# (can be overridden per source with the `shard_size` extra config)
+HARVEST_SHARD_SIZE = 0
+
+# Number of listing pages fetched ahead of the processed one
+HARVEST_PREFETCH_PAGES = 4
+
+# Number of converted descriptions and guessed licenses memoized during a harvest job
+HARVEST_MEMOIZE_SIZE = 1024
+
+# Number of files downloaded in parallel by the harvesters storing remote files locally
+HARVEST_DOWNLOAD_WORKERS = 4
+
+# Harvesters HTTP client: (connect, read) timeouts in seconds,
+# retries on 5xx and 429 responses with an exponential backoff factor
+# and connection pool size per remote host
+HARVEST_HTTP_TIMEOUT = (10, 60)
+HARVEST_HTTP_RETRIES = 5
+HARVEST_HTTP_BACKOFF = 0.5
+HARVEST_HTTP_POOL_SIZE = 10
+
+# On-disk cache of the harvesters GET responses, revalidated with ETag/Last-Modified.
+# Defaults to `<instance path>/harvest-cache`, max size in bytes (0 disables the cache,
+# ie. `512 * 1024 * 1024` enables a 512MB cache)
+HARVEST_HTTP_CACHE_DIR = None
+HARVEST_HTTP_CACHE_SIZE = 0
+
+# Harvesters per remote host limits: requests per second (`None` for no limit),
+# bursts size and concurrent requests (defaults to `HARVEST_HTTP_POOL_SIZE`).
+# They are halved on 429/503 answers or rising latency and grow back while the host is healthy.
+# (the rate can be overridden per source with the `rate_limit` extra config)
+HARVEST_RATE_LIMIT = {'rate': None, 'burst': None}
@@ -0,0 +1,600 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from udata.core.dataset.factories import DatasetFactory
+from udata.harvest.models import HarvestItem, HarvestJob
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.models import Dataset, License
+
+from udata_front.harvesters import base
+from udata_front.harvesters.base import (
+    CHECKPOINT, HIGH_WATER_MARK, INCREMENTAL, LAST_FULL_HARVEST, LISTED_ID, STATS, UNCHANGED,
+    PTBaseBackend, get_http_cache
+)
+from udata_front.harvesters.tools.datasets import CONTENT_HASH
+from udata_front.tests import GouvFrSettings
+
+
+class FakeBackend(PTBaseBackend):
+    display_name = 'Fake PT'
+
+    def iter_datasets(self):
+        start = self.cursor or 0
+        for index, name in enumerate(self.source.config['names'][start:], start):
+            self.checkpoint(index)
+            self.listed.append(name)
+            yield name, {'index': index}
+
+    @property
+    def listed(self):
+        if not hasattr(self, '_listed'):
+            self._listed = []
+        return self._listed
+
+    def dispatch_shards(self):
+        self.dispatched = self._shards
+        self._shards = None
+
+    def inner_process_dataset(self, item, **kwargs):
+        name = item.remote_id
+        # Like CKAN: the listed name is replaced by a stable id
+        item.remote_id = 'id-{0}'.format(name)
+        if name in self.source.config.get('failing', []):
+            raise ValueError('Remote error')
+        payload = {'name': name, 'version': self.source.config.get('version', 1)}
+        dataset = self.get_dataset_if_changed(item, payload)
+        for key, value in DatasetFactory.as_dict(visible=True).items():
+            if getattr(dataset, key) is None:
+                setattr(dataset, key, value)
+        dataset.title = name
+        return dataset
+
+
+class DocumentBackend(FakeBackend):
+    '''Fetch a document per dataset, its remote id being only known once parsed (like MAAF)'''
+    from_cache = False
+
+    def inner_process_dataset(self, item, **kwargs):
+        name = item.remote_id
+        response = SimpleNamespace(from_cache=self.from_cache,
+                                   content='<name>{0}</name>'.format(name).encode())
+        self.skip_if_cached(item, response)
+        self.parsed.append(name)
+        item.remote_id = 'id-{0}'.format(name)
+        dataset = self.get_dataset_if_changed(item, response.content)
+        for key, value in DatasetFactory.as_dict(visible=True).items():
+            if getattr(dataset, key) is None:
+                setattr(dataset, key, value)
+        return dataset
+
+    @property
+    def parsed(self):
+        if not hasattr(self, '_parsed'):
+            self._parsed = []
+        return self._parsed
+
+
+class IncrementalBackend(FakeBackend):
+    '''Track the `modified` dates of the source config, like CKAN tracks `metadata_modified`'''
+    incremental = True
+
+    def inner_process_dataset(self, item, **kwargs):
+        self.track_modified(self.source.config['modified'].get(item.remote_id))
+        return super().inner_process_dataset(item, **kwargs)
+
+
+class DescribedBackend(FakeBackend):
+    '''Convert the same HTML description for every dataset'''
+    def inner_process_dataset(self, item, **kwargs):
+        dataset = super().inner_process_dataset(item, **kwargs)
+        dataset.description = self.parse_html(self.source.config['description'])
+        return dataset
+
+
+def harvest(source, **attrs):
+    backend = FakeBackend(source)
+    for key, value in attrs.items():
+        setattr(backend, key, value)
+    return backend.harvest()
+
+
+@pytest.mark.usefixtures('clean_db')
+class PTBaseBackendTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_items_keep_their_listed_id(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+
+        job = harvest(source)
+
+        assert job.items[0].remote_id == 'id-a'
+        assert job.items[0].kwargs[LISTED_ID] == 'a'
+
+    def test_retry_failed_items_with_replaced_remote_id(self):
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c'], 'failing': ['b']})
+        job = harvest(source)
+        assert job.status == 'done-errors'
+
+        source.config['failing'] = []
+        source.save()
+        job = harvest(source, retry_failed=True)
+
+        assert [item.remote_id for item in job.items] == ['id-b']
+        assert job.items[0].status == 'done'
+
+    def test_resume_skips_items_with_replaced_remote_id(self):
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        HarvestJob.objects.create(source=source, status='failed', data={
+            CHECKPOINT: {'cursor': 1, 'since': None},
+        }, items=[HarvestItem(remote_id='id-a', status='done', kwargs={LISTED_ID: 'a'})])
+
+        job = harvest(source)
+
+        assert [item.remote_id for item in job.items] == ['id-b', 'id-c']
+
+
+@pytest.mark.usefixtures('clean_db')
+class ConcurrentHarvestTest:
+    settings = GouvFrSettings
+    modules = []
+
+    names = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+
+    def test_process_concurrently(self, app):
+        app.config['HARVEST_CONCURRENCY'] = 4
+        source = HarvestSourceFactory(config={'names': self.names, 'failing': ['c']})
+
+        job = harvest(source)
+
+        assert job.status == 'done-errors'
+        # Items keep the listing order
+        assert [item.kwargs[LISTED_ID] for item in job.items] == self.names
+        assert [item.status for item in job.items].count('done') == 7
+        assert job.items[2].status == 'failed'
+        assert Dataset.objects.count() == 7
+        assert HarvestJob.objects.get(id=job.id).items[0].dataset.title == 'a'
+
+    def test_process_concurrently_with_bulk_writes(self, app):
+        app.config['HARVEST_CONCURRENCY'] = 4
+        app.config['HARVEST_BULK_WRITE_SIZE'] = 3
+        source = HarvestSourceFactory(config={'names': self.names})
+
+        job = harvest(source)
+
+        assert job.status == 'done'
+        assert all(item.status == 'done' for item in job.items)
+        assert sorted(Dataset.objects.values_list('title')) == self.names
+
+
+@pytest.mark.usefixtures('clean_db')
+class ContentHashTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_store_content_hash(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+
+        job = harvest(source)
+
+        dataset = Dataset.objects.get(id=job.items[0].dataset.id)
+        assert dataset.extras[CONTENT_HASH] == FakeBackend(source).digest({'name': 'a', 'version': 1})
+
+    def test_skip_unchanged_datasets(self):
+        source = HarvestSourceFactory(config={'names': ['a', 'b']})
+        first = harvest(source)
+
+        job = harvest(source)
+
+        assert job.data[UNCHANGED] == 2
+        assert [item.status for item in job.items] == ['done', 'done']
+        assert ([item.dataset.id for item in job.items]
+                == [item.dataset.id for item in first.items])
+        assert Dataset.objects.count() == 2
+
+    def test_update_changed_datasets(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+        first = harvest(source)
+        dataset = Dataset.objects.get(id=first.items[0].dataset.id)
+
+        source.config['version'] = 2
+        source.save()
+        job = harvest(source)
+
+        assert UNCHANGED not in job.data
+        assert job.items[0].status == 'done'
+        assert job.items[0].dataset.id == dataset.id
+        dataset.reload()
+        assert dataset.extras[CONTENT_HASH] == FakeBackend(source).digest({'name': 'a', 'version': 2})
+
+    def test_archived_datasets_are_not_skipped(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+        first = harvest(source)
+        Dataset.objects(id=first.items[0].dataset.id).update(archived=datetime.utcnow())
+
+        job = harvest(source)
+
+        assert UNCHANGED not in job.data
+        assert Dataset.objects.get(id=job.items[0].dataset.id).archived is None
+
+
+@pytest.mark.usefixtures('clean_db')
+class SkipIfCachedTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def run(self, source, from_cache):
+        backend = DocumentBackend(source)
+        backend.from_cache = from_cache
+        return backend, backend.harvest()
+
+    def test_skip_cached_documents_parsing(self):
+        source = HarvestSourceFactory(config={'names': ['a', 'b']})
+        self.run(source, from_cache=False)
+
+        backend, job = self.run(source, from_cache=True)
+
+        assert backend.parsed == []
+        assert job.data[UNCHANGED] == 2
+        assert [item.status for item in job.items] == ['done', 'done']
+        # The remote ids are the ones found by parsing in the previous job
+        assert [item.remote_id for item in job.items] == ['id-a', 'id-b']
+
+    def test_parse_fetched_documents(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+        self.run(source, from_cache=False)
+
+        backend, job = self.run(source, from_cache=False)
+
+        assert backend.parsed == ['a']
+        # Still unchanged once parsed
+        assert job.data[UNCHANGED] == 1
+
+    def test_parse_unknown_datasets(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+
+        backend, job = self.run(source, from_cache=True)
+
+        assert backend.parsed == ['a']
+        assert job.items[0].status == 'done'
+
+    def test_parse_cached_documents_on_config_change(self):
+        source = HarvestSourceFactory(config={'names': ['a']})
+        self.run(source, from_cache=False)
+        source.config['version'] = 2
+        source.save()
+
+        backend, job = self.run(source, from_cache=True)
+
+        assert backend.parsed == ['a']
+        assert UNCHANGED not in job.data
+
+
+@pytest.mark.usefixtures('clean_db')
+class HighWaterMarkTest:
+    settings = GouvFrSettings
+    modules = []
+
+    first = datetime(2026, 1, 1)
+    second = datetime(2026, 2, 1)
+
+    def source(self, **config):
+        config.setdefault('names', ['a', 'b'])
+        config.setdefault('modified', {'a': '2025-12-01T00:00:00Z', 'b': '2026-01-01T01:00:00+01:00'})
+        return HarvestSourceFactory(config=config)
+
+    def run(self, source, **attrs):
+        backend = IncrementalBackend(source)
+        for key, value in attrs.items():
+            setattr(backend, key, value)
+        return backend, backend.harvest()
+
+    def modify(self, source, **modified):
+        source.config['modified'].update(modified)
+        source.save()
+
+    def previous_job(self, source, days_ago=1):
+        return HarvestJob.objects.create(source=source, status='done', data={
+            HIGH_WATER_MARK: self.first,
+            LAST_FULL_HARVEST: datetime.utcnow() - timedelta(days=days_ago),
+        })
+
+    def test_full_harvest_sets_the_mark(self):
+        source = self.source()
+
+        backend, job = self.run(source)
+
+        assert backend.since is None
+        assert not backend.partial
+        # The most recent date, in UTC
+        assert job.data[HIGH_WATER_MARK] == self.first
+        assert job.data[LAST_FULL_HARVEST] == job.started
+        assert job.data[INCREMENTAL] is False
+
+    def test_incremental_harvest_from_the_mark(self):
+        source = self.source()
+        _, first = self.run(source)
+        self.modify(source, b='2026-02-01T00:00:00Z')
+
+        backend, job = self.run(source)
+
+        assert backend.since == self.first
+        assert backend.partial
+        assert job.data[HIGH_WATER_MARK] == self.second
+        # Still counted from the last full harvest
+        assert job.data[LAST_FULL_HARVEST] == first.data[LAST_FULL_HARVEST]
+        assert job.data[INCREMENTAL] is True
+
+    def test_failed_items_keep_the_mark(self):
+        source = self.source()
+        self.run(source)
+        self.modify(source, b='2026-02-01T00:00:00Z')
+        source.config['failing'] = ['a']
+        source.save()
+
+        _, job = self.run(source)
+
+        assert job.status == 'done-errors'
+        assert job.data[HIGH_WATER_MARK] == self.first
+
+    def test_max_items_keep_the_mark(self):
+        source = self.source()
+        self.run(source)
+        self.modify(source, a='2026-02-01T00:00:00Z')
+
+        _, job = self.run(source, max_items=1)
+
+        assert len(job.items) == 1
+        assert job.data[HIGH_WATER_MARK] == self.first
+
+    def test_retry_failed_keeps_the_mark(self):
+        source = self.source()
+        self.run(source)
+        source.config['failing'] = ['b']
+        source.save()
+        self.run(source)
+        source.config['failing'] = []
+        source.save()
+        self.modify(source, b='2026-02-01T00:00:00Z')
+
+        backend, job = self.run(source, retry_failed=True)
+
+        assert backend.since is None
+        assert [item.status for item in job.items] == ['done']
+        assert job.data[HIGH_WATER_MARK] == self.first
+
+    def test_resumed_harvest_keeps_the_mark(self):
+        source = self.source()
+        _, first = self.run(source)
+        HarvestJob.objects.create(source=source, status='failed', data={
+            CHECKPOINT: {'cursor': 1, 'since': self.first},
+        }, items=[HarvestItem(remote_id='id-a', status='done', kwargs={LISTED_ID: 'a'})])
+        self.modify(source, b='2026-02-01T00:00:00Z')
+
+        backend, job = self.run(source)
+
+        # The interrupted job listing goes on
+        assert backend.since == self.first
+        assert [item.remote_id for item in job.items] == ['id-b']
+        assert job.data[HIGH_WATER_MARK] == self.first
+        assert job.data[LAST_FULL_HARVEST] == first.data[LAST_FULL_HARVEST]
+
+    def test_full_harvest_after_the_interval(self, app):
+        source = self.source()
+        self.previous_job(source, days_ago=app.config['HARVEST_FULL_HARVEST_DAYS'])
+
+        backend, job = self.run(source)
+
+        assert backend.since is None
+        assert job.data[LAST_FULL_HARVEST] == job.started
+        assert job.data[INCREMENTAL] is False
+
+    def test_configured_interval(self):
+        source = self.source(extra_configs=[{'key': 'full_harvest_days', 'value': 30}])
+        self.previous_job(source, days_ago=10)
+
+        backend, _ = self.run(source)
+
+        assert backend.since == self.first
+
+    def test_always_full_without_interval(self, app):
+        app.config['HARVEST_FULL_HARVEST_DAYS'] = 0
+        source = self.source()
+        self.previous_job(source)
+
+        backend, _ = self.run(source)
+
+        assert backend.since is None
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    '''Count the calls to the memoized functions'''
+    calls = []
+
+    class CountingLicense(object):
+        @staticmethod
+        def guess(*strings, default=None):
+            calls.append(('guess',) + strings)
+            return default
+
+        @staticmethod
+        def default():
+            calls.append(('default',))
+            return None
+
+    def parse_html(html):
+        calls.append(('parse_html', html))
+        return html.upper()
+
+    monkeypatch.setattr(base, 'License', CountingLicense)
+    monkeypatch.setattr(base, 'parse_html', parse_html)
+    return calls
+
+
+@pytest.mark.usefixtures('clean_db')
+class MemoizeTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_parse_html_by_content(self, calls):
+        backend = FakeBackend(HarvestSourceFactory())
+
+        assert backend.parse_html('<p>Descrição</p>') == '<P>DESCRIÇÃO</P>'
+        assert backend.parse_html('<p>Descrição</p>') == '<P>DESCRIÇÃO</P>'
+        backend.parse_html('<p>Outra</p>')
+
+        assert calls == [('parse_html', '<p>Descrição</p>'), ('parse_html', '<p>Outra</p>')]
+        assert backend.performance_report(0)['caches']['html'] == {
+            'hits': 1, 'misses': 2, 'ratio': .333,
+        }
+
+    def test_guess_license_by_arguments(self, calls):
+        backend = FakeBackend(HarvestSourceFactory())
+        default = License(id='cc-by')
+
+        backend.guess_license('cc-by')
+        backend.guess_license('cc-by')
+        backend.guess_license('cc-by', 'Creative Commons')
+        backend.guess_license('cc-by', default=default)
+        assert backend.guess_license('cc-by', default=default) is default
+
+        assert calls == [('guess', 'cc-by'), ('guess', 'cc-by', 'Creative Commons'),
+                         ('guess', 'cc-by')]
+
+    def test_default_license(self, calls):
+        backend = FakeBackend(HarvestSourceFactory())
+
+        backend.default_license()
+        backend.default_license()
+        backend.guess_license(None)
+
+        # The default license and the guesses share the licenses cache without colliding
+        assert calls == [('default',), ('guess', None)]
+        assert backend.performance_report(0)['caches']['licenses']['hits'] == 1
+
+    def test_evict_least_recently_used(self, app, calls):
+        app.config['HARVEST_MEMOIZE_SIZE'] = 1
+        backend = FakeBackend(HarvestSourceFactory())
+
+        for html in ('a', 'b', 'a'):
+            backend.parse_html(html)
+
+        assert calls == [('parse_html', 'a'), ('parse_html', 'b'), ('parse_html', 'a')]
+
+    def test_caches_are_shared_by_the_job_items(self, app, calls):
+        app.config['HARVEST_CONCURRENCY'] = 4
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c', 'd'],
+                                              'description': '<p>Descrição</p>'})
+
+        job = DescribedBackend(source).harvest()
+
+        assert Dataset.objects.get(id=job.items[0].dataset.id).description == '<P>DESCRIÇÃO</P>'
+        # Concurrent misses may compute the same value twice
+        report = job.data[STATS]['caches']['html']
+        assert report['hits'] + report['misses'] == 4
+        assert len(calls) == report['misses']
+
+
+@pytest.mark.usefixtures('clean_db')
+class ShardedHarvestTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_split_shards_keeps_remote_ids_and_positions(self, app):
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        backend = FakeBackend(source)
+        backend._shards = []
+
+        assert backend.split_shards(backend.iter_datasets(), 2) == [
+            {'cursor': 0, 'since': None, 'datasets': [['a', None], ['b', None]]},
+            {'cursor': 2, 'since': None, 'datasets': [['c', None]]},
+        ]
+
+    def test_shard_lists_from_its_position(self, app):
+        app.config['HARVEST_SHARD_SIZE'] = 2
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c', 'd', 'e']})
+        backend = FakeBackend(source)
+        job = backend.harvest()
+
+        shard = FakeBackend(HarvestJob.objects.get(id=job.id))
+        shard.harvest_shard(1, backend.dispatched[1])
+
+        # Neither the first shard datasets nor the next ones are listed again
+        assert shard.listed == ['c', 'd']
+
+    def test_shipped_kwargs_are_not_listed_again(self, app):
+        class ShippingBackend(FakeBackend):
+            def shard_kwargs(self, remote_id, kwargs):
+                return kwargs
+
+        app.config['HARVEST_SHARD_SIZE'] = 2
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        backend = ShippingBackend(source)
+        job = backend.harvest()
+        assert backend.dispatched[1]['datasets'] == [['c', {'index': 2}]]
+
+        shard = ShippingBackend(HarvestJob.objects.get(id=job.id))
+        shard.harvest_shard(1, backend.dispatched[1])
+
+        assert shard.listed == []
+        assert HarvestJob.objects.get(id=job.id).items[0].remote_id == 'id-c'
+
+    def test_no_checkpoint_while_listing(self, app):
+        app.config['HARVEST_SHARD_SIZE'] = 2
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        backend = FakeBackend(source)
+
+        job = backend.harvest()
+
+        assert [[rid for rid, _ in shard['datasets']] for shard in backend.dispatched] == [
+            ['a', 'b'], ['c'],
+        ]
+        assert job.status == 'processing'
+        assert CHECKPOINT not in HarvestJob.objects.get(id=job.id).data
+
+    def test_harvest_and_finalize_shards(self, app):
+        app.config['HARVEST_SHARD_SIZE'] = 2
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        backend = FakeBackend(source)
+        job = backend.harvest()
+
+        for index, shard in enumerate(backend.dispatched):
+            FakeBackend(HarvestJob.objects.get(id=job.id)).harvest_shard(index, shard)
+        FakeBackend(HarvestJob.objects.get(id=job.id)).finalize_shards()
+
+        job.reload()
+        assert job.status == 'done'
+        assert sorted(item.remote_id for item in job.items) == ['id-a', 'id-b', 'id-c']
+
+    def test_failed_shard(self, app):
+        app.config['HARVEST_SHARD_SIZE'] = 2
+        source = HarvestSourceFactory(config={'names': ['a', 'b', 'c']})
+        backend = FakeBackend(source)
+        job = backend.harvest()
+        FakeBackend(HarvestJob.objects.get(id=job.id)).harvest_shard(0, backend.dispatched[0])
+
+        FakeBackend(HarvestJob.objects.get(id=job.id)).finalize_shards(failed=True)
+
+        job.reload()
+        assert job.status == 'failed'
+        assert len(job.errors) == 1
+        assert len(job.items) == 2
+
+
+class HTTPCacheConfigTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_disabled_by_default(self, app):
+        assert get_http_cache() is None
+
+    def test_unusable_directory(self, app, tmp_path):
+        directory = tmp_path / 'harvest-cache'
+        directory.write_text('not a directory')
+        app.config['HARVEST_HTTP_CACHE_DIR'] = str(directory)
+        app.config['HARVEST_HTTP_CACHE_SIZE'] = 1024
+
+        assert get_http_cache() is None
@@ -0,0 +1,221 @@
+import pytest
+
+from mongoengine.errors import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from udata.core.dataset.factories import DatasetFactory, ResourceFactory
+from udata.models import Dataset
+
+from udata_front.harvesters.tools.bulk import (
+    DUPLICATE_KEY, BulkWriter, save_changes, update_operations
+)
+from udata_front.tests import GouvFrSettings
+
+
+def saved_dataset(nb_resources=3):
+    dataset = DatasetFactory(resources=ResourceFactory.build_batch(nb_resources))
+    return Dataset.objects.get(id=dataset.id)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.written = []
+        self.errors = []
+
+    def writer(self, size=10):
+        return BulkWriter(Dataset, size, self.on_success, self.on_error)
+
+    def on_success(self, key, document):
+        self.written.append(key)
+
+    def on_error(self, key, document, error):
+        self.errors.append((key, str(error)))
+
+
+def fail_bulk_write(monkeypatch, *errors):
+    collection = Dataset._get_collection()
+    calls = []
+
+    def bulk_write(operations, **kwargs):
+        calls.append(operations)
+        raise BulkWriteError({'writeErrors': list(errors)})
+
+    # The collection object is cached by the model
+    monkeypatch.setattr(collection, 'bulk_write', bulk_write)
+    return calls
+
+
+@pytest.mark.usefixtures('clean_db')
+class UpdateOperationsTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_unchanged(self):
+        assert update_operations(saved_dataset()) == []
+
+    def test_set_changed_fields(self):
+        dataset = saved_dataset()
+        dataset.title = 'New title'
+
+        assert update_operations(dataset) == [
+            UpdateOne({'_id': dataset.id}, {'$set': {'title': 'New title'}}),
+        ]
+
+    def test_pull_removed_resources(self):
+        dataset = saved_dataset()
+        dataset.resources.pop(1)
+
+        assert update_operations(dataset) == [
+            UpdateOne({'_id': dataset.id}, {'$pull': {'resources': {'_id': {
+                '$nin': [r.id for r in dataset.resources]
+            }}}}),
+        ]
+
+    def test_push_new_resources(self):
+        dataset = saved_dataset()
+        resource = ResourceFactory.build()
+        dataset.resources.append(resource)
+
+        operations = update_operations(dataset)
+
+        assert operations[1] == UpdateOne({'_id': dataset.id}, {
+            '$push': {'resources': {'$each': [resource.to_mongo()]}}
+        })
+        assert len(operations) == 2
+
+    def test_set_changed_resources_fields(self):
+        dataset = saved_dataset()
+        first, _, last = dataset.resources
+        first.title = 'New title'
+        last.description = None
+
+        # Items are targeted by id, not by position
+        assert update_operations(dataset) == [UpdateOne(
+            {'_id': dataset.id},
+            {
+                '$set': {'resources.$[i0].title': 'New title'},
+                '$unset': {'resources.$[i1].description': 1},
+            },
+            array_filters=[{'i0._id': first.id}, {'i1._id': last.id}],
+        )]
+
+    def test_remove_and_change_resources(self):
+        dataset = saved_dataset()
+        first, removed, _ = dataset.resources
+        dataset.resources.remove(removed)
+        first.title = 'New title'
+
+        assert update_operations(dataset) == [
+            UpdateOne({'_id': dataset.id}, {'$pull': {'resources': {'_id': {
+                '$nin': [r.id for r in dataset.resources]
+            }}}}),
+            UpdateOne({'_id': dataset.id}, {'$set': {'resources.$[i0].title': 'New title'}},
+                      array_filters=[{'i0._id': first.id}]),
+        ]
+
+    def test_save_changes(self):
+        dataset = saved_dataset()
+        first, removed, last = dataset.resources
+        first.title = 'New title'
+        last.description = None
+        dataset.resources.remove(removed)
+        new = ResourceFactory.build()
+        dataset.resources.append(new)
+        dataset.title = 'New dataset title'
+
+        save_changes(dataset)
+
+        assert not dataset._get_changed_fields()
+        dataset = Dataset.objects.get(id=dataset.id)
+        assert dataset.title == 'New dataset title'
+        assert [r.id for r in dataset.resources] == [first.id, last.id, new.id]
+        assert dataset.resources[0].title == 'New title'
+        assert dataset.resources[1].description is None
+        assert dataset.resources[2].url == new.url
+
+
+@pytest.mark.usefixtures('clean_db')
+class BulkWriterTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_insert_new_documents(self):
+        recorder = Recorder()
+        writer = recorder.writer()
+        datasets = DatasetFactory.build_batch(2)
+        for index, dataset in enumerate(datasets):
+            writer.add(index, dataset)
+        assert Dataset.objects.count() == 0
+
+        writer.flush()
+
+        assert recorder.written == [0, 1]
+        assert recorder.errors == []
+        assert writer.pending == []
+        assert Dataset.objects.count() == 2
+        assert all(dataset.id and not dataset._created for dataset in datasets)
+
+    def test_flush_when_full(self):
+        recorder = Recorder()
+        writer = recorder.writer(size=2)
+
+        for index in range(3):
+            writer.add(index, DatasetFactory.build())
+
+        assert recorder.written == [0, 1]
+        assert len(writer.pending) == 1
+
+    def test_update_existing_documents(self):
+        recorder = Recorder()
+        writer = recorder.writer()
+        dataset = saved_dataset()
+        dataset.title = 'New title'
+        dataset.resources.pop()
+
+        writer.add('key', dataset)
+        writer.flush()
+
+        assert recorder.written == ['key']
+        dataset = Dataset.objects.get(id=dataset.id)
+        assert dataset.title == 'New title'
+        assert len(dataset.resources) == 2
+
+    def test_validation_errors_are_raised_on_add(self):
+        writer = Recorder().writer()
+
+        with pytest.raises(ValidationError):
+            writer.add('key', DatasetFactory.build(title=None))
+
+        assert writer.pending == []
+
+    def test_map_write_errors_to_documents(self, monkeypatch):
+        recorder = Recorder()
+        writer = recorder.writer()
+        changed = saved_dataset()
+        writer.add('new', DatasetFactory.build())
+        # Two operations: the resources `$pull` and the `$set`
+        changed.resources.pop()
+        changed.title = 'New title'
+        writer.add('changed', changed)
+        writer.add('other', DatasetFactory.build())
+        calls = fail_bulk_write(monkeypatch, {'index': 2, 'code': 2, 'errmsg': 'boom'})
+
+        writer.flush()
+
+        assert len(calls[0]) == 4
+        assert recorder.errors == [('changed', 'boom')]
+        assert recorder.written == ['new', 'other']
+
+    def test_duplicate_key_falls_back_to_save(self, monkeypatch):
+        recorder = Recorder()
+        writer = recorder.writer()
+        dataset = DatasetFactory.build()
+        writer.add('key', dataset)
+        fail_bulk_write(monkeypatch, {'index': 0, 'code': DUPLICATE_KEY, 'errmsg': 'duplicate'})
+
+        writer.flush()
+
+        assert recorder.written == ['key']
+        assert recorder.errors == []
+        assert Dataset.objects.get(id=dataset.id)
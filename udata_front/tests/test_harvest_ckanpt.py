@@ -0,0 +1,129 @@
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters.ckanpt import CkanPTBackend
+from udata_front.harvesters.tools.benchmark import SyntheticCatalog
+from udata_front.tests import GouvFrSettings
+
+SEARCH_URL = 'https://ckan.test/api/3/action/package_search'
+
+
+def params(request):
+    return parse_qs(urlsplit(request.url).query)
+
+
+@pytest.mark.usefixtures('clean_db')
+class CkanPTListingTest:
+    settings = GouvFrSettings
+    modules = []
+
+    catalog = SyntheticCatalog(3)
+
+    def backend(self, **config):
+        return CkanPTBackend(HarvestSourceFactory(backend='ckanpt', url='https://ckan.test/',
+                                                  config=config))
+
+    def search_result(self, indexes, count=None):
+        return {'success': True, 'result': {
+            'count': len(indexes) if count is None else count,
+            'results': [self.catalog.ckan_package(i) for i in indexes],
+        }}
+
+    def serve(self, rmock, catalog, count=None, max_rows=None):
+        '''Serve `package_search` pages of `catalog`, of at most `max_rows` packages'''
+        def search(request, context):
+            start, rows = int(request.qs['start'][0]), int(request.qs['rows'][0])
+            indexes = catalog.page(start, min(rows, max_rows or rows))
+            return {'success': True, 'result': {
+                'count': catalog.size if count is None else count,
+                'results': [catalog.ckan_package(i) for i in indexes],
+            }}
+        rmock.get(SEARCH_URL, json=search)
+
+    def search(self, rmock, catalog, **kwargs):
+        backend = self.backend(features={'package_search': True})
+        self.serve(rmock, catalog, **kwargs)
+        return [name for name, _ in backend.iter_datasets()]
+
+    def starts(self, rmock):
+        return [int(params(r)['start'][0]) for r in rmock.request_history]
+
+    def test_page_beyond_rows_limit(self, rmock):
+        catalog = SyntheticCatalog(2500, resources=0)
+
+        remote_ids = self.search(rmock, catalog)
+
+        assert remote_ids == [catalog.identifier(i) for i in range(2500)]
+        # The last page is short and reaches the count: no more request
+        assert self.starts(rmock) == [0, 1000, 2000]
+        assert params(rmock.last_request)['rows'] == ['1000']
+        assert params(rmock.last_request)['sort'] == [CkanPTBackend.SEARCH_SORT]
+
+    def test_stop_on_short_last_page(self, rmock):
+        remote_ids = self.search(rmock, self.catalog)
+
+        assert len(remote_ids) == 3
+        assert self.starts(rmock) == [0]
+
+    def test_stop_on_empty_page(self, rmock):
+        # The count is higher than the packages actually returned
+        remote_ids = self.search(rmock, self.catalog, count=5)
+
+        assert len(remote_ids) == 3
+        assert self.starts(rmock) == [0, 3]
+
+    def test_page_until_count_with_capped_rows(self, rmock):
+        # The portal returns less rows than requested: pages are short until the count is reached
+        catalog = SyntheticCatalog(5, resources=0)
+
+        remote_ids = self.search(rmock, catalog, max_rows=2)
+
+        assert remote_ids == [catalog.identifier(i) for i in range(5)]
+        assert self.starts(rmock) == [0, 2, 4]
+
+    def test_skip_packages_shifted_to_the_next_page(self, rmock):
+        catalog = SyntheticCatalog(3, resources=0)
+        pages = iter([[0, 1], [1, 2], []])
+
+        def search(request, context):
+            return {'success': True, 'result': {
+                'count': 4,
+                'results': [catalog.ckan_package(i) for i in next(pages)],
+            }}
+        rmock.get(SEARCH_URL, json=search)
+        backend = self.backend(features={'package_search': True})
+
+        remote_ids = [name for name, _ in backend.iter_datasets()]
+
+        assert remote_ids == [catalog.identifier(i) for i in range(3)]
+
+    def test_package_search_kwargs(self, rmock):
+        self.serve(rmock, self.catalog)
+        backend = self.backend(features={'package_search': True})
+
+        items = list(backend.iter_datasets())
+
+        assert items[0] == (self.catalog.identifier(0), {'package': self.catalog.ckan_package(0)})
+
+    def test_list_modified_since(self, rmock):
+        backend = self.backend()
+        backend._since = datetime(2026, 1, 2, 3, 4, 5)
+        rmock.get(SEARCH_URL, json=self.search_result([0, 1]))
+
+        assert [name for name, _ in backend.iter_datasets()] == ['dataset-0', 'dataset-1']
+        assert params(rmock.last_request)['q'] == ['metadata_modified:[2026-01-02T03:04:05Z TO *]']
+
+    def test_list_modified_since_with_filters(self, rmock):
+        backend = self.backend(filters=[{'key': 'organization', 'value': 'ama'}])
+        backend._since = datetime(2026, 1, 2)
+        rmock.get(SEARCH_URL, json=self.search_result([0]))
+
+        list(backend.iter_datasets())
+
+        assert params(rmock.last_request)['q'] == [
+            'organization:ama AND metadata_modified:[2026-01-02T00:00:00Z TO *]'
+        ]
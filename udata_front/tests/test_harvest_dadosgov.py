@@ -0,0 +1,135 @@
+import csv
+import io
+import threading
+
+import pytest
+import requests
+
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.models import Organization
+
+from udata_front.harvesters import dadosgov
+from udata_front.harvesters.dadosgov import DGBackend
+from udata_front.tests import GouvFrSettings
+
+ROOT_URL = 'http://servico.dados.gov.pt/v1/'
+
+
+def service(*names):
+    '''An OData service document listing the `names` collections'''
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<service xml:base="{0}" xmlns="http://www.w3.org/2007/app"'
+            ' xmlns:atom="http://www.w3.org/2005/Atom"><workspace>'
+            '<atom:title>Default</atom:title>{1}</workspace></service>').format(ROOT_URL, ''.join(
+                '<collection href="{0}"><atom:title>{0}</atom:title></collection>'.format(name)
+                for name in names
+            )).encode('utf-8')
+
+
+def write_tsv(path, rows):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f, delimiter='\t').writerows(rows)
+
+
+def organization_row(acronym, name, description):
+    return ['', name, description, '', '', '', acronym]
+
+
+def dataset_row(name, file_path='', service_url=''):
+    row = [''] * 13
+    row[1], row[3], row[9] = name, service_url, '2016-07-01'
+    # The exported paths are prefixed by the storage container
+    row[12] = 'datasetsfiles/' + file_path if file_path else ''
+    return row
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    write_tsv(tmp_path / 'organizations.csv', [
+        organization_row('ama', 'Agência para a Modernização Administrativa', 'Modernização'),
+    ])
+    write_tsv(tmp_path / 'datasetByName.csv', [
+        dataset_row('ds-a', 'file-a.xlsx', 'http://service.test/a'),
+        dataset_row('ds-b'),
+        dataset_row('ds-c', 'file-c.csv'),
+    ])
+    monkeypatch.setattr(dadosgov, 'AUX_FILE_PATH', str(tmp_path))
+    monkeypatch.setattr(dadosgov, 'REPORT_FILE_PATH', str(tmp_path / 'report.csv'))
+    monkeypatch.setattr(dadosgov, 'DOWNLOADFILEPATH', str(tmp_path / 'files'))
+    return tmp_path
+
+
+@pytest.mark.usefixtures('clean_db')
+class DGBackendDiscoveryTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def serve(self, rmock, collections):
+        rmock.get(ROOT_URL, body=io.BytesIO(service(*collections)))
+        for name, datasets in collections.items():
+            rmock.get(ROOT_URL + name, body=io.BytesIO(service(*datasets)))
+
+    def test_list_datasets_of_all_collections(self, files, rmock):
+        self.serve(rmock, {
+            'ama': ['ds-a', 'ds-b', 'unknown'],
+            'ine': ['ds-c'],
+            'empty': [],
+        })
+        backend = DGBackend(HarvestSourceFactory(backend='dadosGov'))
+
+        datasets = dict(backend.iter_datasets())
+
+        # Only the datasets of the exported database are harvested
+        assert sorted(datasets) == ['ds-a', 'ds-b', 'ds-c']
+        ama = Organization.objects.get(acronym='ama')
+        assert datasets['ds-a'] == {
+            'orgId': ama.id,
+            'orgAcronym': 'ama',
+            'filePath': 'file-a.xlsx',
+            'serviceUrl': 'http://service.test/a',
+            'createdOn': '2016-07-01',
+        }
+        assert datasets['ds-b']['filePath'] == ''
+        assert datasets['ds-c']['orgAcronym'] == 'ine'
+        # Each collection is fetched once
+        assert sorted(r.url for r in rmock.request_history) == sorted(
+            [ROOT_URL] + [ROOT_URL + name for name in ('ama', 'empty', 'ine')])
+        # The report is started and the download directory created
+        assert (files / 'report.csv').read_text().startswith('DatasetId\t')
+        assert (files / 'files').is_dir()
+
+    def test_organizations(self, files, rmock):
+        self.serve(rmock, {'ama': ['ds-a'], 'ine': ['ds-c'], 'empty': []})
+        backend = DGBackend(HarvestSourceFactory(backend='dadosGov'))
+
+        list(backend.iter_datasets())
+        backend.organizations.flush()
+
+        # Organizations without dataset are not created
+        assert sorted(Organization.objects.values_list('acronym')) == ['ama', 'ine']
+        ama = Organization.objects.get(acronym='ama')
+        assert ama.name == 'Agência para a Modernização Administrativa'
+        # Unknown organizations are named after their collection
+        assert Organization.objects.get(acronym='ine').name == 'ine'
+
+    def test_collection_error(self, files, rmock):
+        self.serve(rmock, {'ama': ['ds-a']})
+        rmock.get(ROOT_URL + 'ama', status_code=500)
+        backend = DGBackend(HarvestSourceFactory(backend='dadosGov'))
+
+        with pytest.raises(requests.HTTPError):
+            list(backend.iter_datasets())
+
+    def test_concurrent_report_rows(self, files):
+        backend = DGBackend(HarvestSourceFactory(backend='dadosGov'))
+        rows = [['ds-{0}'.format(i), 'Título ' * 500, '[]'] for i in range(50)]
+        threads = [threading.Thread(target=backend.write_report, args=(row,)) for row in rows]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(files / 'report.csv', newline='') as f:
+            written = list(csv.reader(f, delimiter='\t'))
+        assert sorted(written) == sorted(rows)
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from udata.core.dataset.factories import DatasetFactory
+from udata.core.dataset.models import HarvestDatasetMetadata
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.models import Dataset
+
+from udata_front.harvesters.tools import datasets as module
+from udata_front.harvesters.tools.datasets import CONTENT_HASH, DatasetIndex
+from udata_front.tests import GouvFrSettings
+
+
+def harvested(source, remote_id, **kwargs):
+    return DatasetFactory(harvest=HarvestDatasetMetadata(
+        remote_id=remote_id, source_id=str(source.id), domain=source.domain,
+    ), **kwargs)
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    '''The ids requested by each `load()` query'''
+    queries = []
+
+    class CountingDataset(object):
+        _get_collection = Dataset._get_collection
+
+        @staticmethod
+        def objects(**kwargs):
+            queries.append(kwargs['id__in'])
+            return Dataset.objects(**kwargs)
+
+    monkeypatch.setattr(module, 'Dataset', CountingDataset)
+    return queries
+
+
+@pytest.mark.usefixtures('clean_db')
+class DatasetIndexTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_index_source_datasets(self):
+        source = HarvestSourceFactory(url='https://remote.test/')
+        dataset = harvested(source, 'a', extras={CONTENT_HASH: 'hash'})
+        harvested(HarvestSourceFactory(url='https://other.test/'), 'b')
+
+        index = DatasetIndex(source)
+
+        assert index.get('a') == {
+            'id': dataset.id,
+            'content_hash': 'hash',
+            'last_modified': None,
+            'archived': None,
+        }
+        assert index.get('b') is None
+
+    def test_index_by_domain(self):
+        source = HarvestSourceFactory()
+        dataset = DatasetFactory(harvest=HarvestDatasetMetadata(remote_id='a',
+                                                                domain=source.domain))
+
+        assert DatasetIndex(source).get('a')['id'] == dataset.id
+
+    def test_entries_are_loaded_once(self, monkeypatch):
+        source = HarvestSourceFactory()
+        harvested(source, 'a')
+        index = DatasetIndex(source)
+        calls = []
+        load_entries = index.load_entries
+        monkeypatch.setattr(index, 'load_entries', lambda: calls.append(1) or load_entries())
+
+        index.get('a')
+        index.get('b')
+
+        assert len(calls) == 1
+
+    def test_add(self):
+        source = HarvestSourceFactory()
+        index = DatasetIndex(source)
+        dataset = harvested(source, 'a', extras={CONTENT_HASH: 'hash'})
+
+        index.add('a', dataset)
+        index.add('unsaved', Dataset())
+
+        assert index.get('a')['content_hash'] == 'hash'
+        assert index.get('unsaved') is None
+
+    def test_load(self, queries):
+        source = HarvestSourceFactory()
+        dataset = harvested(source, 'a')
+        index = DatasetIndex(source)
+
+        assert index.load(index.get('a')['id']) == dataset
+        assert queries == [[dataset.id]]
+
+    def test_load_deleted_dataset(self):
+        source = HarvestSourceFactory()
+        dataset = harvested(source, 'a')
+        index = DatasetIndex(source)
+        # Deleted after being indexed
+        index.get('a')
+        Dataset.objects(id=dataset.id).delete()
+
+        assert index.load(dataset.id) is None
+
+    def test_coalesce_concurrent_loads(self, queries):
+        source = HarvestSourceFactory()
+        datasets = [harvested(source, str(i)) for i in range(5)]
+        index = DatasetIndex(source)
+        results = {}
+
+        def load(dataset):
+            results[dataset.id] = index.load(dataset.id)
+
+        # Block the queries until every thread asked for its dataset
+        with index._query_lock:
+            threads = [threading.Thread(target=load, args=(d,)) for d in datasets]
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while len(index._wanted) < len(datasets) and time.monotonic() < deadline:
+                time.sleep(.01)
+        for thread in threads:
+            thread.join(5)
+
+        assert len(queries) == 1
+        assert sorted(queries[0]) == sorted(d.id for d in datasets)
+        assert results == dict((d.id, d) for d in datasets)
+        assert index._loaded == {}
+
+    def test_load_by_batches(self, monkeypatch, queries):
+        monkeypatch.setattr(module, 'LOAD_BATCH_SIZE', 2)
+        source = HarvestSourceFactory()
+        datasets = [harvested(source, str(i)) for i in range(3)]
+        index = DatasetIndex(source)
+        index._wanted.update(d.id for d in datasets[1:])
+
+        assert index.load(datasets[0].id) == datasets[0]
+
+        assert len(queries[0]) == 2
+        assert len(index._wanted) == 1
@@ -0,0 +1,61 @@
+import io
+import json
+
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters.dgt import DGTBackend, iter_metadata
+from udata_front.harvesters.tools.benchmark import SyntheticCatalog
+from udata_front.tests import GouvFrSettings
+
+SEARCH_URL = 'https://dgt.test/geonetwork/srv/por/q'
+
+
+def stream(data):
+    return io.BytesIO(json.dumps(data).encode('utf-8'))
+
+
+class IterMetadataTest:
+    def test_list(self):
+        records = [{'title': 'a', 'geonet:info': {'uuid': '1'}}, {'title': 'b', 'score': 1.5}]
+
+        assert list(iter_metadata(stream({'summary': {'count': 2}, 'metadata': records}))) == records
+
+    def test_single_object(self):
+        record = {'title': 'a', 'keyword': ['x', 'y']}
+
+        assert list(iter_metadata(stream({'metadata': record}))) == [record]
+
+    def test_no_result(self):
+        assert list(iter_metadata(stream({'summary': {'count': 0}}))) == []
+
+
+@pytest.mark.usefixtures('clean_db')
+class DGTListingTest:
+    settings = GouvFrSettings
+    modules = []
+
+    catalog = SyntheticCatalog(2)
+
+    def test_list_modified_since(self, rmock):
+        source = HarvestSourceFactory(backend='dgt', url=SEARCH_URL + '?_content_type=json&from=1')
+        backend = DGTBackend(source)
+        backend._since = datetime(2026, 1, 2, 3, 4, 5)
+        rmock.get(SEARCH_URL, json={
+            'metadata': [self.catalog.geonetwork_record(i) for i in range(2)],
+        })
+
+        remote_ids = [remote_id for remote_id, _ in backend.iter_datasets()]
+
+        assert remote_ids == [self.catalog.identifier(0), self.catalog.identifier(1)]
+        assert parse_qs(urlsplit(rmock.last_request.url).query) == {
+            '_content_type': ['json'],
+            'from': ['1'],
+            'to': ['100'],
+            'dateFrom': ['2026-01-02'],
+        }
+        assert backend._high_water_mark == self.catalog.modified(1)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+from udata_front.harvesters.tools.download import META_EXT, PART_EXT, download
+from udata_front.harvesters.tools.http import HarvestHTTPClient
+
+URL = 'https://remote.test/files/data.csv'
+CONTENT = b'0123456789' * 100
+
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def head(rmock, etag='"v1"', size=len(CONTENT)):
+    rmock.head(URL, headers={'ETag': etag, 'Content-Length': str(size)})
+
+
+class DownloadTest:
+    def test_download(self, tmp_path, rmock):
+        head(rmock)
+        rmock.get(URL, content=CONTENT, headers={'ETag': '"v1"'})
+        path = str(tmp_path / 'data.csv')
+
+        result = download(HarvestHTTPClient(retries=0), URL, path, chunk_size=64)
+
+        assert result.size == len(CONTENT)
+        assert result.checksum == sha256(CONTENT)
+        assert not result.skipped
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
+        assert not (tmp_path / ('data.csv' + PART_EXT)).exists()
+        meta = json.loads((tmp_path / ('data.csv' + META_EXT)).read_text())
+        assert meta['etag'] == '"v1"'
+        assert meta['checksum'] == sha256(CONTENT)
+
+    def test_skip_up_to_date_files(self, tmp_path, rmock):
+        head(rmock)
+        rmock.get(URL, content=CONTENT, headers={'ETag': '"v1"'})
+        path = str(tmp_path / 'data.csv')
+        client = HarvestHTTPClient(retries=0)
+        download(client, URL, path)
+
+        result = download(client, URL, path)
+
+        assert result.skipped
+        assert result.checksum == sha256(CONTENT)
+        assert [r.method for r in rmock.request_history] == ['HEAD', 'GET', 'HEAD']
+
+    def test_download_changed_files(self, tmp_path, rmock):
+        head(rmock)
+        rmock.get(URL, content=CONTENT, headers={'ETag': '"v1"'})
+        path = str(tmp_path / 'data.csv')
+        client = HarvestHTTPClient(retries=0)
+        download(client, URL, path)
+        head(rmock, etag='"v2"', size=3)
+        rmock.get(URL, content=b'new', headers={'ETag': '"v2"'})
+
+        result = download(client, URL, path)
+
+        assert not result.skipped
+        assert (tmp_path / 'data.csv').read_bytes() == b'new'
+
+    def test_resume_partial_download(self, tmp_path, rmock):
+        head(rmock)
+        rmock.get(URL, status_code=206, content=CONTENT[300:], headers={'ETag': '"v1"'})
+        path = str(tmp_path / 'data.csv')
+        (tmp_path / ('data.csv' + PART_EXT)).write_bytes(CONTENT[:300])
+        (tmp_path / ('data.csv' + META_EXT)).write_text(json.dumps({'partial_etag': '"v1"'}))
+
+        result = download(HarvestHTTPClient(retries=0), URL, path)
+
+        request = rmock.request_history[-1]
+        assert request.headers['Range'] == 'bytes=300-'
+        assert request.headers['If-Range'] == '"v1"'
+        assert result.size == len(CONTENT)
+        assert result.checksum == sha256(CONTENT)
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
+
+    def test_restart_partial_download_of_another_file(self, tmp_path, rmock):
+        head(rmock, etag='"v2"')
+        rmock.get(URL, content=CONTENT, headers={'ETag': '"v2"'})
+        path = str(tmp_path / 'data.csv')
+        (tmp_path / ('data.csv' + PART_EXT)).write_bytes(b'old content')
+        (tmp_path / ('data.csv' + META_EXT)).write_text(json.dumps({'partial_etag': '"v1"'}))
+
+        result = download(HarvestHTTPClient(retries=0), URL, path)
+
+        assert 'Range' not in rmock.request_history[-1].headers
+        assert result.checksum == sha256(CONTENT)
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
+
+    def test_finish_complete_partial_download(self, tmp_path, rmock):
+        head(rmock)
+        path = str(tmp_path / 'data.csv')
+        (tmp_path / ('data.csv' + PART_EXT)).write_bytes(CONTENT)
+        (tmp_path / ('data.csv' + META_EXT)).write_text(json.dumps({'partial_etag': '"v1"'}))
+        client = HarvestHTTPClient(retries=0)
+
+        result = download(client, URL, path)
+
+        assert [r.method for r in rmock.request_history] == ['HEAD']
+        assert result.size == len(CONTENT)
+        assert result.checksum == sha256(CONTENT)
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
+        assert not (tmp_path / ('data.csv' + PART_EXT)).exists()
+        # Up to date on the next run
+        assert download(client, URL, path).skipped
+
+    def test_restart_unsatisfiable_range(self, tmp_path, rmock):
+        # No size advertised: the complete partial file is only detected by the server
+        rmock.head(URL, headers={'ETag': '"v1"'})
+        rmock.get(URL, [
+            {'status_code': 416},
+            {'content': CONTENT, 'headers': {'ETag': '"v1"'}},
+        ])
+        path = str(tmp_path / 'data.csv')
+        (tmp_path / ('data.csv' + PART_EXT)).write_bytes(CONTENT)
+        (tmp_path / ('data.csv' + META_EXT)).write_text(json.dumps({'partial_etag': '"v1"'}))
+
+        result = download(HarvestHTTPClient(retries=0), URL, path)
+
+        assert rmock.request_history[1].headers['Range'] == 'bytes={0}-'.format(len(CONTENT))
+        assert 'Range' not in rmock.request_history[2].headers
+        assert result.checksum == sha256(CONTENT)
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
+
+    def test_restart_partial_download_larger_than_the_remote_file(self, tmp_path, rmock):
+        head(rmock)
+        rmock.get(URL, content=CONTENT, headers={'ETag': '"v1"'})
+        path = str(tmp_path / 'data.csv')
+        (tmp_path / ('data.csv' + PART_EXT)).write_bytes(CONTENT + b'garbage')
+        (tmp_path / ('data.csv' + META_EXT)).write_text(json.dumps({'partial_etag': '"v1"'}))
+
+        result = download(HarvestHTTPClient(retries=0), URL, path)
+
+        assert 'Range' not in rmock.request_history[-1].headers
+        assert (tmp_path / 'data.csv').read_bytes() == CONTENT
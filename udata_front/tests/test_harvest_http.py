@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from requests import RequestException, Response
+from requests.structures import CaseInsensitiveDict
+
+from udata_front.harvesters.tools.http import HarvestHTTPClient
+from udata_front.harvesters.tools.http_cache import BODY_EXT, HTTPCache
+
+URL = 'https://remote.test/api/datasets'
+
+
+def response(content=b'data', status_code=200, **headers):
+    response = Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HTTPCache(str(tmp_path), 1024)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    '''Reply with the next scripted response, the last one being repeated'''
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        scripted = self.server.responses
+        response = scripted.pop(0) if len(scripted) > 1 else scripted[0]
+        self.server.requests.append(self.path)
+        time.sleep(response.get('delay', 0))
+        body = response.get('body', b'')
+        try:
+            self.send_response(response.get('status', 200))
+            for name, value in response.get('headers', {}).items():
+                self.send_header(name, value)
+            if response.get('chunked'):
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for start in range(0, len(body), 1000):
+                    chunk = body[start:start + 1000]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        except ConnectionError:
+            # The client timed out
+            pass
+
+
+@pytest.fixture
+def server():
+    '''A local server: urllib3 retries are not run by mocked responses'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    server.daemon_threads = True
+    server.responses = [{}]
+    server.requests = []
+    server.url = 'http://127.0.0.1:{0}/api'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class HTTPCacheTest:
+    def test_store_and_get(self, cache):
+        cache.store(URL, response(b'data', ETag='"v1"', **{'Content-Type': 'application/json'}))
+
+        entry = cache.get(URL)
+        assert entry.read() == b'data'
+        assert entry.size == 4
+        assert entry.conditional_headers() == {'If-None-Match': '"v1"'}
+        assert entry.meta['headers'] == {'content-type': 'application/json', 'etag': '"v1"'}
+
+    def test_last_modified(self, cache):
+        date = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        cache.store(URL, response(**{'Last-Modified': date}))
+
+        assert cache.get(URL).conditional_headers() == {'If-Modified-Since': date}
+
+    def test_do_not_store_unrevalidable_responses(self, cache):
+        cache.store(URL, response())
+        cache.store(URL + '?error', response(status_code=500, ETag='"v1"'))
+        cache.store(URL + '?large', response(b'x' * 2048, ETag='"v1"'))
+
+        assert cache.get(URL) is None
+        assert cache.get(URL + '?error') is None
+        assert cache.get(URL + '?large') is None
+        assert cache.size == 0
+
+    def test_url_for_sorts_sets(self):
+        assert (HTTPCache.url_for(URL, {'tags': {'b', 'a'}})
+                == HTTPCache.url_for(URL, {'tags': ['a', 'b']}))
+
+    def test_evict_least_recently_used(self, tmp_path):
+        cache = HTTPCache(str(tmp_path), 2048)
+        for index in range(3):
+            cache.store('{0}?page={1}'.format(URL, index), response(b'x' * 400, ETag='"v1"'))
+            # Distinct and increasing usage dates
+            path = cache.get('{0}?page={1}'.format(URL, index)).path + BODY_EXT
+            os.utime(path, (index, index))
+        cache.touch(cache.get(URL + '?page=0'))
+
+        assert cache.evict(800) == 1
+
+        assert cache.get(URL + '?page=0')
+        assert cache.get(URL + '?page=1') is None
+        assert cache.get(URL + '?page=2')
+        assert cache.size == 800
+
+    def test_size_is_bounded(self, cache):
+        for index in range(4):
+            cache.store('{0}?page={1}'.format(URL, index), response(b'x' * 400, ETag='"v1"'))
+
+        assert cache.size <= 1024
+
+    def test_purge(self, cache):
+        cache.store(URL, response(ETag='"v1"'))
+        cache.store('https://other.test/', response(ETag='"v1"'))
+
+        assert cache.purge('remote.test') == 1
+
+        assert cache.get(URL) is None
+        assert cache.get('https://other.test/')
+
+
+class HarvestHTTPClientTest:
+    def test_retry_server_errors(self, server):
+        server.responses = [{'status': 503}, {'status': 500}, {'body': b'data'}]
+        client = HarvestHTTPClient(backoff=0)
+
+        response = client.get(server.url)
+
+        assert response.status_code == 200
+        assert response.content == b'data'
+        assert len(server.requests) == 3
+        stats = client.report()[0]
+        assert (stats['requests'], stats['retries'], stats['errors']) == (1, 2, 0)
+
+    def test_retry_too_many_requests(self, server):
+        server.responses = [{'status': 429, 'headers': {'Retry-After': '0'}}, {'body': b'data'}]
+        client = HarvestHTTPClient(backoff=0)
+
+        assert client.get(server.url).status_code == 200
+        assert len(server.requests) == 2
+
+    def test_give_up_after_retries(self, server):
+        server.responses = [{'status': 502}]
+        client = HarvestHTTPClient(retries=2, backoff=0)
+
+        response = client.get(server.url)
+
+        # The last response is returned to be handled by the harvester
+        assert response.status_code == 502
+        assert len(server.requests) == 3
+        stats = client.report()[0]
+        assert (stats['requests'], stats['retries'], stats['errors']) == (1, 2, 1)
+
+    def test_do_not_retry_client_errors(self, server):
+        server.responses = [{'status': 404}]
+        client = HarvestHTTPClient(backoff=0)
+
+        assert client.get(server.url).status_code == 404
+        assert len(server.requests) == 1
+
+    def test_default_timeout(self, rmock):
+        rmock.get(URL)
+        client = HarvestHTTPClient(timeout=(3, 30))
+
+        client.get(URL)
+        assert rmock.last_request.timeout == (3, 30)
+
+        client.get(URL, timeout=5)
+        assert rmock.last_request.timeout == 5
+
+    def test_timeout(self, server):
+        server.responses = [{'delay': .5}]
+        client = HarvestHTTPClient(timeout=(1, .1), retries=0)
+
+        with pytest.raises(RequestException):
+            client.get(server.url)
+
+        stats = client.report()[0]
+        assert (stats['requests'], stats['errors']) == (1, 1)
+
+    def test_count_streamed_bytes(self, server):
+        server.responses = [{'body': b'x' * 3000}]
+        client = HarvestHTTPClient()
+
+        response = client.get(server.url, stream=True)
+        assert client.report()[0]['bytes'] == 0
+
+        assert sum(len(chunk) for chunk in response.iter_content(1024)) == 3000
+        assert client.report()[0]['bytes'] == 3000
+
+    def test_count_raw_reads(self, server):
+        server.responses = [{'body': b'x' * 3000}]
+        client = HarvestHTTPClient()
+
+        response = client.get(server.url, stream=True)
+        response.raw.read(1000)
+        assert client.report()[0]['bytes'] == 1000
+
+        response.raw.read()
+        assert client.report()[0]['bytes'] == 3000
+
+    def test_count_chunked_streams(self, server):
+        server.responses = [{'body': b'x' * 3000, 'chunked': True}]
+        client = HarvestHTTPClient()
+
+        response = client.get(server.url, stream=True)
+
+        assert len(response.content) == 3000
+        assert client.report()[0]['bytes'] == 3000
+
+    def test_stats_per_host(self, rmock):
+        rmock.get(URL, content=b'data')
+        rmock.get('https://other.test/', status_code=404)
+        client = HarvestHTTPClient()
+
+        client.get(URL)
+        client.get(URL)
+        client.get('https://other.test/')
+
+        report = dict((stats.pop('host'), stats) for stats in client.report())
+        assert sorted(report) == ['other.test', 'remote.test']
+        remote, other = report['remote.test'], report['other.test']
+        assert (remote['requests'], remote['errors'], remote['bytes']) == (2, 0, 8)
+        assert (other['requests'], other['errors']) == (1, 1)
+        assert sum(bucket['count'] for bucket in remote['latency']) == 2
+        assert remote['latency'][-1]['le'] is None
+        assert remote['limiter']
+
+    def test_revalidate_cached_responses(self, cache, rmock):
+        rmock.get(URL, [
+            {'content': b'data', 'headers': {'ETag': '"v1"'}},
+            {'status_code': 304, 'headers': {'ETag': '"v1"'}},
+        ])
+        client = HarvestHTTPClient(retries=0, cache=cache)
+
+        first = client.get(URL)
+        second = client.get(URL)
+
+        assert not first.from_cache
+        assert second.from_cache
+        assert second.status_code == 200
+        assert second.content == b'data'
+        assert 'If-None-Match' not in rmock.request_history[0].headers
+        assert rmock.request_history[1].headers['If-None-Match'] == '"v1"'
+        assert client.report()[0]['cached'] == 1
+
+    def test_changed_responses_replace_the_cache(self, cache, rmock):
+        rmock.get(URL, [
+            {'content': b'data', 'headers': {'ETag': '"v1"'}},
+            {'content': b'new data', 'headers': {'ETag': '"v2"'}},
+        ])
+        client = HarvestHTTPClient(retries=0, cache=cache)
+
+        client.get(URL)
+        second = client.get(URL)
+
+        assert not second.from_cache
+        assert second.content == b'new data'
+        assert cache.get(URL).conditional_headers() == {'If-None-Match': '"v2"'}
+
+    def test_uncached_requests(self, cache, rmock):
+        rmock.get(URL, content=b'data', headers={'ETag': '"v1"'})
+        client = HarvestHTTPClient(retries=0, cache=cache)
+
+        client.get(URL, cache=False)
+
+        assert cache.get(URL) is None
@@ -0,0 +1,88 @@
+import io
+
+from xml.dom import minidom
+
+import pytest
+
+from udata.harvest.models import HarvestItem
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters.ine import INEBackend
+from udata_front.tests import GouvFrSettings
+
+CATALOG_URL = 'https://www.ine.pt/ine/xml_indic.jsp?opc=3&lang=PT'
+
+CATALOG = b'''<?xml version="1.0" encoding="UTF-8"?>
+<catalog>
+  <indicator id="0008074"><title>Popula\xc3\xa7\xc3\xa3o residente</title></indicator>
+  <indicator id="0000001"><title>Nados vivos</title></indicator>
+</catalog>
+'''
+
+INDICATOR = b'''<?xml version="1.0" encoding="UTF-8"?>
+<catalog>
+  <indicator id="0008074" lang="PT">
+    <title>Popula\xc3\xa7\xc3\xa3o residente</title>
+    <description>Popula\xc3\xa7\xc3\xa3o residente por local de resid\xc3\xaancia</description>
+    <keywords><![CDATA[Popula\xc3\xa7\xc3\xa3o]]>,<![CDATA[Residentes]]>,<![CDATA[popula\xc3\xa7\xc3\xa3o]]>,</keywords>
+    <html>
+      <bdd_url>https://www.ine.pt/xportal/xmain?xpid=INE&amp;indOcorrCod=0008074</bdd_url>
+    </html>
+    <json>
+      <json_dataset>https://www.ine.pt/ine/json_indicador/pindica.jsp?op=2&amp;varcd=0008074</json_dataset>
+      <json_metainfo>https://www.ine.pt/ine/json_indicador/pindicaMeta.jsp?varcd=0008074</json_metainfo>
+    </json>
+  </indicator>
+</catalog>
+'''
+
+
+def full_tree_mapping(xml):
+    '''The indicator mapping as it was done on a complete minidom tree'''
+    mapped = {'tags': set(), 'resources': []}
+    for indicator in minidom.parseString(xml).getElementsByTagName('indicator'):
+        for node in indicator.childNodes:
+            if not node.firstChild:
+                continue
+            if node.nodeName == 'keywords':
+                for child in node.childNodes:
+                    if child.nodeValue != ',':
+                        mapped['tags'].add(child.nodeValue.rstrip(',').lower())
+            elif node.nodeName in ('title', 'description'):
+                mapped[node.nodeName] = node.firstChild.nodeValue
+            elif node.nodeName == 'html':
+                for child in node.getElementsByTagName('bdd_url'):
+                    mapped['description'] += '\n ' + child.firstChild.nodeValue
+            elif node.nodeName == 'json':
+                for child in node.childNodes:
+                    if child.nodeName in ('json_dataset', 'json_metainfo'):
+                        mapped['resources'].append(child.firstChild.nodeValue)
+    return mapped
+
+
+@pytest.mark.usefixtures('clean_db')
+class INEBackendTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def backend(self):
+        return INEBackend(HarvestSourceFactory(backend='ine', url=CATALOG_URL))
+
+    def test_list_indicators_from_the_streamed_catalog(self, rmock):
+        rmock.get(CATALOG_URL, body=io.BytesIO(CATALOG))
+
+        assert [remote_id for remote_id, _ in self.backend().iter_datasets()] == [
+            '0000001', '0008074'
+        ]
+
+    def test_same_dataset_as_the_full_tree_parse(self, rmock):
+        rmock.get(INEBackend.INDICATOR_URL, content=INDICATOR)
+        expected = full_tree_mapping(INDICATOR)
+
+        dataset = self.backend().inner_process_dataset(HarvestItem(remote_id='0008074'))
+
+        assert dataset.title == expected['title']
+        assert dataset.description == expected['description']
+        assert set(dataset.tags) == expected['tags'] | {'ine.pt'}
+        assert [resource.url for resource in dataset.resources] == expected['resources']
+        assert rmock.last_request.qs['varcd'] == ['0008074']
@@ -0,0 +1,29 @@
+import threading
+
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters import maaf
+from udata_front.harvesters.maaf import MaafBackend
+from udata_front.harvesters.tools.benchmark import SyntheticCatalog
+
+
+class MaafParseXmlTest:
+    def parse(self, backend, xml, results):
+        results.append(backend.parse_xml(xml))
+
+    def test_parse_descriptor_twice(self, app, monkeypatch):
+        '''The first parsing compiles the XSD under the validation lock'''
+        monkeypatch.setattr(maaf, '_xsd', None)
+        backend = MaafBackend(HarvestSourceFactory.build(backend='maaf'))
+        xml = SyntheticCatalog(1).maaf_descriptor(0).encode('utf-8')
+        results = []
+
+        for _ in range(2):
+            thread = threading.Thread(target=self.parse, args=(backend, xml, results))
+            thread.start()
+            thread.join(timeout=10)
+            assert not thread.is_alive(), 'parse_xml() is deadlocked'
+
+        assert len(results) == 2
+        assert results[0] == results[1]
+        assert results[0]['metadata']['id'] == SyntheticCatalog(1).identifier(0)
@@ -0,0 +1,88 @@
+import threading
+
+from udata_front.harvesters.tools.memoize import LRUCache, cache_report, content_key
+
+
+class Compute(object):
+    '''Count the computations of each key'''
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, key):
+        def compute():
+            self.calls.append(key)
+            return key.upper() if key else key
+        return compute
+
+
+class LRUCacheTest:
+    def test_get(self):
+        cache, compute = LRUCache(10), Compute()
+
+        assert cache.get('a', compute('a')) == 'A'
+        assert cache.get('a', compute('a')) == 'A'
+        assert cache.get('b', compute('b')) == 'B'
+
+        assert compute.calls == ['a', 'b']
+        assert cache.report() == {'hits': 1, 'misses': 2, 'ratio': .333}
+
+    def test_none_values_and_keys(self):
+        cache, compute = LRUCache(10), Compute()
+
+        cache.get(None, compute(None))
+
+        assert cache.get(None, compute(None)) is None
+        assert compute.calls == [None]
+
+    def test_evict_least_recently_used(self):
+        cache, compute = LRUCache(2), Compute()
+        cache.get('a', compute('a'))
+        cache.get('b', compute('b'))
+        # `a` becomes the most recently used
+        cache.get('a', compute('a'))
+
+        cache.get('c', compute('c'))
+
+        assert list(cache.values) == ['a', 'c']
+        cache.get('a', compute('a'))
+        cache.get('b', compute('b'))
+        assert compute.calls == ['a', 'b', 'c', 'b']
+
+    def test_disabled(self):
+        cache, compute = LRUCache(0), Compute()
+
+        cache.get('a', compute('a'))
+        cache.get('a', compute('a'))
+
+        assert compute.calls == ['a', 'a']
+        assert cache.values == {}
+        assert cache.report()['misses'] == 2
+
+    def test_compute_outside_of_the_lock(self):
+        cache = LRUCache(10)
+        thread = threading.Thread(
+            target=cache.get, args=('a', lambda: cache.get('b', lambda: 'B') + 'A'))
+
+        thread.start()
+        thread.join(timeout=5)
+
+        assert not thread.is_alive(), 'get() is deadlocked'
+        assert cache.values == {'b': 'B', 'a': 'BA'}
+
+
+class ContentKeyTest:
+    def test_content_key(self):
+        description = 'Descrição ' * 1000
+
+        assert content_key(description) == content_key('Descrição ' * 1000)
+        assert content_key(description) != content_key(description + '.')
+        assert len(content_key(description)) == 40
+
+    def test_empty_values(self):
+        assert content_key('') == ''
+        assert content_key(None) is None
+
+
+class CacheReportTest:
+    def test_no_lookup(self):
+        assert cache_report(0, 0) == {'hits': 0, 'misses': 0, 'ratio': None}
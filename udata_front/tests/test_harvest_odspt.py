@@ -0,0 +1,32 @@
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters.odspt import OdsBackendPT
+from udata_front.harvesters.tools.benchmark import SyntheticCatalog
+from udata_front.tests import GouvFrSettings
+
+SEARCH_URL = 'https://ods.test/api/datasets/1.0/search/'
+
+
+@pytest.mark.usefixtures('clean_db')
+class OdsPTListingTest:
+    settings = GouvFrSettings
+    modules = []
+
+    catalog = SyntheticCatalog(2)
+
+    def test_list_modified_since(self, rmock):
+        backend = OdsBackendPT(HarvestSourceFactory(backend='odspt', url='https://ods.test/'))
+        backend._since = datetime(2026, 1, 2, 3, 4, 5)
+        rmock.get(SEARCH_URL, json={
+            'nhits': 2,
+            'datasets': [self.catalog.ods_dataset(i) for i in range(2)],
+        })
+
+        assert [name for name, _ in backend.iter_datasets()] == ['dataset-0', 'dataset-1']
+        assert parse_qs(urlsplit(rmock.last_request.url).query)['q'] == ['modified>=2026/01/02']
+        assert backend._high_water_mark == self.catalog.modified(1)
@@ -0,0 +1,129 @@
+import pytest
+
+from udata.core.organization.factories import OrganizationFactory
+from udata.models import Organization
+
+from udata_front.harvesters.tools.organizations import CLAIMS_COLLECTION, OrganizationResolver
+from udata_front.tests import GouvFrSettings
+
+
+def claims():
+    return Organization._get_db()[CLAIMS_COLLECTION]
+
+
+@pytest.mark.usefixtures('clean_db')
+class OrganizationResolverTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_get_known_organization(self):
+        org = OrganizationFactory(acronym='AMA')
+        resolver = OrganizationResolver()
+
+        assert resolver.get_or_create('AMA').id == org.id
+        assert Organization.objects.count() == 1
+
+    def test_load_once(self, monkeypatch):
+        OrganizationFactory(acronym='AMA')
+        resolver = OrganizationResolver()
+        calls = []
+        load = resolver.load
+        monkeypatch.setattr(resolver, 'load', lambda: calls.append(1) or load())
+
+        resolver.get('AMA')
+        resolver.get('INE')
+
+        assert len(calls) == 1
+
+    def test_ignore_empty_acronyms(self):
+        OrganizationFactory(acronym='')
+        OrganizationFactory(acronym='')
+
+        assert OrganizationResolver().organizations == {}
+
+    def test_create_missing_organization(self):
+        resolver = OrganizationResolver()
+
+        org = resolver.get_or_create('AMA', name='Agência', description='Modernização')
+
+        assert not org._created
+        assert (org.name, org.description, org.slug) == ('Agência', 'Modernização', 'agencia')
+        assert Organization.objects.get(acronym='AMA').id == org.id
+        assert claims().find_one({'_id': 'AMA'})['organization'] == org.id
+        # Then resolved from memory
+        assert resolver.get_or_create('AMA') is org
+
+    def test_default_name_and_description(self):
+        org = OrganizationResolver().get_or_create('AMA')
+
+        assert (org.name, org.description) == ('AMA', 'AMA')
+
+    def test_reuse_organization_created_since_loaded(self):
+        resolver = OrganizationResolver()
+        resolver.get('AMA')
+        org = OrganizationFactory(acronym='AMA')
+
+        assert resolver.get_or_create('AMA').id == org.id
+        assert Organization.objects.count() == 1
+
+    def test_organization_claimed_by_another_job(self, monkeypatch):
+        other = OrganizationResolver().get_or_create('AMA')
+        resolver = OrganizationResolver()
+        resolver.get('AMA')
+        # As if the other job inserted it after this one looked for it
+        monkeypatch.setattr(resolver, 'find', lambda acronym: None)
+
+        org = resolver.get_or_create('AMA')
+
+        assert org.id == other.id
+        assert [o.id for o in Organization.objects(acronym='AMA')] == [other.id]
+
+    def test_replace_claim_of_deleted_organization(self):
+        deleted = OrganizationResolver().get_or_create('AMA')
+        Organization.objects(id=deleted.id).delete()
+
+        org = OrganizationResolver().get_or_create('AMA')
+
+        assert org.id != deleted.id
+        assert claims().find_one({'_id': 'AMA'})['organization'] == org.id
+
+    def test_flush(self):
+        org = OrganizationFactory(acronym='AMA', name='Old name')
+        other = OrganizationFactory(acronym='INE')
+        resolver = OrganizationResolver()
+        ama, ine = resolver.get('AMA'), resolver.get('INE')
+
+        resolver.increment(ama, 'datasets')
+        resolver.increment(ama, 'datasets', 2)
+        resolver.increment(ine, 'datasets')
+        resolver.update(ama, name='New name')
+        resolver.update(ine, name=ine.name)
+        assert Organization.objects.get(id=org.id).name == 'Old name'
+        resolver.flush()
+
+        org.reload()
+        other.reload()
+        assert org.name == 'New name'
+        assert org.metrics['datasets'] == 3
+        assert other.metrics['datasets'] == 1
+
+        # Nothing left to write
+        resolver.flush()
+        assert Organization.objects.get(id=org.id).metrics['datasets'] == 3
+
+    def test_flush_writes_once(self, monkeypatch):
+        resolver = OrganizationResolver()
+        org = resolver.get_or_create('AMA')
+        resolver.increment(org, 'datasets')
+        resolver.update(org, description='New description')
+        collection = Organization._get_collection()
+        calls = []
+        bulk_write = collection.bulk_write
+        monkeypatch.setattr(collection, 'bulk_write',
+                            lambda operations, **kwargs: calls.append(operations)
+                            or bulk_write(operations, **kwargs))
+
+        resolver.flush()
+
+        assert len(calls) == 1
+        assert len(calls[0]) == 1
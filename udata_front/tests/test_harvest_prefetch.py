@@ -0,0 +1,161 @@
+import threading
+import time
+
+from queue import Empty, Queue
+
+import pytest
+
+from udata_front.harvesters.tools import prefetch as module
+from udata_front.harvesters.tools.prefetch import (
+    crawl, fetch_as_completed, fetch_ordered, prefetch
+)
+
+
+def pages(count, error=None):
+    for index in range(count):
+        yield index
+    if error:
+        raise error
+
+
+class PrefetchTest:
+    def test_values(self):
+        assert list(prefetch(pages(10), 2)) == list(range(10))
+
+    def test_raise_errors(self):
+        values = []
+
+        with pytest.raises(RuntimeError, match='listing error'):
+            for value in prefetch(pages(2, RuntimeError('listing error')), 4):
+                values.append(value)
+
+        assert values == [0, 1]
+
+    def test_read_ahead_is_bounded(self):
+        produced = []
+
+        def values():
+            for index in range(10):
+                produced.append(index)
+                yield index
+
+        iterator = prefetch(values(), 2)
+        assert next(iterator) == 0
+        time.sleep(.3)
+
+        # The next 2 values are queued and one is waiting for a slot
+        assert len(produced) <= 4
+        iterator.close()
+
+    def test_stop_early(self):
+        iterator = prefetch(pages(1000), 2)
+        assert next(iterator) == 0
+
+        iterator.close()
+
+        assert not [t for t in threading.enumerate() if t.name == 'harvest-prefetch']
+
+    def test_drain_after_the_producer_exited(self, monkeypatch):
+        class LateQueue(Queue):
+            '''Times out once, while the producer queues everything and exits'''
+            late = True
+
+            def get(self, block=True, timeout=None):
+                if LateQueue.late:
+                    LateQueue.late = False
+                    time.sleep(.3)
+                    raise Empty
+                return super().get(block, timeout)
+
+        monkeypatch.setattr(module, 'Queue', LateQueue)
+        values = []
+
+        with pytest.raises(RuntimeError, match='listing error'):
+            for value in prefetch(pages(2, RuntimeError('listing error')), 4):
+                values.append(value)
+
+        assert values == [0, 1]
+
+
+class FetchOrderedTest:
+    def test_results_in_order(self):
+        def fetch(offset):
+            # The first pages are the slowest
+            time.sleep((10 - offset) / 100.)
+            return offset
+
+        assert list(fetch_ordered(fetch, range(10), 4)) == list(range(10))
+
+    def test_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(offset):
+            with lock:
+                running.append(offset)
+                peak.append(len(running))
+            time.sleep(.02)
+            with lock:
+                running.remove(offset)
+            return offset
+
+        list(fetch_ordered(fetch, range(20), 3))
+
+        assert max(peak) <= 3
+
+    def test_raise_errors(self):
+        def fetch(offset):
+            if offset == 2:
+                raise ValueError('page error')
+            return offset
+
+        results = []
+        with pytest.raises(ValueError):
+            for result in fetch_ordered(fetch, range(5), 2):
+                results.append(result)
+
+        assert results == [0, 1]
+
+    def test_stop_early(self):
+        fetched = []
+
+        def fetch(offset):
+            fetched.append(offset)
+            return offset
+
+        for result in fetch_ordered(fetch, range(1000), 2):
+            break
+
+        assert len(fetched) <= 4
+
+
+class FetchAsCompletedTest:
+    def test_results(self):
+        def fetch(arg):
+            time.sleep((5 - arg) / 100.)
+            return arg * 2
+
+        results = list(fetch_as_completed(fetch, range(5), 5))
+
+        assert sorted(results) == [(arg, arg * 2) for arg in range(5)]
+        # The fastest calls come first
+        assert results[0] == (4, 8)
+
+
+class CrawlTest:
+    def test_crawl(self):
+        tree = {
+            'root': (['a', 'b'], [1]),
+            'a': (['b', 'c'], [2]),
+            'b': (['root'], [3]),
+            'c': ([], [4, 5]),
+        }
+        visits = []
+
+        def fetch(url):
+            visits.append(url)
+            return tree[url]
+
+        assert sorted(crawl(fetch, ['root'], 2)) == [1, 2, 3, 4, 5]
+        assert sorted(visits) == ['a', 'b', 'c', 'root']
@@ -0,0 +1,113 @@
+import threading
+
+from email.utils import formatdate
+from time import monotonic, time
+from types import SimpleNamespace
+
+from udata_front.harvesters.tools.ratelimit import AdaptiveLimiter, parse_retry_after
+
+
+def response(status_code=200, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers, raw=None)
+
+
+class ParseRetryAfterTest:
+    def test_seconds(self):
+        assert parse_retry_after('120') == 120.
+
+    def test_http_date(self):
+        assert 50 < parse_retry_after(formatdate(time() + 60, usegmt=True)) <= 60
+
+    def test_past_date(self):
+        assert parse_retry_after(formatdate(time() - 60, usegmt=True)) == 0.
+
+    def test_invalid(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after('soon') is None
+
+
+class AdaptiveLimiterTest:
+    def test_rate(self):
+        limiter = AdaptiveLimiter(rate=20, burst=1)
+        start = monotonic()
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(.01, response())
+
+        # The first request uses the burst token, the next ones wait for a refill
+        assert monotonic() - start >= .09
+
+    def test_concurrency_window(self):
+        limiter = AdaptiveLimiter(concurrency=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        assert not acquired.wait(.2)
+
+        limiter.release(.01, response())
+        assert acquired.wait(2)
+        thread.join()
+
+    def test_throttled_halves_limits(self):
+        limiter = AdaptiveLimiter(rate=10, concurrency=8)
+        limiter.acquire()
+
+        limiter.release(.01, response(429))
+
+        assert limiter.as_dict() == {
+            'concurrency': 4,
+            'rate': 5.,
+            'throttled': 1,
+            'waited': limiter.as_dict()['waited'],
+        }
+
+    def test_decrease_once_per_window(self):
+        limiter = AdaptiveLimiter(concurrency=8)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(.01, response(503))
+
+        assert limiter.as_dict()['concurrency'] == 4
+        assert limiter.as_dict()['throttled'] == 3
+
+    def test_retry_after_blocks_requests(self):
+        limiter = AdaptiveLimiter()
+        limiter.acquire()
+        limiter.release(.01, response(429, **{'Retry-After': '0.2'}))
+
+        start = monotonic()
+        limiter.acquire()
+
+        assert monotonic() - start >= .15
+
+    def test_slow_host(self):
+        limiter = AdaptiveLimiter(concurrency=8, latency_factor=3.)
+        limiter.acquire()
+        limiter.release(.1, response())
+
+        limiter.acquire()
+        limiter.release(10., response())
+
+        assert limiter.as_dict()['concurrency'] == 4
+
+    def test_grows_back_up_to_limits(self):
+        limiter = AdaptiveLimiter(rate=10, concurrency=2)
+        limiter.concurrency, limiter.rate = 1., 5.
+        for _ in range(200):
+            limiter.observe(.001)
+
+        assert limiter.as_dict()['concurrency'] == 2
+        assert limiter.as_dict()['rate'] == 10.
+
+    def test_server_errors_are_not_latency_samples(self):
+        limiter = AdaptiveLimiter()
+        limiter.acquire()
+        limiter.release(5., response(500))
+
+        assert limiter.latency is None
@@ -0,0 +1,54 @@
+import pytest
+
+from udata.core.dataset.factories import DatasetFactory
+from udata.core.dataset.models import HarvestDatasetMetadata
+from udata.harvest.models import HarvestItem
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.models import Dataset
+
+from udata_front.harvesters.tools import harvester_utils
+from udata_front.harvesters.tools.harvester_utils import reconcile_missing_datasets
+
+
+def harvested(remote_id):
+    return DatasetFactory(harvest=HarvestDatasetMetadata(domain='test.org', remote_id=remote_id))
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    sent = []
+    monkeypatch.setattr(harvester_utils.send_missing_datasets_warning, 'delay',
+                        lambda source_id, dataset_ids: sent.append(dataset_ids))
+    return sent
+
+
+@pytest.mark.usefixtures('clean_db')
+class ReconcileMissingDatasetsTest:
+    def test_hide_missing_datasets(self, warnings):
+        source = HarvestSourceFactory(url='https://test.org/')
+        listed, skipped, missing = harvested('1'), harvested('2'), harvested('3')
+        items = [
+            HarvestItem(remote_id='1', status='done', dataset=listed),
+            HarvestItem(remote_id='2', status='skipped'),
+        ]
+
+        assert reconcile_missing_datasets(items, source) == [missing.id]
+
+        assert not Dataset.objects.get(id=listed.id).private
+        assert not Dataset.objects.get(id=skipped.id).private
+        assert Dataset.objects.get(id=missing.id).private
+        assert warnings == [[str(missing.id)]]
+
+    def test_do_not_hide_anything_on_failed_items(self, warnings):
+        source = HarvestSourceFactory(url='https://test.org/')
+        listed, failed = harvested('1'), harvested('2')
+        items = [
+            HarvestItem(remote_id='1', status='done', dataset=listed),
+            # ie. a transient package_show error: the remote id is still the package name
+            HarvestItem(remote_id='package-name', status='failed'),
+        ]
+
+        assert reconcile_missing_datasets(items, source) == []
+
+        assert not Dataset.objects.get(id=failed.id).private
+        assert warnings == []
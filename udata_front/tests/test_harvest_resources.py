@@ -0,0 +1,69 @@
+from udata.models import Dataset, Resource
+
+from udata_front.harvesters.tools.resources import ResourceReconciler
+
+
+def dataset(*urls):
+    return Dataset(resources=[Resource(title=url, url=url) for url in urls])
+
+
+class ResourceReconcilerTest:
+    def test_get_existing_resource(self):
+        ds = dataset('https://remote.test/a', 'https://remote.test/b')
+        resources = ResourceReconciler(ds, 'url')
+
+        created, resource = resources.get_or_create('https://remote.test/b')
+
+        assert not created
+        assert resource is ds.resources[1]
+        assert len(ds.resources) == 2
+
+    def test_create_missing_resource(self):
+        ds = dataset('https://remote.test/a')
+        resources = ResourceReconciler(ds, 'url')
+
+        created, resource = resources.get_or_create('https://remote.test/b', title='B',
+                                                    url='https://remote.test/b')
+
+        assert created
+        assert resource.title == 'B'
+        assert ds.resources[-1] is resource
+        # Found again by the same reconciler
+        assert resources.get_or_create('https://remote.test/b') == (False, resource)
+
+    def test_create_from_key_only(self):
+        resources = ResourceReconciler(dataset(), 'url')
+
+        _, resource = resources.get_or_create('https://remote.test/a')
+
+        assert resource.url == 'https://remote.test/a'
+
+    def test_update_keeps_identity(self):
+        ds = dataset('https://remote.test/a')
+        existing = ds.resources[0]
+        resources = ResourceReconciler(ds, 'url')
+
+        resource = resources.update('https://remote.test/a', title='New title', format='csv')
+
+        assert resource is existing
+        assert resource.id == existing.id
+        assert resource.title == 'New title'
+        assert resource.format == 'csv'
+
+    def test_remove_stale(self):
+        ds = dataset('https://remote.test/a', 'https://remote.test/b', 'https://remote.test/c')
+        resources = ResourceReconciler(ds, 'url')
+        resources.get_or_create('https://remote.test/b')
+        resources.get_or_create('https://remote.test/d')
+
+        stale = resources.remove_stale()
+
+        assert [r.url for r in stale] == ['https://remote.test/a', 'https://remote.test/c']
+        assert [r.url for r in ds.resources] == ['https://remote.test/b', 'https://remote.test/d']
+
+    def test_index_by_id(self):
+        ds = dataset('https://remote.test/a')
+        resources = ResourceReconciler(ds)
+
+        assert resources.get_or_create(ds.resources[0].id) == (False, ds.resources[0])
+        assert resources.remove_stale() == []
@@ -0,0 +1,130 @@
+import logging
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from udata.harvest.models import HarvestJob
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_front.harvesters import commands  # noqa: registers the harvest-tools commands
+from udata_front.harvesters.base import STATS
+from udata_front.harvesters.tools.memoize import cache_report
+from udata_front.harvesters.tools.stats import StageStats, merge_reports, percentile
+from udata_front.tests import GouvFrSettings
+
+
+def report(items, stages, caches=None, requests=0, bytes=0):
+    return {'items': items, 'stages': stages, 'caches': caches or {},
+            'requests': requests, 'bytes': bytes, 'duration': 10.,
+            'items_per_second': items / 10.}
+
+
+class StageStatsTest:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert percentile(values, .5) == 50
+        assert percentile(values, .95) == 95
+        assert percentile([3], .95) == 3
+        assert percentile([], .5) is None
+
+    def test_as_dict(self):
+        stats = StageStats()
+        for duration in range(1, 21):
+            stats.add('fetch', duration / 10.)
+        stats.add('parse', .5)
+
+        assert stats.as_dict() == {
+            'fetch': {'count': 20, 'total': 21., 'p50': 1., 'p95': 1.9},
+            'parse': {'count': 1, 'total': .5, 'p50': .5, 'p95': .5},
+        }
+
+    def test_time_nested_stages(self):
+        stats = StageStats()
+
+        with stats.time('map'):
+            with stats.time('fetch'):
+                pass
+        with pytest.raises(ValueError):
+            with stats.time('fetch'):
+                raise ValueError()
+
+        durations = stats.as_dict()
+        assert durations['fetch']['count'] == 2
+        assert durations['map']['count'] == 1
+        # Inclusive durations
+        assert stats.durations['map'][0] >= stats.durations['fetch'][0]
+        assert stats.elapsed > 0
+
+
+class MergeReportsTest:
+    def test_merge(self):
+        merged = merge_reports([
+            report(10, {'fetch': {'count': 10, 'total': 1.5, 'p50': .1, 'p95': .3}},
+                   caches={'html': cache_report(3, 1)}, requests=10, bytes=1000),
+            report(5, {'fetch': {'count': 5, 'total': .5, 'p50': .2, 'p95': .2},
+                       'parse': {'count': 5, 'total': .1, 'p50': .02, 'p95': .03}},
+                   caches={'html': cache_report(1, 3), 'licenses': cache_report(4, 0)},
+                   requests=6, bytes=500),
+        ])
+
+        assert merged == {
+            'items': 15,
+            'requests': 16,
+            'bytes': 1500,
+            'stages': {
+                'fetch': {'count': 15, 'total': 2., 'p50': .2, 'p95': .3},
+                'parse': {'count': 5, 'total': .1, 'p50': .02, 'p95': .03},
+            },
+            'caches': {
+                'html': {'hits': 4, 'misses': 4, 'ratio': .5},
+                'licenses': {'hits': 4, 'misses': 0, 'ratio': 1.},
+            },
+        }
+
+    def test_merge_empty_reports(self):
+        assert merge_reports([{}, {'stages': None}]) == {
+            'stages': {}, 'items': 0, 'requests': 0, 'bytes': 0, 'caches': {},
+        }
+
+
+@pytest.mark.usefixtures('clean_db')
+class StatsCommandTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_display_last_jobs(self, cli, caplog):
+        caplog.set_level(logging.INFO, logger=commands.log.name)
+        source = HarvestSourceFactory()
+        now = datetime.utcnow()
+        HarvestJob.objects.create(source=source, status='done', created=now - timedelta(days=1),
+                                  data={STATS: report(100, {
+                                      'fetch': {'count': 100, 'total': 20., 'p50': .2, 'p95': .4},
+                                  }, requests=100, bytes=2048)})
+        HarvestJob.objects.create(source=source, status='done', created=now,
+                                  data={STATS: report(100, {
+                                      'fetch': {'count': 100, 'total': 10., 'p50': .1, 'p95': .2},
+                                      'parse': {'count': 100, 'total': 1., 'p50': .01, 'p95': .02},
+                                  }, caches={'html': cache_report(90, 10)}, requests=100)})
+        HarvestJob.objects.create(source=source, status='failed', created=now - timedelta(days=2))
+
+        cli('harvest-tools', 'stats', str(source.id))
+
+        messages = [r.getMessage() for r in caplog.records if r.name == commands.__name__]
+        # One line per job with a report, the last one first
+        assert len([m for m in messages if 'items/s' in m]) == 2
+        assert '2.0KB' in [m for m in messages if 'items/s' in m][1]
+        stages = [m for m in messages if ' calls ' in m]
+        assert [m.split()[0] for m in stages] == ['fetch', 'parse']
+        # Compared with the previous job
+        assert stages[0].endswith('-50%')
+        assert any(m.startswith('html cache') for m in messages)
+
+    def test_no_report(self, cli):
+        source = HarvestSourceFactory()
+        HarvestJob.objects.create(source=source, status='done', created=datetime.utcnow())
+
+        result = cli('harvest-tools', 'stats', str(source.id), check=False)
+
+        assert result.exit_code != 0
@@ -0,0 +1,124 @@
+import copy
+import timeit
+
+import pytest
+
+from voluptuous import MultipleInvalid
+
+from udata_front.harvesters.schemas import ckan, dkan
+from udata_front.harvesters.tools.validation import CompiledSchema
+
+
+def ckan_package(resources=50):
+    return {
+        'id': 'package-id',
+        'name': 'package',
+        'title': 'A package',
+        'notes': 'Some   notes\r\nwith line endings',
+        'license_id': None,
+        'license_title': None,
+        'tags': [{'id': 'tag-id', 'name': 'Some Tag'}],
+        'metadata_created': '2020-01-02T10:11:12.123456',
+        'metadata_modified': '2021-03-04T10:11:12.123456',
+        'organization': None,
+        'resources': [{
+            'id': 'resource-{0}'.format(i),
+            'position': i,
+            'name': None,
+            'description': 'A  resource',
+            'format': 'CSV',
+            'mimetype': 'TEXT/CSV',
+            'size': '1024',
+            'hash': '',
+            'created': '2020-01-02T10:11:12.123456',
+            'last_modified': None,
+            'url': 'https://example.com/{0}.csv'.format(i),
+            'resource_type': '',
+            'package_id': 'package-id',
+        } for i in range(resources)],
+        'private': 'false',
+        'type': 'dataset',
+        'author': None,
+        'author_email': '',
+        'maintainer': None,
+        'maintainer_email': 'maintainer@example.com',
+        'state': 'active',
+    }
+
+
+def dkan_package(resources=50):
+    package = ckan_package(resources)
+    package['type'] = 'Dataset'
+    package.pop('organization')
+    for resource in package['resources']:
+        resource.pop('position')
+        resource.pop('resource_type')
+        resource['size'] = '1 KB'
+        resource['created'] = 'Date changed Lun, 02/01/2020 - 10:11'
+    return package
+
+
+def errors(schema, data):
+    with pytest.raises(MultipleInvalid) as excinfo:
+        schema(data)
+    return sorted(str(error) for error in excinfo.value.errors)
+
+
+class CompiledSchemaTest:
+    def test_has_fast_path(self):
+        assert CompiledSchema(ckan.schema).fast is not None
+        assert CompiledSchema(dkan.schema).fast is not None
+
+    @pytest.mark.parametrize('schema,package', [
+        (ckan.schema, ckan_package),
+        (dkan.schema, dkan_package),
+    ])
+    def test_same_output(self, schema, package):
+        compiled = CompiledSchema(schema, pure=(dkan.to_date, dkan.dkan_parse_size))
+
+        assert compiled.fast(package()) == schema(package())
+        assert compiled(package()) == schema(package())
+
+    def test_missing_optional_with_default(self):
+        package = ckan_package()
+        package.pop('extras', None)
+        compiled = CompiledSchema(ckan.schema)
+
+        assert compiled(package)['extras'] == []
+
+    def test_same_errors(self):
+        compiled = CompiledSchema(ckan.schema)
+        package = ckan_package()
+        del package['title']
+        package['type'] = 'not-a-dataset'
+        package['resources'][3]['created'] = 'not a date'
+        package['resources'][4]['resource_type'] = 'unknown'
+
+        assert errors(compiled, copy.deepcopy(package)) == errors(ckan.schema, package)
+
+    def test_nested_dict_falls_back(self):
+        '''Nested dicts in `Any` are not required by voluptuous, the fast path must agree'''
+        compiled = CompiledSchema(ckan.schema)
+        package = ckan_package()
+        package['organization'] = {'id': 'org-id', 'title': 'An organization'}
+
+        assert compiled(copy.deepcopy(package)) == ckan.schema(package)
+
+    def test_valid_packages_skip_the_schema(self):
+        compiled = CompiledSchema(ckan.schema)
+        calls = []
+        compiled.schema = lambda data: calls.append(data) or ckan.schema(data)
+
+        compiled(ckan_package())
+
+        assert calls == []
+
+    def test_faster(self):
+        package = ckan_package(resources=100)
+        compiled = CompiledSchema(ckan.schema)
+
+        # Best of several runs with a generous margin: stable on loaded machines
+        slow = min(timeit.repeat(lambda: ckan.schema(package), number=20, repeat=5))
+        fast = min(timeit.repeat(lambda: compiled(package), number=20, repeat=5))
+
+        assert fast < slow
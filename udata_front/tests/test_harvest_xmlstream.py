@@ -0,0 +1,136 @@
+import io
+
+from xml.dom import minidom
+
+import pytest
+import requests
+
+from lxml import etree
+
+from udata_front.harvesters.tools.xmlstream import (
+    iter_elements, iter_response_elements, localname
+)
+
+URL = 'https://remote.test/catalog.xml'
+
+CATALOG = b'''<?xml version="1.0" encoding="UTF-8"?>
+<catalog>
+  <indicator id="1"><title>One</title></indicator>
+  <!-- A comment -->
+  <group>
+    <indicator id="2"><title>Two</title></indicator>
+  </group>
+  <indicator id="3"><title>Three</title></indicator>
+</catalog>
+'''
+
+# A dados.gov TableMetadata feed, the properties being namespaced
+FEED = b'''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:d="http://schemas.microsoft.com/ado/2007/08/dataservices"
+      xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata">
+  <entry>
+    <content type="application/xml">
+      <m:properties>
+        <d:PartitionKey>dataset</d:PartitionKey>
+        <d:category>Economia</d:category>
+        <d:keywords>impostos, receitas</d:keywords>
+        <d:nameexternal>Receitas fiscais</d:nameexternal>
+        <d:description>Receitas fiscais por ano</d:description>
+        <d:contact></d:contact>
+      </m:properties>
+    </content>
+  </entry>
+</feed>
+'''
+
+
+def ids(elements):
+    return [element.get('id') for element in elements]
+
+
+class LocalnameTest:
+    def test_localname(self):
+        root = etree.fromstring(FEED)
+        properties = root.find('.//{*}properties')
+
+        assert localname(root) == 'feed'
+        assert [localname(p) for p in properties][:2] == ['PartitionKey', 'category']
+
+    def test_comments_have_no_localname(self):
+        root = etree.fromstring(CATALOG)
+
+        assert localname(next(root.iter(etree.Comment))) is None
+
+
+class IterElementsTest:
+    def test_bytes(self):
+        assert ids(iter_elements(CATALOG, 'indicator')) == ['1', '2', '3']
+
+    def test_file(self):
+        assert ids(iter_elements(io.BytesIO(CATALOG), 'indicator')) == ['1', '2', '3']
+
+    def test_any_namespace(self):
+        properties = list(iter_elements(FEED, 'properties'))
+
+        assert len(properties) == 1
+
+    def test_same_values_as_a_full_tree_parse(self):
+        doc = minidom.parseString(FEED)
+        expected = [
+            (node.localName, node.firstChild.nodeValue if node.firstChild else None)
+            for node in doc.getElementsByTagNameNS('*', 'properties')[0].childNodes
+            if node.nodeType == node.ELEMENT_NODE
+        ]
+
+        properties = next(iter_elements(FEED, 'properties'))
+
+        assert [(localname(p), p.text) for p in properties] == expected
+
+    def test_elements_are_cleared_once_consumed(self):
+        elements = []
+        for element in iter_elements(CATALOG, 'indicator'):
+            # The element is complete while it is consumed
+            assert element.findtext('title')
+            elements.append(element)
+
+        assert [len(element) for element in elements] == [0, 0, 0]
+        assert ids(elements) == [None, None, None]
+        # Removed from the tree along with the other processed siblings
+        assert elements[0].getparent() is None
+
+    def test_memory_is_bounded(self):
+        document = b'<catalog>%s</catalog>' % b''.join(
+            b'<indicator id="%d"><title>Title</title></indicator>' % i for i in range(10000))
+        sizes = []
+
+        for element in iter_elements(document, 'indicator'):
+            sizes.append(len(element.getparent()))
+
+        # Only the elements parsed ahead of the consumer are in the tree
+        assert max(sizes) < 1000
+
+    def test_stop_early(self):
+        iterator = iter_elements(CATALOG, 'indicator')
+
+        assert next(iterator).get('id') == '1'
+        iterator.close()
+
+    def test_invalid_document(self):
+        with pytest.raises(etree.XMLSyntaxError):
+            list(iter_elements(b'<catalog><indicator id="1"></catalog>', 'indicator'))
+
+
+class IterResponseElementsTest:
+    def test_streamed_response(self, rmock):
+        rmock.get(URL, body=io.BytesIO(CATALOG))
+        response = requests.get(URL, stream=True)
+
+        assert ids(iter_response_elements(response, 'indicator')) == ['1', '2', '3']
+        assert response.raw.closed
+
+    def test_http_error(self, rmock):
+        rmock.get(URL, status_code=500)
+
+        with pytest.raises(requests.HTTPError):
+            list(iter_response_elements(requests.get(URL, stream=True), 'indicator'))